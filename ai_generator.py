@@ -1,12 +1,15 @@
 import os
 import time
-import requests
 from PIL import Image
 import io
 import base64
 import logging
 import settings
-from huggingface_hub import InferenceClient # Official Library
+import photo_store
+import shuffle_deck
+import data_api
+import resilience
+import memory_budget
 
 try:
     from utils.logger import log_debug
@@ -17,9 +20,10 @@ logger = logging.getLogger(__name__)
 
 # --- Models ---
 TEXT2IMG_MODEL = "black-forest-labs/FLUX.1-schnell" # Best Free T2I
+AI_DEADLINE = 150 # Seconds for one generate_image() (translation, auth, generation, retries)
 
 
-def _get_hf_client():
+def _get_hf_client(timeout=30):
     config = settings.load_config()
     api_key = config.get('api_key_hf') # Use proper HF key
     if not api_key: api_key = config.get('api_key_ai') # Fallback
@@ -27,11 +31,14 @@ def _get_hf_client():
     if not api_key:
         logger.error("❌ HF API Key가 없습니다.")
         return None
+    # Imported on first use: huggingface_hub pulls in ~30 MB of modules the web app rarely needs
+    from huggingface_hub import InferenceClient # Official Library
     # User Request: Timeout 30s
-    return InferenceClient(token=api_key, timeout=30)
+    return InferenceClient(token=api_key, timeout=timeout)
 
-def generate_image(prompt, style_preset, provider="huggingface", image_filenames=None):
+def generate_image(prompt, style_preset, provider="huggingface", image_filenames=None, deadline=None):
     config = settings.load_config()
+    deadline = resilience.Deadline.of(deadline if deadline is not None else AI_DEADLINE)
     
     # 0. Common Pre-processing (Translation & Style Mapping)
     # 0. Common Pre-processing (Translation & Style Mapping)
@@ -74,28 +81,33 @@ def generate_image(prompt, style_preset, provider="huggingface", image_filenames
             image_paths = []
             if image_filenames:
                  # Check if it's a list (new method) or single string (legacy safe)
-                if isinstance(image_filenames, list):
-                    image_paths = [os.path.join(settings.UPLOADS_DIR, f) for f in image_filenames]
-                else:
-                    image_paths = [os.path.join(settings.UPLOADS_DIR, image_filenames)]
+                if not isinstance(image_filenames, list):
+                    image_filenames = [image_filenames]
+                image_paths = [p for p in (photo_store.resolve(f) for f in image_filenames) if p]
                 
-            return _gen_gemini_flash(full_prompt, api_key, image_paths)
+            return _gen_gemini_flash(full_prompt, api_key, image_paths, deadline=deadline)
+        except memory_budget.MemoryBusy:
+            raise # Reported as 503 by the route
         except Exception as e:
             logger.error(f"Google Gen Failed: {e}")
             return None
 
     # 2. Hugging Face (Official Client)
     elif provider == "huggingface":
-        client = _get_hf_client()
-        if not client: return None
+        if not _get_hf_client(): return None
 
         try:
             log_debug(f"AI Gen Start: HuggingFace ({TEXT2IMG_MODEL})")
             t0 = time.time()
-            image = client.text_to_image(prompt=full_prompt, model=TEXT2IMG_MODEL)
+            image = resilience.call(
+                'huggingface',
+                lambda timeout: _get_hf_client(timeout).text_to_image(prompt=full_prompt, model=TEXT2IMG_MODEL),
+                deadline, attempts=2, timeout=30)
             dt = time.time() - t0
             log_debug(f"AI Gen Success: {dt:.2f}s")
             return _save_result(image, "hf")
+        except memory_budget.MemoryBusy:
+            raise # Reported as 503 by the route
         except Exception as e:
             logger.error(f"❌ HF Failed: {e}")
             return None
@@ -134,7 +146,7 @@ def _get_token_from_service_account():
         )
         
         # Refresh Token
-        creds.refresh(GoogleAuthRequest())
+        creds.refresh(GoogleAuthRequest(session=data_api.get_session()))
         return creds.token, sa_info.get('project_id')
 
     except ImportError:
@@ -156,7 +168,13 @@ def _get_gcloud_token():
     except:
         return None, None
 
-def _gen_gemini_flash(prompt, _unused_api_key, image_paths=None):
+def _check_vertex(response):
+    if response.status_code != 200:
+        logger.error(f"Vertex AI Failed: {response.status_code}")
+        logger.error(f"Response Body: {response.text}")
+    return resilience.check_response(response)
+
+def _gen_gemini_flash(prompt, _unused_api_key, image_paths=None, deadline=None):
     # Strict Usage: Vertex AI (OAuth2)
     # Model: gemini-2.5-flash-image (Nano Banana)
     
@@ -210,7 +228,13 @@ def _gen_gemini_flash(prompt, _unused_api_key, image_paths=None):
     logger.debug(f"URL: {url}")
 
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=60)
+        def post(timeout):
+            response = data_api.get_session().post(url, headers=headers, json=payload, timeout=timeout)
+            data_api.log_connection_reuse("Vertex AI", url)
+            return response
+
+        # Generation is expensive: one retry, and only for network errors / 5xx / 429
+        response = resilience.call('vertex_ai', post, deadline, attempts=2, timeout=60, check=_check_vertex)
         
         if response.status_code == 200:
             res_json = response.json()
@@ -230,11 +254,8 @@ def _gen_gemini_flash(prompt, _unused_api_key, image_paths=None):
             logger.error(f"Generate success but no image data: {res_json}")
             return None
             
-        else:
-            logger.error(f"Vertex AI Failed: {response.status_code}")
-            logger.error(f"Response Body: {response.text}")
-            return None
-            
+    except memory_budget.MemoryBusy:
+        raise # Reported as 503 by the route
     except Exception as e:
         logger.error(f"Vertex AI Exception: {e}")
         return None
@@ -244,6 +265,12 @@ def _gen_dalle3(prompt, api_key):
     return None 
 
 def _save_result(img, prefix):
+    # Only the local decode / resize / save is a heavy job; the remote generation before it
+    # must not hold the slot (uploads and previews would queue behind minutes of network I/O)
+    with memory_budget.job('ai'):
+        return _store_result(img, prefix)
+
+def _store_result(img, prefix):
     # Resize to 800x480 (Fill/Crop)
     target_w, target_h = 800, 480
     
@@ -264,7 +291,9 @@ def _save_result(img, prefix):
     img = img.crop((left, top, left + target_w, top + target_h))
 
     filename = f"ai_{prefix}_{int(time.time())}.png"
-    save_path = os.path.join(settings.UPLOADS_DIR, filename)
-    img.save(save_path)
-    logger.info(f"✅ Saved: {save_path}")
+    save_path = photo_store.temp_path('.png')
+    img.save(save_path, "PNG")
+    filename = photo_store.add_file(filename, save_path)
+    shuffle_deck.insert(filename) # Random position in the undealt part of the deck
+    logger.info(f"✅ Saved: {filename}")
     return filename
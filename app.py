@@ -1,16 +1,27 @@
-from flask import Flask, render_template, request, jsonify, send_file, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_file, make_response, Response
 import os
 import settings
 import hardware
 import ai_generator
-import renderer
+import render_sink
 import data_api
+import live_data
+import stations
+import forecast_store
+import photo_store
+import ingest
+import shuffle_deck
+import http_cache
+import preview_cache
+import import_watcher
+import backup
+import cache_manager
+import memory_budget
 import sqlite3
 import random
 
 import photo_frame
 import threading
-from PIL import Image, ImageCms
 import io
 import datetime
 import time
@@ -30,13 +41,14 @@ except ImportError:
 
 @app.after_request
 def add_header(response):
-    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0, max-age=0'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '-1'
-    return response
+    # Per-route caching policy (no-store unless the route opted into validators / long max-age)
+    return http_cache.apply_policy(response)
 
 hw = hardware.HardwareController()
 
+# Reject oversized request bodies before they are spooled (ingest_settings.max_upload_mb)
+app.config['MAX_CONTENT_LENGTH'] = int(ingest.get_ingest_settings()['max_upload_mb']) * 1024 * 1024
+
 # ... (rest of imports)
 
 # ... (inside upload_file or checks) ...
@@ -51,46 +63,27 @@ def upload_file():
     if file:
         from werkzeug.utils import secure_filename
         filename = secure_filename(file.filename)
-        if not os.path.exists(settings.UPLOADS_DIR):
-            os.makedirs(settings.UPLOADS_DIR)
-            
-        file_path = os.path.join(settings.UPLOADS_DIR, filename)
-        
-        # HEIC Conversion & Color Correction Logic
-        if filename.lower().endswith(('.heic', '.heif')):
-            try:
-                # Save temp
-                file.save(file_path)
-                # Convert
-                img = Image.open(file_path)
-                
-                # Color Profile Correction (P3 -> sRGB)
-                img_corrected = img.copy()
-                
-                if img.info.get('icc_profile'):
-                    try:
-                        f = io.BytesIO(img.info['icc_profile'])
-                        src_profile = ImageCms.ImageCmsProfile(f)
-                        dst_profile = ImageCms.createProfile('sRGB')
-                        img_corrected = ImageCms.profileToProfile(img_corrected, src_profile, dst_profile)
-                    except Exception as e:
-                        print(f"ICC Profile conversion failed: {e}")
-
-                new_filename = os.path.splitext(filename)[0] + ".jpg"
-                new_path = os.path.join(settings.UPLOADS_DIR, new_filename)
-                
-                img_corrected.convert('RGB').save(new_path, "JPEG", quality=95) # Save Good Version
-                
-                # Remove original HEIC
-                os.remove(file_path)
-                filename = new_filename # Return the normal valid file to the UI
-            except Exception as e:
-                print(f"HEIC conversion failed: {e}")
-                return jsonify({'error': 'HEIC conversion failed'}), 500
+
+        # [Streaming Ingest] Decode straight from the request stream (no temp copy of the original).
+        # Duplicates are a name -> hash link; HEIC / wide-gamut / oversized images are
+        # converted at the stored target scale and written once.
+        try:
+            result = ingest.ingest_stream(file.stream, filename)
+        except ingest.IngestError as e:
+            print(f"Upload rejected: {e}")
+            return jsonify({'error': str(e)}), e.status
+        except memory_budget.MemoryBusy as e:
+            return jsonify({'error': str(e)}), 503
+        except Exception as e:
+            print(f"Upload conversion failed: {e}")
+            return jsonify({'error': 'Conversion failed'}), 500
+
+        response = {'success': True, 'filename': result['filename']}
+        if result.get('duplicate'):
+            response['duplicate'] = True
         else:
-            file.save(file_path)
-            
-        return jsonify({'success': True, 'filename': filename}), 200
+            shuffle_deck.insert(result['filename']) # Random position in the undealt part of the deck
+        return jsonify(response), 200
 
 # --- [Routes] ---
 
@@ -100,12 +93,29 @@ def upload_file():
 
 @app.route('/uploads/<path:filename>')
 def serve_upload(filename):
-    return send_file(os.path.join(settings.UPLOADS_DIR, filename))
+    path = photo_store.resolve(filename)
+    if not path:
+        return jsonify({'error': 'File not found'}), 404
+    entry = photo_store.lookup(filename)
+    # Strong ETag = content hash, Last-Modified, 304 and Range handled by send_file
+    return http_cache.send_photo(path, etag=entry['hash'] if entry else None)
+
+@app.route('/thumbs/<path:filename>')
+def serve_thumbnail(filename):
+    try:
+        path, etag = ingest.thumbnail_path(filename, request.args.get('size', ingest.THUMB_SIZE, type=int))
+    except Exception as e:
+        print(f"Thumbnail failed: {e}")
+        return jsonify({'error': 'Thumbnail failed'}), 500
+    if not path:
+        return jsonify({'error': 'File not found'}), 404
+    return http_cache.send_photo(path, etag=etag)
 
 # Serve React Static Files
 @app.route('/assets/<path:path>')
 def send_assets(path):
-    return send_from_directory('my_frame_web/static/assets', path)
+    # Vite emits content-hashed filenames (index-<hash>.js), safe to cache forever
+    return http_cache.send_immutable('my_frame_web/static/assets', path)
 
 # Catch-all for React Router
 @app.route('/', defaults={'path': ''})
@@ -115,15 +125,15 @@ def catch_all(path):
     if path.startswith('api/'):
         return jsonify({'error': 'Not found'}), 404
         
-    return render_template('index.html')
+    return http_cache.send_revalidated(make_response(render_template('index.html')))
 
 @app.route('/index.html') # Legacy redirection
 def index_legacy():
-    return render_template('index.html')
+    return http_cache.send_revalidated(make_response(render_template('index.html')))
 
 @app.route('/settings') # React Router handles this URL now, but initial load needs HTML
 def settings_page():
-    return render_template('index.html')
+    return http_cache.send_revalidated(make_response(render_template('index.html')))
 
 
 @app.route('/api/get_config')
@@ -164,19 +174,22 @@ def api_save_config():
 
     # [Auto-Update Station Name]
     # User Request: "If I change region, station should update automatically"
-    # Logic: Extract the last part of location name (Dong/Eup/Myeon) and use as station_name
+    # Logic: nearest AirKorea station to the location's grid point (stations table).
+    # Without the table yet, fall back to the last part of the location name (Dong/Eup/Myeon).
     if 'location' in data and 'name' in data['location']:
         loc_name = data['location']['name']
         try:
+            stations.ensure_table(current.get('api_key_air', current.get('api_key')))
+            nearest = stations.nearest(int(current['location'].get('nx', 61)), int(current['location'].get('ny', 115)), k=1)
             # Format: "Jeonggi-do Pyeongtaek-si Godeok-dong" -> "Godeok-dong"
-            # This is a heuristic. AirKorea usually matches Dong/Eup/Myeon names.
-            possible_station = loc_name.split()[-1]
+            possible_station = nearest[0][0] if nearest else loc_name.split()[-1]
             current['station_name'] = possible_station
             print(f"Auto-updated station_name to: {possible_station}")
         except:
             pass
 
     settings.save_config(current)
+    preview_cache.invalidate() # Layout / location / keys may have changed
     
     # Trigger Display Refresh in Background ONLY if requested
     # User Requirement: Refresh ONLY when "Save Layout & Transfer" is pressed.
@@ -209,6 +222,13 @@ def api_save_config():
     
     return jsonify({"status": "success"})
 
+# Preview encodings: format -> (render sink factory, mimetype)
+PREVIEW_VARIANTS = {
+    'jpeg': (lambda: render_sink.EncodedImage(), 'image/jpeg'),
+    'webp': (lambda: render_sink.EncodedImage(fmt='WEBP'), 'image/webp'),
+    'eink': (lambda: render_sink.EinkPreview(name='preview'), 'image/png'),
+}
+
 @app.route('/api/preview')
 def get_preview():
     """Generate live preview with real layout settings."""
@@ -228,58 +248,167 @@ def get_preview():
     }
     
     # ... (photo loading)
-    if not os.path.exists(settings.UPLOADS_DIR):
-        os.makedirs(settings.UPLOADS_DIR)
-        
     requested_file = request.args.get('min_filename') # Filename only, no path
-    img_path = None
+    photo_name = requested_file
+    img_path = photo_store.resolve(requested_file) if requested_file else None
     
-    photos = [f for f in os.listdir(settings.UPLOADS_DIR) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-    if requested_file and requested_file in photos:
-        img_path = os.path.join(settings.UPLOADS_DIR, requested_file)
-    elif photos:
-        photos.sort(key=lambda x: os.path.getmtime(os.path.join(settings.UPLOADS_DIR, x)), reverse=True)
-        img_path = os.path.join(settings.UPLOADS_DIR, photos[0])
+    if not img_path:
+        photos = photo_store.list_photos() # Newest first
+        if photos:
+            photo_name = photos[0]
+            img_path = photo_store.resolve(photo_name)
 
     # Get Current Location Name & Keys
     location_name = current_config.get('location', {}).get('name', '')
     
     api_key_kma = current_config.get('api_key_kma')
     api_key_air = current_config.get('api_key_air')
+    loc = current_config.get('location', {})
+    nx = int(loc.get('nx', 61))
+    ny = int(loc.get('ny', 115))
+    # Nearest AirKorea stations (or the one known to work) for the location
+    station = stations.for_location(nx, ny, current_config.get('station_name'))
     
-    # Defaults (Align with Frame: Start as None)
-    w_data = None
-    d_data = None
-    
-    # Fetch Real Data if keys exist using data_api
-    if api_key_kma:
-        loc = current_config.get('location', {})
-        nx = int(loc.get('nx', 61))
-        ny = int(loc.get('ny', 115))
-        real_w = data_api.get_weather_data(api_key_kma, nx, ny)
+    # [Preview Cache] Weather/dust fetched at most once per minute bucket for previews
+    bucket = preview_cache.minute_bucket()
+    data_key = preview_cache.data_key_for(current_config, live_data.dust_scope(station))
+    memo = preview_cache.get_data(data_key, bucket)
+    if memo:
+        w_data, d_data, version = memo
+    else:
+        # Defaults (Align with Frame: Start as None)
+        w_data = None
+        d_data = None
+        
+        # Fetch Real Data if keys exist (in parallel; last known data if the network is slow)
+        real_w, real_d = live_data.get(api_key_kma, nx, ny, api_key_air, station, config=current_config)
         if real_w: w_data = real_w
-            
-    if api_key_air and location_name:
-        # Simple extraction of station name (last word)
-        station = location_name.split()[-1] 
-        real_d = data_api.get_fine_dust_data(api_key_air, station)
         if real_d: d_data = real_d
-
-    # Render
-    final_img, box_x, box_y, box_w, box_h = renderer.create_composed_image(img_path, w_data, d_data, layout, location_name)
-    
-    import io
-    img_io = io.BytesIO()
-    final_img.save(img_io, 'JPEG', quality=70)
-    img_io.seek(0)
+        version = preview_cache.put_data(data_key, bucket, w_data, d_data)
+
+    # [Validator] Cache key / ETag covers every render input (photo content, layout, data, minute).
+    # A matching If-None-Match skips everything; a cache hit skips the render + JPEG encode.
+    # ?format=jpeg (default) | webp | eink (dithered PNG of what the panel will show)
+    variant = request.args.get('format', 'jpeg').lower()
+    if variant not in PREVIEW_VARIANTS:
+        return jsonify({'error': 'Invalid format'}), 400
+    photo_id = preview_cache.photo_identity(photo_name, img_path)
+    key = preview_cache.make_key(photo_id, layout, location_name, version, bucket, variant)
+    http_cache.set_policy('private-revalidate')
+    if http_cache.is_not_modified(key):
+        return http_cache.not_modified_response(key)
+
+    cached = preview_cache.get(key)
+    if cached:
+        data, meta = cached['data'], cached['meta']
+    else:
+        # Render (queued behind other heavy jobs when the memory budget is tight)
+        try:
+            with memory_budget.job('render'):
+                comp = render_sink.compose(img_path, w_data, d_data, layout, location_name)
+                data = render_sink.render(comp, [PREVIEW_VARIANTS[variant][0]()])['preview']
+        except memory_budget.MemoryBusy as e:
+            return jsonify({'error': str(e)}), 503
+        meta = comp.widget_headers
+        preview_cache.put(key, data, meta, photo_id)
     
-    response = send_file(img_io, mimetype='image/jpeg')
-    response.headers['X-Widget-X'] = str(box_x)
-    response.headers['X-Widget-Y'] = str(box_y)
-    response.headers['X-Widget-Width'] = str(box_w)
-    response.headers['X-Widget-Height'] = str(box_h)
+    response = send_file(io.BytesIO(data), mimetype=PREVIEW_VARIANTS[variant][1], etag=key)
+    for header, value in meta.items():
+        response.headers[header] = str(value)
+    response.headers['X-Preview-Cache'] = 'HIT' if cached else 'MISS'
+    return response
+
+# --- [Photo Metadata Queries] (served from the photo index, no file access) ---
+
+@app.route('/api/photos/query')
+def photos_query():
+    """?from=YYYY-MM-DD&to=YYYY-MM-DD&orientation=portrait|landscape|square"""
+    orientation = request.args.get('orientation')
+    if orientation and orientation not in ('portrait', 'landscape', 'square'):
+        return jsonify({'error': 'Invalid orientation'}), 400
+    return jsonify(photo_store.query(request.args.get('from'), request.args.get('to'), orientation))
+
+@app.route('/api/photos/on_this_day')
+def photos_on_this_day():
+    """?date=MM-DD (default: today). Photos taken on this day in previous years."""
+    today = datetime.date.today()
+    month, day = today.month, today.day
+    exclude_year = today.year
+    if request.args.get('date'):
+        try:
+            month, day = (int(p) for p in request.args['date'].split('-')[-2:])
+            exclude_year = None
+        except ValueError:
+            return jsonify({'error': 'Invalid date (MM-DD)'}), 400
+    return jsonify(photo_store.on_this_day(month, day, exclude_year))
+
+@app.route('/api/photos/meta/<path:filename>')
+def photo_meta(filename):
+    entry = photo_store.lookup(filename)
+    if not entry:
+        return jsonify({'error': 'File not found'}), 404
+    return jsonify(dict(entry['meta'], name=filename, size=entry['size']))
+
+@app.route('/api/import/status')
+def import_status():
+    """Progress of the watched import folder (queued / done / duplicates / failed)."""
+    return jsonify(import_watcher.get_status())
+
+# --- [Backup] Streamed export / restore of photos + index + settings ---
+
+@app.route('/api/backup/export')
+def backup_export():
+    """?format=zip|tar&since=<token>&config=0. The token for the next incremental run is in X-Backup-Token."""
+    fmt = request.args.get('format', 'zip')
+    if fmt not in backup.ARCHIVE_FORMATS:
+        return jsonify({'error': 'Invalid format'}), 400
+    try:
+        since = backup.parse_token(request.args.get('since'))
+    except backup.BackupError as e:
+        return jsonify({'error': str(e)}), 400
+
+    manifest = backup.build_manifest(since)
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M')
+    filename = f"frame-backup-{stamp}{'-incr' if since is not None else ''}.{fmt}"
+    include_config = request.args.get('config', '1') != '0'
+    response = Response(backup.iter_export(manifest, fmt, include_config),
+                        mimetype='application/zip' if fmt == 'zip' else 'application/x-tar')
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['X-Backup-Token'] = str(manifest['token'])
     return response
 
+@app.route('/api/backup/import', methods=['POST'])
+def backup_import():
+    """Raw archive body (ZIP or tar). ?config=0 keeps the current settings."""
+    request.max_content_length = None # Whole libraries exceed the per-upload limit
+    try:
+        result = backup.restore_stream(request.stream, request.args.get('config', '1') != '0')
+    except backup.BackupError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Backup restore failed: {e}")
+        return jsonify({'error': 'Restore failed'}), 500
+    return jsonify(dict(result, success=True))
+
+@app.route('/api/preview_cache')
+def preview_cache_stats():
+    return jsonify(preview_cache.get_stats())
+
+@app.route('/api/cache_stats')
+def cache_stats():
+    """Disk caches per namespace: entries, bytes, quota, hits / misses / evictions."""
+    return jsonify(cache_manager.get_stats())
+
+@app.route('/api/memory_stats')
+def memory_stats():
+    """RSS budget, running / queued heavy jobs and peak memory per job type."""
+    return jsonify(memory_budget.get_stats())
+
+@app.route('/api/fetch_stats')
+def fetch_stats():
+    """Upstream fetches per endpoint: coalesced concurrent calls and circuit breaker states."""
+    return jsonify(data_api.get_fetch_stats())
+
 @app.route('/api/generate_ai', methods=['POST'])
 def api_gen_ai():
     prompt = request.json.get('prompt')
@@ -291,7 +420,10 @@ def api_gen_ai():
         
     provider = settings.load_config().get('ai_provider', 'huggingface')
     
-    filename = ai_generator.generate_image(prompt, style, provider, image_filenames)
+    try:
+        filename = ai_generator.generate_image(prompt, style, provider, image_filenames)
+    except memory_budget.MemoryBusy as e: # Only the local decode / save takes a heavy-job slot
+        return jsonify({"status": "error", "message": str(e)}), 503
     if filename:
         return jsonify({"status": "success", "image": filename})
     else:
@@ -401,11 +533,8 @@ def system_action():
     
 @app.route('/api/list_photos')
 def list_photos():
-    if not os.path.exists(settings.UPLOADS_DIR):
-        return jsonify([])
-    # Sort by modification time (newest first)
-    files = [f for f in os.listdir(settings.UPLOADS_DIR) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-    files.sort(key=lambda x: os.path.getmtime(os.path.join(settings.UPLOADS_DIR, x)), reverse=True)
+    # Newest first (index entries + legacy flat uploads)
+    files = [f for f in photo_store.list_photos() if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
     return jsonify(files)
 
 @app.route('/api/delete_photo', methods=['POST'])
@@ -413,9 +542,9 @@ def delete_photo():
     filename = request.json.get('filename')
     if not filename: return jsonify({'error': 'No filename'}), 400
     
-    path = os.path.join(settings.UPLOADS_DIR, filename)
-    if os.path.exists(path):
-        os.remove(path)
+    photo_id = preview_cache.photo_identity(filename, photo_store.resolve(filename))
+    if photo_store.delete(filename):
+        preview_cache.invalidate(photo_id)
         return jsonify({'status': 'success'})
     else:
         return jsonify({'error': 'File not found'}), 404
@@ -429,15 +558,15 @@ def delete_photos():
     errors = []
     
     for filename in filenames:
-        path = os.path.join(settings.UPLOADS_DIR, filename)
-        if os.path.exists(path):
-            try:
-                os.remove(path)
+        try:
+            photo_id = preview_cache.photo_identity(filename, photo_store.resolve(filename))
+            if photo_store.delete(filename):
+                preview_cache.invalidate(photo_id)
                 deleted_count += 1
-            except Exception as e:
-                errors.append(f"{filename}: {str(e)}")
-        else:
-            errors.append(f"{filename}: Not found")
+            else:
+                errors.append(f"{filename}: Not found")
+        except Exception as e:
+            errors.append(f"{filename}: {str(e)}")
             
     return jsonify({
         'status': 'success', 
@@ -548,7 +677,22 @@ def apply_power_mode_logic():
                         if target_dt < now: target_dt += datetime.timedelta(days=1)
                         final_wake_time = target_dt
                         log_lifecycle_event(f"Night Mode Active ({end_h}h ~ {start_h}h). Sleeping until {final_wake_time}")
-                    
+
+                    # Next wake's frame from the forecast: the wake pushes it before fetching anything
+                    if current_cfg.get('next_frame_settings', {}).get('enabled', True):
+                        log_lifecycle_event(f"Pre-rendering frame for {final_wake_time}")
+                        photo_frame.EInkPhotoFrame().prerender_next(final_wake_time)
+                        now = datetime.datetime.now()
+
+                    # Next wake runs from the stored forecast: it does not need the Wi-Fi radio
+                    if forecast_store.get_forecast_settings(current_cfg)['wifi_off_offline']:
+                        loc = current_cfg.get('location', {})
+                        nx, ny = int(loc.get('nx', 61)), int(loc.get('ny', 115))
+                        candidates = stations.for_location(nx, ny, current_cfg.get('station_name', "고덕"))
+                        offline = forecast_store.can_stay_offline(final_wake_time, nx, ny, candidates, current_cfg)
+                        log_lifecycle_event(f"Wi-Fi radio {'off' if offline else 'on'} for the next wake")
+                        hw.set_wifi_radio(not offline)
+
                     # Calculate minutes
                     diff_seconds = (final_wake_time - now).total_seconds()
                     rtc_minutes = int(diff_seconds / 60)
@@ -587,6 +731,8 @@ def apply_power_mode_logic():
         else:
             print("🛠️ Settings Mode: Stay Awake.")
             log_lifecycle_event("Settings Mode - Staying Awake")
+            if forecast_store.get_forecast_settings(cfg)['wifi_off_offline']:
+                hw.set_wifi_radio(True) # The web UI needs Wi-Fi
             pass
 
     except Exception as e:
@@ -599,5 +745,7 @@ if __name__ == '__main__':
     # Check power management thread (delay slightly to let app start)
     if not os.environ.get("WERKZEUG_RUN_MAIN") == "true": # Run only once (if reloader is on, but here reloader is false)
          threading.Thread(target=check_power_management).start()
+         import_watcher.start() # Watched import folder (inotify, polling fallback)
+         threading.Thread(target=ingest.migrate_legacy_uploads, daemon=True).start()
 
     app.run(host='0.0.0.0', port=8080, debug=True, use_reloader=False)
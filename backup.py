@@ -0,0 +1,327 @@
+import os
+import io
+import json
+import time
+import shutil
+import logging
+import tarfile
+import zipfile
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import settings
+import photo_store
+import ingest
+import shuffle_deck
+import preview_cache
+import import_watcher
+
+try:
+    from utils.logger import log_debug
+except ImportError:
+    log_debug = lambda msg, level='info': None # Fallback
+
+logger = logging.getLogger(__name__)
+
+# --- [Backup Export / Restore] ---
+# Export streams an archive of the library straight into the HTTP response:
+#   manifest.json   names -> hash / added time (the photo index), export token
+#   config.json     settings
+#   blobs/<hash><ext>   one entry per stored blob (names sharing a blob are listed in the manifest)
+#   legacy/<name>       flat uploads that predate the photo store
+# Nothing is staged on the SD card; memory stays at one copy chunk (ZIP) or one photo (tar).
+#
+# Incremental export: every name registered in the photo index gets a monotonic `seq`.
+# The manifest carries the current value as `token`; `since=<token>` exports only newer names.
+#
+# Restore reads the archive from the request stream (tar: fully streaming, ZIP: spooled once
+# because its directory is at the end) and feeds every photo through ingest.ingest_stream on
+# the import worker pool, so dedup / index / thumbnails behave exactly like uploads.
+
+ARCHIVE_FORMATS = ('zip', 'tar')
+MANIFEST_NAME = 'manifest.json'
+CONFIG_NAME = 'config.json'
+COPY_CHUNK = 256 * 1024
+
+
+class BackupError(ValueError):
+    """Archive rejected (unknown format, missing manifest, bad token)."""
+
+
+class _ChunkSink:
+    """Write-only file object for zipfile/tarfile; the generator drains it after each write."""
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        if data:
+            self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return b''.join(chunks)
+
+
+def parse_token(value):
+    if value in (None, ''):
+        return None
+    try:
+        token = int(value)
+    except (TypeError, ValueError):
+        raise BackupError("Invalid export token")
+    if token < 0:
+        raise BackupError("Invalid export token")
+    return token
+
+
+def build_manifest(since=None):
+    """Snapshot of the photo index (names changed after `since` when given)."""
+    data = photo_store.load_index()
+    blobs = {}
+    for name, entry in sorted(data['names'].items(), key=lambda x: x[1].get('seq', 0)):
+        if since is not None and entry.get('seq', 0) <= since:
+            continue
+        blob = data['blobs'].get(entry['hash'])
+        if blob is None:
+            continue
+        item = blobs.setdefault(entry['hash'], {
+            "hash": entry['hash'], "ext": blob.get('ext', ''), "size": blob.get('size'),
+            "file": f"blobs/{entry['hash']}{blob.get('ext', '')}", "names": []})
+        item['names'].append({"name": name, "added": entry.get('added')})
+
+    legacy = []
+    if since is None:
+        for name in photo_store.legacy_files():
+            if name in data['names']: continue
+            path = os.path.join(settings.UPLOADS_DIR, name)
+            try:
+                legacy.append({"name": name, "added": os.path.getmtime(path),
+                               "size": os.path.getsize(path), "file": f"legacy/{name}"})
+            except OSError:
+                pass
+
+    return {"version": 1, "created": datetime.now().isoformat(timespec='seconds'),
+            "token": data.get('seq', 0), "since": since,
+            "photos": list(blobs.values()), "legacy": legacy}
+
+
+def _photo_entries(manifest):
+    for item in manifest['photos']:
+        yield item['file'], photo_store.blob_path(item['hash'], item['ext'])
+    for item in manifest['legacy']:
+        yield item['file'], os.path.join(settings.UPLOADS_DIR, item['name'])
+
+
+def _dos_time(ts=None):
+    return time.localtime(ts or time.time())[:6]
+
+
+def iter_export(manifest, fmt='zip', include_config=True):
+    """Yield the archive bytes chunk by chunk (for a streamed Flask Response)."""
+    if fmt not in ARCHIVE_FORMATS:
+        raise BackupError(f"Unknown archive format: {fmt}")
+    sink = _ChunkSink()
+    members = [(MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False, indent=1).encode('utf-8'))]
+    if include_config:
+        members.append((CONFIG_NAME, json.dumps(settings.load_config(), ensure_ascii=False,
+                                                indent=4).encode('utf-8')))
+    written = 0
+
+    if fmt == 'zip':
+        # Unseekable output -> zipfile writes data descriptors after each entry
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as zf:
+            for arcname, payload in members:
+                zf.writestr(zipfile.ZipInfo(arcname, _dos_time()), payload, zipfile.ZIP_DEFLATED)
+            yield sink.drain()
+            for arcname, path in _photo_entries(manifest):
+                try:
+                    src = open(path, 'rb')
+                except OSError:
+                    logger.warning(f"Backup: skipping missing file {arcname}")
+                    continue
+                with src:
+                    st = os.fstat(src.fileno())
+                    zinfo = zipfile.ZipInfo(arcname, _dos_time(st.st_mtime))
+                    zinfo.file_size = st.st_size # Lets zipfile decide on ZIP64 up front
+                    with zf.open(zinfo, 'w') as dst: # JPEG/PNG are already compressed: store
+                        while True:
+                            chunk = src.read(COPY_CHUNK)
+                            if not chunk: break
+                            dst.write(chunk)
+                            yield sink.drain()
+                written += 1
+        yield sink.drain() # Central directory
+    else:
+        with tarfile.open(fileobj=sink, mode='w|') as tf:
+            for arcname, payload in members:
+                info = tarfile.TarInfo(arcname)
+                info.size, info.mtime = len(payload), time.time()
+                tf.addfile(info, io.BytesIO(payload))
+            yield sink.drain()
+            for arcname, path in _photo_entries(manifest):
+                try:
+                    src = open(path, 'rb')
+                except OSError:
+                    logger.warning(f"Backup: skipping missing file {arcname}")
+                    continue
+                with src:
+                    st = os.fstat(src.fileno())
+                    info = tarfile.TarInfo(arcname)
+                    info.size, info.mtime = st.st_size, st.st_mtime
+                    tf.addfile(info, src)
+                written += 1
+                yield sink.drain()
+        yield sink.drain()
+
+    log_debug(f"BACKUP | Exported {written} files ({fmt}, since={manifest['since']}, token={manifest['token']})")
+
+
+# --- Restore ---
+
+class _PrefixedStream:
+    """Re-attach the bytes consumed for format detection in front of a forward-only stream."""
+    def __init__(self, head, stream):
+        self._head = head
+        self._stream = stream
+
+    def read(self, size=-1):
+        if self._head:
+            if size is None or size < 0:
+                data, self._head = self._head + self._stream.read(), b''
+                return data
+            data, self._head = self._head[:size], self._head[size:]
+            if len(data) < size:
+                data += self._stream.read(size - len(data))
+            return data
+        return self._stream.read(size)
+
+
+def _iter_zip(stream):
+    """ZIP needs its central directory (at the end): spool the body once into the store tmp dir."""
+    spool = photo_store.temp_path('.zip')
+    try:
+        with open(spool, 'wb') as f:
+            shutil.copyfileobj(stream, f, COPY_CHUNK)
+        with zipfile.ZipFile(spool) as zf:
+            for info in zf.infolist():
+                if info.is_dir(): continue
+                with zf.open(info) as member:
+                    yield info.filename, member
+    finally:
+        try: os.remove(spool)
+        except OSError: pass
+
+
+def _iter_tar(stream):
+    with tarfile.open(fileobj=stream, mode='r|*') as tf: # Forward-only (plain or compressed)
+        for info in tf:
+            if not info.isfile(): continue
+            yield info.name, tf.extractfile(info)
+
+
+class _Restore:
+    def __init__(self, restore_config):
+        self.restore_config = restore_config
+        self.manifest = None
+        self.by_file = {}
+        self.stats = {'photos': 0, 'restored': 0, 'duplicates': 0, 'failed': 0, 'config': False}
+        self._lock = threading.Lock()
+        workers = max(1, int(import_watcher.get_import_settings()['workers']))
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='restore')
+        self._slots = threading.BoundedSemaphore(workers * 2) # Caps spooled photos on disk
+
+    def handle(self, arcname, member):
+        if arcname == MANIFEST_NAME:
+            self.manifest = json.load(member)
+            for item in self.manifest.get('photos', []):
+                self.by_file[item['file']] = (item['names'], item['hash'])
+            for item in self.manifest.get('legacy', []):
+                self.by_file[item['file']] = ([{"name": item['name'], "added": item.get('added')}], None)
+            return
+        if self.manifest is None:
+            raise BackupError("Archive has no manifest (not a frame backup)")
+        if arcname == CONFIG_NAME:
+            if self.restore_config:
+                self._restore_config(json.load(member))
+            return
+        target = self.by_file.pop(arcname, None)
+        if target is None:
+            return # Not listed in the manifest
+
+        names, digest = target
+        tmp = photo_store.temp_path(os.path.splitext(arcname)[1])
+        self._slots.acquire()
+        try:
+            with open(tmp, 'wb') as f:
+                shutil.copyfileobj(member, f, COPY_CHUNK)
+        except Exception:
+            self._slots.release()
+            raise
+        self.stats['photos'] += 1
+        self._pool.submit(self._restore_photo, tmp, names, digest)
+
+    def _restore_config(self, restored):
+        current = settings.load_config()
+        current.update(restored)
+        settings.save_config(current)
+        preview_cache.invalidate()
+        self.stats['config'] = True
+
+    def _restore_photo(self, tmp, names, digest):
+        try:
+            new_names = [n['name'] for n in names if not photo_store.lookup(n['name'])]
+            with open(tmp, 'rb') as f:
+                # Original upload hash as dedup key: re-importing the same backup is a no-op
+                result = ingest.ingest_stream(f, names[0]['name'], digest=digest)
+            final_hash = photo_store.lookup(result['filename'])['hash']
+            for extra in names[1:]:
+                photo_store.link(extra['name'], final_hash)
+            for n in names:
+                if n['name'] in new_names and n.get('added'):
+                    photo_store.set_added(n['name'], n['added']) # Keep gallery order
+            if not result.get('duplicate'):
+                shuffle_deck.insert(result['filename'])
+            with self._lock:
+                self.stats['duplicates' if result.get('duplicate') else 'restored'] += 1
+        except Exception as e:
+            logger.warning(f"Restore failed ({names[0]['name']}): {e}")
+            with self._lock:
+                self.stats['failed'] += 1
+        finally:
+            try: os.remove(tmp)
+            except OSError: pass
+            self._slots.release()
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+
+def restore_stream(stream, restore_config=True):
+    """Restore a backup archive (ZIP or tar[.gz]) read from `stream`. Returns counters."""
+    head = stream.read(4)
+    source = _PrefixedStream(head, stream)
+    if head.startswith(b'PK'):
+        entries = _iter_zip(source)
+    else:
+        entries = _iter_tar(source)
+
+    job = _Restore(restore_config)
+    try:
+        for arcname, member in entries:
+            job.handle(arcname, member)
+    except (tarfile.TarError, zipfile.BadZipFile) as e:
+        raise BackupError(f"Unreadable archive: {e}")
+    finally:
+        job.close()
+
+    if job.manifest is None:
+        raise BackupError("Archive has no manifest (not a frame backup)")
+    result = dict(job.stats, missing=len(job.by_file), token=job.manifest.get('token'))
+    log_debug(f"BACKUP | Restored {result['restored']} photos "
+              f"({result['duplicates']} duplicates, {result['failed']} failed, config={result['config']})")
+    return result
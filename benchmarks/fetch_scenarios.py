@@ -0,0 +1,121 @@
+"""
+End-to-end fetch latency of the weather / dust data path under degraded upstream conditions.
+
+    python benchmarks/fetch_scenarios.py                       # every scenario, 5 runs each
+    python benchmarks/fetch_scenarios.py --only slow --repeat 20
+    python benchmarks/fetch_scenarios.py --deadline 15         # shorter gather() budget
+
+Every run is one cold wake: data_api.gather() (3 KMA calls + AirKorea, concurrent, shared deadline)
+against the stand-in server (benchmarks/standin.py) with an empty response cache and fresh
+circuit breakers; 'warm_cache' repeats the call with the cache kept. Reported per scenario:
+  latency   median / p95 / max ms of gather()
+  complete  runs with a full weather dict (temp, sky, POP) / with dust
+  requests  upstream requests per run and the stand-in's outcome tally (ok / error / timeout / xml_error)
+Writes benchmarks/reports/fetch_scenarios.json. Needs requests only; no keys, no network.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import statistics
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import settings
+import cache_manager
+import resilience
+import data_api
+from standin import StandIn, SCENARIOS
+
+REPORT_DIR = os.path.join(BASE_DIR, 'benchmarks', 'reports')
+DUMMY_KEY = 'standin-key'
+NX, NY, STATION = 61, 115, "고덕"
+
+
+def _isolate_cache(tmp_dir):
+    """Response cache (and the config it reads) in a throwaway directory, never the frame's own."""
+    settings.CONFIG_PATH = os.path.join(tmp_dir, 'config.json')
+    settings.CACHE_DB_PATH = os.path.join(tmp_dir, 'cache.db')
+    settings.CACHE_DIR = os.path.join(tmp_dir, 'cache')
+
+
+def _complete(weather):
+    return bool(weather) and all(k in weather for k in ('temp', 'weather_description', 'pop'))
+
+
+def run_scenario(server, name, spec, repeat, deadline, warm=False):
+    server.configure(spec)
+    server.reset_stats()
+    latencies, weather_ok, dust_ok = [], 0, 0
+    for i in range(repeat):
+        if not warm or i == 0:
+            cache_manager.invalidate('api')
+        resilience.reset_breakers() # Every wake is a new process
+        t0 = time.perf_counter()
+        weather, dust = data_api.gather(DUMMY_KEY, NX, NY, DUMMY_KEY, STATION, deadline=deadline)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        weather_ok += _complete(weather)
+        dust_ok += bool(dust)
+
+    outcomes = {}
+    for per in server.stats.values():
+        for outcome, n in per.items():
+            outcomes[outcome] = outcomes.get(outcome, 0) + n
+    ordered = sorted(latencies)
+    return {
+        'scenario': name, 'runs': repeat, 'deadline_s': deadline,
+        'median_ms': statistics.median(latencies),
+        'p95_ms': ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))],
+        'max_ms': ordered[-1],
+        'weather_complete': weather_ok, 'dust_ok': dust_ok,
+        'requests_per_run': sum(outcomes.values()) / repeat,
+        'outcomes': outcomes, 'by_endpoint': server.stats
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch latency under degraded KMA / AirKorea conditions")
+    parser.add_argument('--repeat', type=int, default=5, help="cold wakes per scenario")
+    parser.add_argument('--deadline', type=float, default=data_api.FETCH_DEADLINE, help="gather() deadline (s)")
+    parser.add_argument('--only', help="run scenarios whose name contains this string")
+    parser.add_argument('--seed', type=int, default=48, help="stand-in randomness (error / timeout rolls)")
+    parser.add_argument('--report-dir', default=REPORT_DIR)
+    parser.add_argument('--verbose', action='store_true', help="show data_api / RESILIENCE log lines")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger('debug_network').setLevel(logging.CRITICAL)
+
+    tmp_dir = tempfile.mkdtemp(prefix='fetch_scenarios_')
+    _isolate_cache(tmp_dir)
+    scenarios = [(name, spec, False) for name, spec in SCENARIOS.items()] + [('warm_cache', SCENARIOS['healthy'], True)]
+    results = []
+    with StandIn(seed=args.seed) as server:
+        data_api.API_BASE_URL = server.url
+        print(f"Stand-in on {server.url} (recorded: {sorted(server.recordings) or 'none, synthesized'})")
+        print(f"{'scenario':20s} {'median':>9s} {'p95':>9s} {'max':>9s} {'weather':>8s} {'dust':>6s} {'req/run':>8s}  outcomes")
+        for name, spec, warm in scenarios:
+            if args.only and args.only not in name: continue
+            r = run_scenario(server, name, spec, max(1, args.repeat), args.deadline, warm)
+            results.append(r)
+            print(f"{name:20s} {r['median_ms']:7.0f}ms {r['p95_ms']:7.0f}ms {r['max_ms']:7.0f}ms "
+                  f"{r['weather_complete']:>4d}/{r['runs']:<3d} {r['dust_ok']:>2d}/{r['runs']:<3d} "
+                  f"{r['requests_per_run']:8.1f}  {json.dumps(r['outcomes'])}")
+
+    report = {'created': datetime.now().isoformat(timespec='seconds'), 'repeat': args.repeat,
+              'deadline_s': args.deadline, 'seed': args.seed, 'results': results}
+    os.makedirs(args.report_dir, exist_ok=True)
+    path = os.path.join(args.report_dir, 'fetch_scenarios.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    print(f"\nReport: {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,414 @@
+"""
+Golden-image regression + speed benchmark for the renderer and the panel dither.
+
+    python benchmarks/golden_render.py --update    # (re)record goldens after a reviewed visual change
+    python benchmarks/golden_render.py             # compare against goldens, write report, exit 1 on failure
+
+Every case renders a deterministic input (procedural photo, fixed weather/dust data, fixed clock)
+through renderer.create_composed_image and the render_sink dither, then compares with the golden:
+  rgb             composite RGB           PSNR / SSIM / ΔE*ab (CIE76)
+  dither          full Floyd-Steinberg     same metrics on the low-passed panel colors (what the eye
+  dither_prefetch pre-dithered base layer  integrates), plus the fraction of changed palette indices
+  prefetch_vs_full  fidelity of the prefetched dither vs a full dither of the same frame, both measured
+                  against the RGB composite (no golden needed; the dot patterns legitimately differ
+                  where error diffusion leaves the widgets, so they are not compared pixel by pixel)
+Speed (median render / dither ms) is reported next to the quality numbers.
+Headless: needs Pillow + NumPy only. The goldens in benchmarks/golden/ are committed; they were
+recorded with the bundled font and the Pillow version in golden/environment.json. Re-record them
+(--update) only after a reviewed visual change, and commit them together with that change.
+"""
+import os
+import sys
+import json
+import time
+import html
+import argparse
+import statistics
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import renderer
+import render_sink
+
+GOLDEN_DIR = os.path.join(BASE_DIR, 'benchmarks', 'golden')
+REPORT_DIR = os.path.join(BASE_DIR, 'benchmarks', 'reports')
+FIXED_NOW = datetime(2025, 12, 18, 5, 30)
+
+DEFAULT_TOLERANCES = {
+    "rgb": {"min_psnr": 40.0, "min_ssim": 0.98, "max_de_mean": 1.0, "max_de_p95": 3.0},
+    "dither": {"min_psnr": 30.0, "min_ssim": 0.90, "max_de_mean": 3.0, "max_de_p95": 8.0,
+               "max_index_change": 0.35},
+    # prefetch_vs_full: how much worse the prefetched dither may reproduce the composite than a full one
+    "prefetch": {"max_de_mean_delta": 0.25, "max_de_p95_delta": 1.0, "max_ssim_drop": 0.01},
+}
+DITHER_BLUR = 5 # Box size approximating the viewing-distance low-pass of the dither pattern
+
+# --- Inputs ---
+
+def _photo_gradient(w=1600, h=1000):
+    x = np.linspace(0, 1, w)[None, :, None]
+    y = np.linspace(0, 1, h)[:, None, None]
+    rgb = np.concatenate([x * 255 + 0 * y, y * 255 + 0 * x, (1 - x) * (1 - y) * 255], axis=2)
+    return rgb.astype(np.uint8)
+
+
+def _photo_texture(w=1200, h=900):
+    rng = np.random.default_rng(39)
+    coarse = rng.integers(0, 256, (h // 30, w // 30, 3), dtype=np.uint8)
+    img = Image.fromarray(coarse).resize((w, h), Image.Resampling.BICUBIC)
+    fine = rng.normal(0, 12, (h, w, 3))
+    return np.clip(np.asarray(img, dtype=np.float64) + fine, 0, 255).astype(np.uint8)
+
+
+def _photo_portrait(w=900, h=1400):
+    # Portrait aspect (crop path) with skin-like tones and a dark background
+    yy, xx = np.mgrid[0:h, 0:w]
+    d = np.sqrt(((xx - w / 2) / (w * 0.3)) ** 2 + ((yy - h * 0.45) / (h * 0.3)) ** 2)
+    face = np.clip(1.2 - d, 0, 1)[..., None]
+    skin = np.array([224, 172, 140], dtype=np.float64)
+    bg = np.array([30, 40, 60], dtype=np.float64)
+    return (bg + (skin - bg) * face).astype(np.uint8)
+
+
+def _photo_lines(w=1600, h=960):
+    # High-contrast detail: worst case for dither stability
+    img = np.full((h, w, 3), 255, dtype=np.uint8)
+    for i in range(0, w, 16):
+        img[:, i:i + 2] = (0, 0, 0)
+    for j in range(0, h, 24):
+        img[j:j + 3, :] = (200, 30, 30)
+    return img
+
+
+PHOTOS = {
+    "gradient": _photo_gradient,
+    "texture": _photo_texture,
+    "portrait": _photo_portrait,
+    "lines": _photo_lines,
+}
+
+LAYOUTS = {
+    "type_A": {"type": "type_A"},
+    "type_B": {"type": "type_B", "position": "bottom"},
+    "custom": {"type": "custom", "x": 40, "y": 200, "widget_size": 0.8, "opacity": 0.6},
+    "large": {"type": "type_A", "widget_size": 1.4, "font_scale": 1.2, "opacity": 0.95},
+}
+
+WEATHER_FULL = {"temp": 21.4, "weather_description": "맑음", "current_rain_amount": 0,
+                "max_temp": 25, "pop": 20}
+DATA = {
+    "full": (WEATHER_FULL, {"pm10": 35, "pm25": 12}, None),
+    "no_data": (None, None, None),
+    "rain_low_battery": (dict(WEATHER_FULL, weather_description="비", current_rain_amount=2.5, pop=80,
+                              rain_forecast={"start_time": "15:00", "type_code": 1}),
+                         {"pm10": 120, "pm25": 60}, {"level": 8, "charging": False}),
+}
+
+
+def build_cases():
+    """Every photo with every layout on full data; every data scenario on the gradient."""
+    cases = []
+    for photo in PHOTOS:
+        for layout in LAYOUTS:
+            cases.append((f"{photo}-{layout}-full", photo, layout, "full"))
+    for data in DATA:
+        if data == "full": continue
+        for layout in LAYOUTS:
+            cases.append((f"gradient-{layout}-{data}", "gradient", layout, data))
+    return cases
+
+
+def prepare_inputs(tmp_dir):
+    paths = {}
+    os.makedirs(tmp_dir, exist_ok=True)
+    for name, fn in PHOTOS.items():
+        path = os.path.join(tmp_dir, f"{name}.png")
+        if not os.path.exists(path):
+            Image.fromarray(fn()).save(path)
+        paths[name] = path
+    return paths
+
+
+# --- Metrics (vectorized) ---
+
+def _box_filter(a, size):
+    """Mean over size x size windows ('valid' region) via an integral image."""
+    c = np.cumsum(np.cumsum(np.pad(a, ((1, 0), (1, 0))), axis=0), axis=1)
+    s = c[size:, size:] - c[:-size, size:] - c[size:, :-size] + c[:-size, :-size]
+    return s / float(size * size)
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return 100.0 if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse)) # 100 = identical
+
+
+def ssim(a, b, window=7):
+    """Mean SSIM on luma (box window instead of the Gaussian one; same trend, much cheaper)."""
+    weights = np.array([0.299, 0.587, 0.114])
+    x = a.astype(np.float64) @ weights
+    y = b.astype(np.float64) @ weights
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mx, my = _box_filter(x, window), _box_filter(y, window)
+    sxx = _box_filter(x * x, window) - mx * mx
+    syy = _box_filter(y * y, window) - my * my
+    sxy = _box_filter(x * y, window) - mx * my
+    s = ((2 * mx * my + c1) * (2 * sxy + c2)) / ((mx * mx + my * my + c1) * (sxx + syy + c2))
+    return float(s.mean())
+
+
+def srgb_to_lab(rgb):
+    c = rgb.astype(np.float64) / 255.0
+    c = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    m = np.array([[0.4124564, 0.3575761, 0.1804375],
+                  [0.2126729, 0.7151522, 0.0721750],
+                  [0.0193339, 0.1191920, 0.9503041]])
+    xyz = c @ m.T / np.array([0.95047, 1.0, 1.08883]) # D65 white
+    f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    return np.stack([116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+def delta_e(a, b):
+    return np.linalg.norm(srgb_to_lab(a) - srgb_to_lab(b), axis=-1)
+
+
+def compare(golden, new, kind):
+    """Metrics dict for two images ('RGB' for rgb, 'P' for dither modes)."""
+    result = {}
+    if kind != 'rgb':
+        gi, ni = np.asarray(golden), np.asarray(new)
+        result['index_change'] = float(np.mean(gi != ni))
+        golden, new = golden.convert('RGB'), new.convert('RGB')
+    a, b = np.asarray(golden), np.asarray(new)
+    if kind != 'rgb': # Compare what the eye sees, not the exact dot pattern
+        a = np.stack([_box_filter(a[..., ch].astype(np.float64), DITHER_BLUR) for ch in range(3)], axis=-1)
+        b = np.stack([_box_filter(b[..., ch].astype(np.float64), DITHER_BLUR) for ch in range(3)], axis=-1)
+    de = delta_e(a, b)
+    result.update(psnr=psnr(a, b), ssim=ssim(a, b), de_mean=float(de.mean()),
+                  de_p95=float(np.percentile(de, 95)), de_max=float(de.max()))
+    return result, de
+
+
+def fidelity(source, dithered):
+    """ΔE / SSIM of a dithered frame against its RGB source, both low-passed like compare()."""
+    a, b = (np.stack([_box_filter(np.asarray(img.convert('RGB'))[..., ch].astype(np.float64), DITHER_BLUR)
+                      for ch in range(3)], axis=-1) for img in (source, dithered))
+    de = delta_e(a, b)
+    return {'de_mean': float(de.mean()), 'de_p95': float(np.percentile(de, 95)), 'ssim': ssim(a, b)}
+
+
+def compare_prefetch(rgb, full, prefetched):
+    """Fidelity of both dithers to the composite, and how much the prefetch shortcut loses."""
+    f, p = fidelity(rgb, full), fidelity(rgb, prefetched)
+    return {'full': f, 'prefetch': p, 'de_mean_delta': p['de_mean'] - f['de_mean'],
+            'de_p95_delta': p['de_p95'] - f['de_p95'], 'ssim_drop': f['ssim'] - p['ssim'],
+            'index_change': float(np.mean(np.asarray(full) != np.asarray(prefetched)))}
+
+
+def check_prefetch(metrics, tol):
+    failures = []
+    if metrics['de_mean_delta'] > tol['max_de_mean_delta']:
+        failures.append(f"ΔE mean +{metrics['de_mean_delta']:.2f} > {tol['max_de_mean_delta']}")
+    if metrics['de_p95_delta'] > tol['max_de_p95_delta']:
+        failures.append(f"ΔE p95 +{metrics['de_p95_delta']:.2f} > {tol['max_de_p95_delta']}")
+    if metrics['ssim_drop'] > tol['max_ssim_drop']:
+        failures.append(f"SSIM -{metrics['ssim_drop']:.4f} > {tol['max_ssim_drop']}")
+    return failures
+
+
+def check(metrics, tol):
+    failures = []
+    if metrics['psnr'] < tol['min_psnr']: failures.append(f"PSNR {metrics['psnr']:.2f} < {tol['min_psnr']}")
+    if metrics['ssim'] < tol['min_ssim']: failures.append(f"SSIM {metrics['ssim']:.4f} < {tol['min_ssim']}")
+    if metrics['de_mean'] > tol['max_de_mean']: failures.append(f"ΔE mean {metrics['de_mean']:.2f} > {tol['max_de_mean']}")
+    if metrics['de_p95'] > tol['max_de_p95']: failures.append(f"ΔE p95 {metrics['de_p95']:.2f} > {tol['max_de_p95']}")
+    if 'index_change' in metrics and metrics['index_change'] > tol.get('max_index_change', 1.0):
+        failures.append(f"index change {metrics['index_change']:.3f} > {tol['max_index_change']}")
+    return failures
+
+
+def diff_heatmap(de, size):
+    """ΔE map as an image (black = identical, red = ΔE >= 10)."""
+    v = np.clip(de / 10.0, 0, 1)
+    img = np.zeros(de.shape + (3,), dtype=np.uint8)
+    img[..., 0] = (v * 255).astype(np.uint8)
+    img[..., 1] = (np.clip(v * 2 - 1, 0, 1) * 255).astype(np.uint8)
+    return Image.fromarray(img).resize(size, Image.Resampling.NEAREST)
+
+
+# --- Run ---
+
+def render_case(paths, photo, layout, data, repeat):
+    """Render + dither one case. Returns (outputs by mode, timings in ms)."""
+    weather, dust, batt = DATA[data]
+    base = renderer.load_base_layer(paths[photo])
+    render_ms, dither_ms, prefetch_ms = [], [], []
+    outputs = {}
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        img, bx, by, bw, bh = renderer.create_composed_image(
+            paths[photo], weather, dust, dict(LAYOUTS[layout]), "경기도 평택시 고덕동", batt, now=FIXED_NOW)
+        render_ms.append((time.perf_counter() - t0) * 1000)
+
+        t0 = time.perf_counter()
+        full = render_sink.Composition(img, (bx, by, bw, bh)).quantized()
+        dither_ms.append((time.perf_counter() - t0) * 1000)
+
+        # Prefetched path: the base layer and its indices were prepared before the wake
+        composed, *_ = renderer.create_composed_image(
+            paths[photo], weather, dust, dict(LAYOUTS[layout]), "경기도 평택시 고덕동", batt,
+            base_layer=base, now=FIXED_NOW)
+        base_indices = render_sink.Composition(base, (bx, by, bw, bh)).quantized()
+        t0 = time.perf_counter()
+        pre = render_sink.Composition(composed, (bx, by, bw, bh), base, base_indices).quantized()
+        prefetch_ms.append((time.perf_counter() - t0) * 1000)
+        outputs = {'rgb': img.convert('RGB'), 'dither': full, 'dither_prefetch': pre}
+
+    timing = {'render_ms': statistics.median(render_ms), 'dither_ms': statistics.median(dither_ms),
+              'dither_prefetch_ms': statistics.median(prefetch_ms)}
+    return outputs, timing
+
+
+def _environment():
+    import PIL
+    font = renderer.get_font_path()
+    if font and os.path.abspath(font).startswith(BASE_DIR + os.sep):
+        font = os.path.relpath(font, BASE_DIR) # Bundled font: same on every checkout
+    return {"pillow": PIL.__version__, "numpy": np.__version__, "font": font,
+            "python": sys.version.split()[0]}
+
+
+def write_html(report, path):
+    rows = []
+    for r in report['results']:
+        status = 'PASS' if r['passed'] else 'FAIL'
+        m = r.get('metrics') or {}
+        m = dict(m, **m.get('prefetch', {})) # prefetch_vs_full: the prefetched dither's fidelity
+        imgs = ''.join(f'<a href="{html.escape(p)}"><img src="{html.escape(p)}" width="240"></a>'
+                       for p in r.get('images', []))
+        rows.append(
+            f"<tr class='{status.lower()}'><td>{html.escape(r['case'])}</td><td>{r['mode']}</td>"
+            f"<td>{status}</td><td>{m.get('psnr', float('nan')):.2f}</td><td>{m.get('ssim', float('nan')):.4f}</td>"
+            f"<td>{m.get('de_mean', float('nan')):.2f}</td><td>{m.get('de_p95', float('nan')):.2f}</td>"
+            f"<td>{m.get('index_change', 0):.3f}</td><td>{r['ms']:.1f}</td>"
+            f"<td>{html.escape('; '.join(r['failures']))}</td><td>{imgs}</td></tr>")
+    summary = report['summary']
+    doc = f"""<!doctype html><html><head><meta charset="utf-8"><title>Golden render report</title>
+<style>body{{font-family:sans-serif;font-size:13px}} table{{border-collapse:collapse}}
+td,th{{border:1px solid #ccc;padding:3px 6px;vertical-align:top}} tr.fail{{background:#fdd}}</style></head><body>
+<h2>Golden render report — {html.escape(report['created'])}</h2>
+<p>{summary['passed']} / {summary['total']} passed · render median {summary['render_ms']:.1f} ms ·
+dither median {summary['dither_ms']:.1f} ms · prefetched dither median {summary['dither_prefetch_ms']:.1f} ms</p>
+<p>Environment: {html.escape(json.dumps(report['environment'], ensure_ascii=False))}</p>
+<table><tr><th>case</th><th>mode</th><th>status</th><th>PSNR</th><th>SSIM</th><th>ΔE mean</th><th>ΔE p95</th>
+<th>idx Δ</th><th>ms</th><th>failures</th><th>golden / new / ΔE</th></tr>
+{''.join(rows)}</table></body></html>"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(doc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Golden-image regression for renderer / dither changes")
+    parser.add_argument('--update', action='store_true', help="record the current output as the new goldens")
+    parser.add_argument('--golden-dir', default=GOLDEN_DIR)
+    parser.add_argument('--report-dir', default=REPORT_DIR)
+    parser.add_argument('--tolerances', help="JSON file overriding DEFAULT_TOLERANCES ({'rgb': {...}, 'dither': {...}})")
+    parser.add_argument('--repeat', type=int, default=3, help="renders per case for the timing median")
+    parser.add_argument('--only', help="run cases whose name contains this string")
+    parser.add_argument('--all-images', action='store_true', help="write comparison images for passing cases too")
+    args = parser.parse_args()
+
+    tolerances = json.loads(json.dumps(DEFAULT_TOLERANCES))
+    if args.tolerances:
+        with open(args.tolerances, encoding='utf-8') as f:
+            for kind, values in json.load(f).items():
+                tolerances.setdefault(kind, {}).update(values)
+
+    paths = prepare_inputs(os.path.join(args.report_dir, 'inputs'))
+    os.makedirs(args.golden_dir, exist_ok=True)
+    img_dir = os.path.join(args.report_dir, 'img')
+    os.makedirs(img_dir, exist_ok=True)
+
+    env = _environment()
+    meta_path = os.path.join(args.golden_dir, 'environment.json')
+    if not args.update and os.path.exists(meta_path):
+        with open(meta_path, encoding='utf-8') as f:
+            recorded = json.load(f)
+        if recorded.get('font') != env['font'] or recorded.get('pillow') != env['pillow']:
+            print(f"⚠️ Goldens were recorded with {recorded}, running with {env}: expect text differences")
+
+    results, timings = [], []
+    for case, photo, layout, data in build_cases():
+        if args.only and args.only not in case: continue
+        outputs, timing = render_case(paths, photo, layout, data, max(1, args.repeat))
+        timings.append(timing)
+
+        # The prefetch shortcut must reproduce the frame as faithfully as a full dither of it
+        metrics = compare_prefetch(outputs['rgb'], outputs['dither'], outputs['dither_prefetch'])
+        failures = check_prefetch(metrics, tolerances['prefetch'])
+        results.append({'case': case, 'mode': 'prefetch_vs_full', 'ms': timing['dither_prefetch_ms'],
+                        'passed': not failures, 'metrics': metrics, 'failures': failures, 'images': []})
+        for mode, img in outputs.items():
+            golden_path = os.path.join(args.golden_dir, f"{case}__{mode}.png")
+            ms = timing['render_ms'] if mode == 'rgb' else timing[f"{mode}_ms"]
+            entry = {'case': case, 'mode': mode, 'ms': ms, 'failures': [], 'images': []}
+            if args.update:
+                img.save(golden_path, optimize=True)
+                entry.update(passed=True, metrics=None, updated=True)
+                results.append(entry)
+                continue
+            if not os.path.exists(golden_path):
+                entry.update(passed=False, metrics=None, failures=["no golden (run with --update)"])
+                results.append(entry)
+                continue
+
+            golden = Image.open(golden_path)
+            golden.load()
+            kind = 'rgb' if mode == 'rgb' else 'dither'
+            metrics, de = compare(golden, img, kind)
+            failures = check(metrics, tolerances[kind])
+            entry.update(passed=not failures, metrics=metrics, failures=failures)
+            if failures or args.all_images:
+                stem = f"{case}__{mode}"
+                golden.convert('RGB').save(os.path.join(img_dir, f"{stem}_golden.png"))
+                img.convert('RGB').save(os.path.join(img_dir, f"{stem}_new.png"))
+                diff_heatmap(de, img.size).save(os.path.join(img_dir, f"{stem}_de.png"))
+                entry['images'] = [f"img/{stem}_golden.png", f"img/{stem}_new.png", f"img/{stem}_de.png"]
+            results.append(entry)
+            print(f"{'PASS' if not failures else 'FAIL'} {case:40s} {mode:16s} "
+                  f"PSNR {metrics['psnr']:6.2f} SSIM {metrics['ssim']:.4f} ΔE {metrics['de_mean']:.2f} "
+                  f"{ms:7.1f} ms {'; '.join(failures)}")
+
+    if args.update:
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(env, f, ensure_ascii=False, indent=1)
+        print(f"Recorded {len(results)} goldens in {args.golden_dir}")
+
+    med = lambda key: statistics.median(t[key] for t in timings) if timings else 0.0
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'environment': env,
+        'tolerances': tolerances,
+        'summary': {'total': len(results), 'passed': sum(r['passed'] for r in results),
+                    'render_ms': med('render_ms'), 'dither_ms': med('dither_ms'),
+                    'dither_prefetch_ms': med('dither_prefetch_ms')},
+        'results': results
+    }
+    os.makedirs(args.report_dir, exist_ok=True)
+    with open(os.path.join(args.report_dir, 'golden_report.json'), 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    write_html(report, os.path.join(args.report_dir, 'golden_report.html'))
+
+    s = report['summary']
+    print(f"\n{s['passed']}/{s['total']} passed | render {s['render_ms']:.1f} ms | dither {s['dither_ms']:.1f} ms "
+          f"| prefetched dither {s['dither_prefetch_ms']:.1f} ms | report: {args.report_dir}/golden_report.html")
+    return 0 if s['passed'] == s['total'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,374 @@
+"""
+Local stand-in for the KMA (VilageFcstInfoService_2.0) and AirKorea endpoints, plus a recorder.
+
+    python benchmarks/standin.py serve --port 8089 --scenario slow     # then DATA_API_BASE_URL=http://127.0.0.1:8089
+    python benchmarks/standin.py record --kma-key KEY --air-key KEY    # live responses -> benchmarks/recordings/
+
+Serves getUltraSrtNcst / getUltraSrtFcst / getVilageFcst / getMsrstnAcctoRltmMesureDnsty on the
+same paths as apis.data.go.kr (data_api.KMA_PATH / DUST_PATH), so data_api runs unchanged
+against it. Response bodies are recorded ones (times shifted to the requested base_time / the
+current hour, nx/ny echoed) when a recording exists, synthesized otherwise.
+A behavior (per scenario, overridable per endpoint) degrades the service:
+  latency_ms / jitter_ms   delay before answering (uniform in latency ± jitter)
+  error_rate, error_status HTTP error answers (503 by default)
+  timeout_rate, hang_sec   hold the request past the client timeout, then answer
+  xml_error_rate, xml_code data.go.kr gateway error body (HTTP 200 <OpenAPI_ServiceResponse>)
+Headless, standard library only (the recorder uses data_api's session).
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import data_api
+
+RECORDINGS_DIR = os.path.join(BASE_DIR, 'benchmarks', 'recordings')
+KMA_ENDPOINTS = ('getUltraSrtNcst', 'getUltraSrtFcst', 'getVilageFcst')
+DUST_ENDPOINT = 'getMsrstnAcctoRltmMesureDnsty'
+
+DEFAULT_BEHAVIOR = {
+    "latency_ms": 40, "jitter_ms": 20,
+    "error_rate": 0.0, "error_status": 503,
+    "timeout_rate": 0.0, "hang_sec": 35,
+    "xml_error_rate": 0.0, "xml_code": "22"
+}
+
+# Named degradations: {'default': behavior overrides, 'endpoints': {endpoint: overrides}}
+SCENARIOS = {
+    "healthy": {},
+    "slow": {"default": {"latency_ms": 1500, "jitter_ms": 1000}},
+    "flaky_5xx": {"default": {"error_rate": 0.3}},
+    "timeouts": {"default": {"timeout_rate": 0.2}},
+    "quota_exceeded": {"default": {"xml_error_rate": 1.0, "xml_code": "22"}},
+    "key_not_registered": {"default": {"xml_error_rate": 1.0, "xml_code": "30"}},
+    "vilage_down": {"endpoints": {"getVilageFcst": {"error_rate": 1.0}}},
+    "dust_hangs": {"endpoints": {DUST_ENDPOINT: {"timeout_rate": 1.0}}},
+}
+
+XML_ERRORS = {
+    '1': 'APPLICATION_ERROR', '4': 'HTTP_ERROR', '12': 'NO_OPENAPI_SERVICE_ERROR',
+    '20': 'SERVICE_ACCESS_DENIED_ERROR', '22': 'LIMITED_NUMBER_OF_SERVICE_REQUESTS_EXCEEDS_ERROR',
+    '30': 'SERVICE_KEY_IS_NOT_REGISTERED_ERROR', '31': 'DEADLINE_HAS_EXPIRED_ERROR', '32': 'UNREGISTERED_IP_ERROR'
+}
+
+
+def resolve_behavior(scenario, endpoint):
+    spec = SCENARIOS.get(scenario, scenario) if isinstance(scenario, str) else (scenario or {})
+    behavior = dict(DEFAULT_BEHAVIOR)
+    behavior.update(spec.get('default', {}))
+    behavior.update(spec.get('endpoints', {}).get(endpoint, {}))
+    return behavior
+
+
+# --- Bodies ---
+
+def _kma_envelope(items, rows):
+    items = items[:rows]
+    return {'response': {'header': {'resultCode': '00', 'resultMsg': 'NORMAL_SERVICE'},
+                         'body': {'dataType': 'JSON', 'items': {'item': items}, 'pageNo': 1,
+                                  'numOfRows': rows, 'totalCount': len(items)}}}
+
+
+def _temp(t):
+    """Diurnal temperature curve (min ~05h, max ~15h)."""
+    hour = t.hour + t.minute / 60
+    return round(12 - 7 * math.cos((hour - 3) / 24 * 2 * math.pi), 1)
+
+
+def synth_kma(endpoint, params):
+    base = datetime.strptime(params['base_date'] + params['base_time'], '%Y%m%d%H%M')
+    common = {'baseDate': params['base_date'], 'baseTime': params['base_time'],
+              'nx': int(params.get('nx', 60)), 'ny': int(params.get('ny', 127))}
+    rows = int(params.get('numOfRows', 10))
+    if endpoint == 'getUltraSrtNcst':
+        values = {'T1H': _temp(base), 'RN1': '0', 'REH': '55', 'PTY': '0', 'WSD': '1.8', 'VEC': '250'}
+        return _kma_envelope([dict(common, category=c, obsrValue=str(v)) for c, v in values.items()], rows)
+
+    items = []
+    if endpoint == 'getUltraSrtFcst':
+        first = base.replace(minute=0) + timedelta(hours=1)
+        for cat in ('T1H', 'SKY', 'PTY', 'RN1', 'REH'):
+            for h in range(6):
+                t = first + timedelta(hours=h)
+                value = {'T1H': _temp(t), 'SKY': '3' if h >= 3 else '1', 'PTY': '1' if h == 4 else '0',
+                         'RN1': '1.0mm' if h == 4 else '강수없음', 'REH': '60'}[cat]
+                items.append(dict(common, category=cat, fcstDate=t.strftime('%Y%m%d'),
+                                  fcstTime=t.strftime('%H%M'), fcstValue=str(value)))
+        return _kma_envelope(items, rows)
+
+    # getVilageFcst: hourly from base + 1h to the end of day + 2
+    t = base + timedelta(hours=1)
+    end = datetime.combine(base.date() + timedelta(days=3), datetime.min.time())
+    while t < end:
+        rainy = t.hour in (14, 15) and t.day % 2 == 0
+        values = {'TMP': _temp(t), 'SKY': '4' if rainy else '1', 'PTY': '1' if rainy else '0',
+                  'POP': '70' if rainy else '10', 'PCP': '2.0mm' if rainy else '강수없음',
+                  'SNO': '적설없음', 'REH': '60', 'WSD': '2.1'}
+        if t.hour == 6: values['TMN'] = _temp(t.replace(hour=5))
+        if t.hour == 15: values['TMX'] = _temp(t)
+        items += [dict(common, category=c, fcstDate=t.strftime('%Y%m%d'), fcstTime=t.strftime('%H%M'),
+                       fcstValue=str(v)) for c, v in values.items()]
+        t += timedelta(hours=1)
+    return _kma_envelope(items, rows)
+
+
+def _dust_hour(now=None):
+    """Latest hour AirKorea has published (dataTime 'YYYY-MM-DD HH:00')."""
+    now = now or datetime.now()
+    return (now - timedelta(minutes=data_api.DUST_PUBLISH_MINUTE)).replace(minute=0, second=0, microsecond=0)
+
+
+def synth_dust(params):
+    t = _dust_hour()
+    items = [{'dataTime': (t - timedelta(hours=h)).strftime('%Y-%m-%d %H:%M'), 'pm10Value': str(30 + h % 7),
+              'pm25Value': str(12 + h % 5), 'pm10Grade': '1', 'pm25Grade': '1', 'khaiValue': '55'}
+             for h in range(24)][:int(params.get('numOfRows', 1))]
+    return {'response': {'header': {'resultCode': '00', 'resultMsg': 'NORMAL_CODE'},
+                         'body': {'totalCount': 24, 'items': items, 'pageNo': 1, 'numOfRows': len(items)}}}
+
+
+def _shift(date_str, time_str, delta):
+    t = datetime.strptime(date_str + time_str, '%Y%m%d%H%M') + delta
+    return t.strftime('%Y%m%d'), t.strftime('%H%M')
+
+
+def replay_kma(recorded, params):
+    """Recorded KMA body moved to the requested base_time (and nx/ny)."""
+    body = json.loads(json.dumps(recorded))
+    items = body['response']['body']['items']['item']
+    if items:
+        first = items[0]
+        delta = (datetime.strptime(params['base_date'] + params['base_time'], '%Y%m%d%H%M') -
+                 datetime.strptime(first['baseDate'] + first['baseTime'], '%Y%m%d%H%M'))
+        for item in items:
+            item['baseDate'], item['baseTime'] = _shift(item['baseDate'], item['baseTime'], delta)
+            if 'fcstDate' in item:
+                item['fcstDate'], item['fcstTime'] = _shift(item['fcstDate'], item['fcstTime'], delta)
+            item['nx'], item['ny'] = int(params.get('nx', item['nx'])), int(params.get('ny', item['ny']))
+    return body
+
+
+def replay_dust(recorded, params):
+    """Recorded AirKorea body moved to the latest published hour."""
+    body = json.loads(json.dumps(recorded))
+    items = body['response']['body']['items']
+    if items:
+        def parse(s):
+            day = datetime.strptime(s[:10], '%Y-%m-%d')
+            return day + timedelta(hours=int(s[11:13]))
+        delta = _dust_hour() - parse(items[0]['dataTime'])
+        for item in items:
+            item['dataTime'] = (parse(item['dataTime']) + delta).strftime('%Y-%m-%d %H:%M')
+    return body
+
+
+def gateway_error(code):
+    reason = XML_ERRORS.get(str(code).lstrip('0'), 'APPLICATION_ERROR')
+    return (f"<OpenAPI_ServiceResponse><cmmMsgHeader><errMsg>SERVICE ERROR</errMsg>"
+            f"<returnAuthMsg>{reason}</returnAuthMsg><returnReasonCode>{code}</returnReasonCode>"
+            f"</cmmMsgHeader></OpenAPI_ServiceResponse>").encode('utf-8')
+
+
+# --- Server ---
+
+class StandIn:
+    """
+    Stand-in server on 127.0.0.1 (port 0: any free port):
+        with StandIn(scenario='slow') as server:
+            data_api.API_BASE_URL = server.url
+    """
+    def __init__(self, scenario='healthy', recordings_dir=RECORDINGS_DIR, port=0, seed=None):
+        self.scenario = scenario
+        self.recordings = self._load_recordings(recordings_dir)
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {}
+        handler = type('Handler', (_Handler,), {'standin': self})
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = None
+
+    @staticmethod
+    def _load_recordings(path):
+        recordings = {}
+        for endpoint in KMA_ENDPOINTS + (DUST_ENDPOINT,):
+            try:
+                with open(os.path.join(path, f"{endpoint}.json"), encoding='utf-8') as f:
+                    recordings[endpoint] = json.load(f)['body']
+            except (OSError, ValueError, KeyError):
+                pass
+        return recordings
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True, name='standin')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def configure(self, scenario):
+        with self._lock:
+            self.scenario = scenario
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {}
+
+    def _count(self, endpoint, outcome):
+        with self._lock:
+            per = self.stats.setdefault(endpoint, {})
+            per[outcome] = per.get(outcome, 0) + 1
+
+    def plan(self, endpoint):
+        """(outcome, delay seconds) for one request under the current scenario."""
+        with self._lock:
+            b = resolve_behavior(self.scenario, endpoint)
+            delay = max(0.0, b['latency_ms'] + self.rng.uniform(-b['jitter_ms'], b['jitter_ms'])) / 1000
+            roll = self.rng.random()
+        if roll < b['timeout_rate']:
+            return ('timeout', b), b['hang_sec']
+        roll -= b['timeout_rate']
+        if roll < b['error_rate']:
+            return ('error', b), delay
+        roll -= b['error_rate']
+        if roll < b['xml_error_rate']:
+            return ('xml_error', b), delay
+        return ('ok', b), delay
+
+    def body(self, endpoint, params):
+        recorded = self.recordings.get(endpoint)
+        if endpoint == DUST_ENDPOINT:
+            return replay_dust(recorded, params) if recorded else synth_dust(params)
+        return replay_kma(recorded, params) if recorded else synth_kma(endpoint, params)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    standin = None
+    protocol_version = 'HTTP/1.1' # Keep-alive, like the real gateway
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        endpoint = parts.path.rsplit('/', 1)[-1]
+        params = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        if endpoint not in KMA_ENDPOINTS + (DUST_ENDPOINT,):
+            self._send(404, b'Not Found', 'text/plain')
+            return
+        (outcome, behavior), delay = self.standin.plan(endpoint)
+        self.standin._count(endpoint, outcome)
+        time.sleep(delay)
+        try:
+            if outcome == 'error':
+                self._send(behavior['error_status'], b'<html><body>Service Unavailable</body></html>', 'text/html')
+            elif outcome == 'xml_error':
+                self._send(200, gateway_error(behavior['xml_code']), 'text/xml;charset=UTF-8')
+            else: # 'timeout' answers too, long after the client gave up
+                payload = json.dumps(self.standin.body(endpoint, params), ensure_ascii=False).encode('utf-8')
+                self._send(200, payload, 'application/json;charset=UTF-8')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+# --- Recorder ---
+
+def record(kma_key, air_key, nx, ny, station, out_dir=RECORDINGS_DIR):
+    """Fetch each endpoint once from the live API and store its body (service key stripped)."""
+    os.makedirs(out_dir, exist_ok=True)
+    session = data_api.get_session()
+    requests_to_make = []
+    if kma_key:
+        for endpoint in KMA_ENDPOINTS:
+            if endpoint == 'getVilageFcst':
+                bd, bt = data_api.get_vilage_base_time()
+                rows = data_api.VILAGE_ROWS
+            else:
+                bd, bt = data_api.get_kma_base_time('ultrasrt' if endpoint == 'getUltraSrtNcst' else 'ultrasrt_fcst')
+                rows = 10 if endpoint == 'getUltraSrtNcst' else 60
+            requests_to_make.append((endpoint, f"{data_api.api_url(data_api.KMA_PATH)}/{endpoint}", kma_key,
+                                     {'numOfRows': str(rows), 'pageNo': '1', 'base_date': bd, 'base_time': bt,
+                                      'nx': nx, 'ny': ny, 'dataType': 'JSON'}))
+    if air_key and station:
+        requests_to_make.append((DUST_ENDPOINT, data_api.api_url(data_api.DUST_PATH), air_key,
+                                 {'returnType': 'json', 'numOfRows': '24', 'pageNo': '1', 'stationName': station,
+                                  'dataTerm': 'DAILY', 'ver': '1.3'}))
+
+    for endpoint, url, key, params in requests_to_make:
+        t0 = time.perf_counter()
+        res = session.get(url, params=dict(params, serviceKey=data_api._decode_key(key)), timeout=30)
+        ms = (time.perf_counter() - t0) * 1000
+        try:
+            data_api.resilience.check_response(res)
+            body = res.json()
+        except (data_api.resilience.UpstreamError, ValueError) as e:
+            print(f"FAIL {endpoint}: {e}")
+            continue
+        with open(os.path.join(out_dir, f"{endpoint}.json"), 'w', encoding='utf-8') as f:
+            json.dump({'endpoint': endpoint, 'recorded_at': datetime.now().isoformat(timespec='seconds'),
+                       'params': params, 'latency_ms': round(ms), 'body': body}, f, ensure_ascii=False, indent=1)
+        print(f"Recorded {endpoint} ({ms:.0f} ms, {len(res.content)} bytes)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in KMA / AirKorea server and recorder")
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve = sub.add_parser('serve', help="run the stand-in server")
+    serve.add_argument('--port', type=int, default=8089)
+    serve.add_argument('--scenario', default='healthy', choices=sorted(SCENARIOS))
+    serve.add_argument('--behavior', help="JSON overriding the scenario's default behavior")
+    serve.add_argument('--recordings', default=RECORDINGS_DIR)
+    rec = sub.add_parser('record', help="record live responses")
+    rec.add_argument('--kma-key')
+    rec.add_argument('--air-key')
+    rec.add_argument('--nx', type=int, default=61)
+    rec.add_argument('--ny', type=int, default=115)
+    rec.add_argument('--station', default="고덕")
+    rec.add_argument('--out', default=RECORDINGS_DIR)
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        record(args.kma_key, args.air_key, args.nx, args.ny, args.station, args.out)
+        return 0
+
+    scenario = json.loads(json.dumps(SCENARIOS[args.scenario]))
+    if args.behavior:
+        scenario.setdefault('default', {}).update(json.loads(args.behavior))
+    server = StandIn(scenario, args.recordings, port=args.port)
+    print(f"Stand-in serving '{args.scenario}' on {server.url} (recorded: {sorted(server.recordings) or 'none'})")
+    print(f"Point the frame at it with DATA_API_BASE_URL={server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,289 @@
+import os
+import time
+import atexit
+import hashlib
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+# --- [Derived-Artifact Cache Manager] ---
+# One owner for everything that can be regenerated (thumbnails, normalized base layers,
+# dithered framebuffers, API responses), so the SD card never fills up with caches.
+#   - namespaced files under CACHE_DIR/<namespace>/<h[:2]>/<sha1(key)><ext>
+#   - size / last access / optional expiry tracked in SQLite (CACHE_DB_PATH, WAL)
+#   - global disk budget + per-namespace quotas, least-recently-used eviction
+#   - atomic writes (temp file in the namespace dir + rename)
+#   - hit / miss / eviction counters per namespace (shared by the web app and the frame process;
+#     hits / misses are batched in memory, so a cache hit costs no SD-card write)
+#
+# Entries can carry a `tag` (e.g. the photo content hash) so all derivatives of one
+# source are dropped together with invalidate(tag=...).
+
+DEFAULT_CACHE_SETTINGS = {
+    "budget_mb": 512,
+    "quotas_mb": {
+        "thumbs": 128,
+        "base_layers": 128,
+        "framebuffers": 64,
+        "api": 16
+    }
+}
+
+ATIME_RESOLUTION = 300 # Seconds; skip the access-time write for entries touched more recently
+COUNTER_FLUSH_SEC = 60 # Hit / miss counters are kept in memory and written at most this often
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = set()
+_pending = {'counts': {}, 'flushed': time.time()}
+_pending_lock = threading.Lock()
+
+
+def get_cache_settings():
+    cfg = settings.load_config().get('cache_settings', {}) or {}
+    merged = dict(DEFAULT_CACHE_SETTINGS)
+    merged['quotas_mb'] = dict(DEFAULT_CACHE_SETTINGS['quotas_mb'])
+    if 'budget_mb' in cfg:
+        merged['budget_mb'] = cfg['budget_mb']
+    merged['quotas_mb'].update(cfg.get('quotas_mb') or {})
+    return merged
+
+
+def _limits(namespace, cfg=None):
+    cfg = cfg or get_cache_settings()
+    budget = int(float(cfg['budget_mb']) * 1024 * 1024)
+    quota = cfg['quotas_mb'].get(namespace)
+    quota = int(float(quota) * 1024 * 1024) if quota is not None else budget
+    return budget, min(quota, budget)
+
+
+def _connect():
+    """Per-thread connection (sqlite3 objects must not cross threads)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and getattr(_local, 'path', None) == settings.CACHE_DB_PATH:
+        return conn
+    os.makedirs(os.path.dirname(settings.CACHE_DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(settings.CACHE_DB_PATH, timeout=10, isolation_level=None)
+    with _init_lock:
+        if settings.CACHE_DB_PATH not in _initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS entries (
+                ns TEXT NOT NULL, key TEXT NOT NULL, path TEXT NOT NULL, size INTEGER NOT NULL,
+                atime REAL NOT NULL, expires REAL, tag TEXT, PRIMARY KEY (ns, key))""")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (ns, atime)")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_tag ON entries (ns, tag)")
+            conn.execute("""CREATE TABLE IF NOT EXISTS counters (
+                ns TEXT PRIMARY KEY, hits INTEGER DEFAULT 0, misses INTEGER DEFAULT 0,
+                evictions INTEGER DEFAULT 0)""")
+            _initialized.add(settings.CACHE_DB_PATH)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    _local.conn, _local.path = conn, settings.CACHE_DB_PATH
+    return conn
+
+
+def _count(conn, namespace, field, n=1):
+    conn.execute(f"INSERT INTO counters (ns, {field}) VALUES (?, ?) "
+                 f"ON CONFLICT(ns) DO UPDATE SET {field} = {field} + excluded.{field}", (namespace, n))
+
+
+def _tally(namespace, field):
+    """Count a hit / miss in memory; flushed to SQLite every COUNTER_FLUSH_SEC (no write per lookup)."""
+    with _pending_lock:
+        counts = _pending['counts']
+        counts[(namespace, field)] = counts.get((namespace, field), 0) + 1
+        due = time.time() - _pending['flushed'] >= COUNTER_FLUSH_SEC
+    if due:
+        flush_counters()
+
+
+def flush_counters():
+    with _pending_lock:
+        counts, _pending['counts'] = _pending['counts'], {}
+        _pending['flushed'] = time.time()
+    if not counts:
+        return
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for (namespace, field), n in counts.items():
+            _count(conn, namespace, field, n)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+atexit.register(flush_counters)
+
+
+def entry_path(namespace, key, ext):
+    h = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(settings.CACHE_DIR, namespace, h[:2], h + ext)
+
+
+def _remove(path):
+    try: os.remove(path)
+    except OSError: pass
+
+
+def get_path(namespace, key):
+    """Path of a cached artifact (and mark it recently used), or None on a miss."""
+    conn = _connect()
+    row = conn.execute("SELECT path, atime, expires FROM entries WHERE ns = ? AND key = ?",
+                       (namespace, key)).fetchone()
+    now = time.time()
+    if row is not None:
+        path, atime, expires = row
+        if (expires is None or expires > now) and os.path.exists(path):
+            if now - atime > ATIME_RESOLUTION:
+                conn.execute("UPDATE entries SET atime = ? WHERE ns = ? AND key = ?", (now, namespace, key))
+            _tally(namespace, 'hits')
+            return path
+        # Expired or removed behind our back
+        conn.execute("DELETE FROM entries WHERE ns = ? AND key = ?", (namespace, key))
+        _remove(path)
+    _tally(namespace, 'misses')
+    return None
+
+
+def get_bytes(namespace, key):
+    path = get_path(namespace, key)
+    if path is None:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+@contextmanager
+def writer(namespace, key, ext='', ttl=None, tag=None):
+    """
+    Write an artifact atomically:
+        with cache_manager.writer('thumbs', key, '.jpg') as tmp:
+            img.save(tmp, 'JPEG')
+    The temp file is renamed into place and registered on success, discarded on error.
+    Yields the temp path; the final path is entry_path(namespace, key, ext).
+    """
+    final = entry_path(namespace, key, ext)
+    tmp_dir = os.path.join(settings.CACHE_DIR, namespace, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp = os.path.join(tmp_dir, f"{os.getpid()}_{threading.get_ident()}_{time.time_ns()}{ext}")
+    try:
+        yield tmp
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        os.replace(tmp, final)
+    except BaseException:
+        _remove(tmp)
+        raise
+    _register(namespace, key, final, ttl, tag)
+
+
+def put_bytes(namespace, key, data, ext='', ttl=None, tag=None):
+    with writer(namespace, key, ext, ttl=ttl, tag=tag) as tmp:
+        with open(tmp, 'wb') as f:
+            f.write(data)
+    return entry_path(namespace, key, ext)
+
+
+def _register(namespace, key, path, ttl, tag):
+    size = os.path.getsize(path)
+    budget, quota = _limits(namespace)
+    now = time.time()
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        old = conn.execute("SELECT path FROM entries WHERE ns = ? AND key = ?", (namespace, key)).fetchone()
+        if old and old[0] != path:
+            _remove(old[0])
+        conn.execute("INSERT OR REPLACE INTO entries (ns, key, path, size, atime, expires, tag) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     (namespace, key, path, size, now, now + ttl if ttl else None, tag))
+        victims = _evict(conn, namespace, quota, budget, keep=(namespace, key))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    for victim in victims:
+        _remove(victim)
+
+
+def _evict(conn, namespace, quota, budget, keep):
+    """Drop least-recently-used entries until the namespace quota and the global budget hold."""
+    victims = []
+    # Expired entries go first, whatever their namespace
+    for ns, key, path in conn.execute("SELECT ns, key, path FROM entries WHERE expires IS NOT NULL "
+                                      "AND expires <= ?", (time.time(),)).fetchall():
+        if (ns, key) == keep: continue
+        conn.execute("DELETE FROM entries WHERE ns = ? AND key = ?", (ns, key))
+        victims.append(path)
+
+    for scope_ns, limit in ((namespace, quota), (None, budget)):
+        where, args = ("WHERE ns = ?", (scope_ns,)) if scope_ns else ("", ())
+        total = conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM entries {where}", args).fetchone()[0]
+        if total <= limit: continue
+        for ns, key, path, size in conn.execute(f"SELECT ns, key, path, size FROM entries {where} "
+                                                "ORDER BY atime", args).fetchall():
+            if total <= limit: break
+            if (ns, key) == keep: continue
+            conn.execute("DELETE FROM entries WHERE ns = ? AND key = ?", (ns, key))
+            _count(conn, ns, 'evictions')
+            victims.append(path)
+            total -= size
+    return victims
+
+
+def invalidate(namespace=None, key=None, tag=None):
+    """
+    Drop one key, every entry with `tag`, or the whole namespace.
+    namespace=None with a tag drops that source's derivatives in every namespace.
+    """
+    conn = _connect()
+    if key is not None:
+        where, args = "ns = ? AND key = ?", (namespace, key)
+    elif tag is not None:
+        where, args = ("ns = ? AND tag = ?", (namespace, tag)) if namespace else ("tag = ?", (tag,))
+    elif namespace is not None:
+        where, args = "ns = ?", (namespace,)
+    else:
+        raise ValueError("invalidate() needs a namespace, key or tag")
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        paths = [r[0] for r in conn.execute(f"SELECT path FROM entries WHERE {where}", args)]
+        conn.execute(f"DELETE FROM entries WHERE {where}", args)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    for path in paths:
+        _remove(path)
+    return len(paths)
+
+
+def get_stats():
+    flush_counters()
+    conn = _connect()
+    cfg = get_cache_settings()
+    namespaces = {}
+    for ns, entries, size in conn.execute("SELECT ns, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY ns"):
+        namespaces[ns] = {'entries': entries, 'bytes': size}
+    for ns, hits, misses, evictions in conn.execute("SELECT ns, hits, misses, evictions FROM counters"):
+        stats = namespaces.setdefault(ns, {'entries': 0, 'bytes': 0})
+        total = hits + misses
+        stats.update(hits=hits, misses=misses, evictions=evictions,
+                     hit_rate=round(hits / total, 3) if total else 0.0)
+    for ns, stats in namespaces.items():
+        stats.setdefault('hits', 0); stats.setdefault('misses', 0)
+        stats.setdefault('evictions', 0); stats.setdefault('hit_rate', 0.0)
+        stats['quota_bytes'] = _limits(ns, cfg)[1]
+    return {
+        'budget_bytes': int(float(cfg['budget_mb']) * 1024 * 1024),
+        'bytes': sum(s['bytes'] for s in namespaces.values()),
+        'namespaces': namespaces
+    }
@@ -0,0 +1,114 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import ImageCms
+
+logger = logging.getLogger(__name__)
+
+# --- [ICC Transform Cache] ---
+# Building a LittleCMS transform is the expensive part of colour management.
+# Almost every iPhone photo carries the identical Display P3 profile, so transforms
+# are built once per (profile bytes hash, mode, rendering intent) and reused.
+
+MAX_TRANSFORMS = 16
+DEFAULT_INTENT = ImageCms.Intent.PERCEPTUAL
+
+_lock = threading.Lock()
+_transforms = OrderedDict() # key -> ImageCmsTransform, or None for "already sRGB"
+_stats = {'hits': 0, 'misses': 0, 'skipped': 0}
+_srgb_profile = None
+
+# NOCACHE: lcms' 1-pixel cache is not thread-safe and uploads run on Flask threads
+try:
+    _TRANSFORM_FLAGS = ImageCms.Flags.NOCACHE
+except AttributeError: # Older Pillow
+    _TRANSFORM_FLAGS = ImageCms.FLAGS['NOCACHE']
+
+
+def _get_srgb():
+    global _srgb_profile
+    if _srgb_profile is None:
+        _srgb_profile = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB'))
+    return _srgb_profile
+
+
+def _is_srgb(profile):
+    try:
+        desc = (ImageCms.getProfileDescription(profile) or '').lower()
+    except Exception:
+        return False
+    return 'srgb' in desc or 'iec61966-2' in desc
+
+
+def _get_transform(icc_bytes, mode, intent):
+    key = (hashlib.sha1(icc_bytes).hexdigest(), mode, int(intent))
+    with _lock:
+        if key in _transforms:
+            _transforms.move_to_end(key)
+            _stats['hits'] += 1
+            return _transforms[key]
+        _stats['misses'] += 1
+
+    src_profile = ImageCms.ImageCmsProfile(BytesIO(icc_bytes))
+    if _is_srgb(src_profile):
+        transform = None
+    else:
+        transform = ImageCms.buildTransform(src_profile, _get_srgb(), mode, mode,
+                                            renderingIntent=intent, flags=_TRANSFORM_FLAGS)
+        logger.info(f"ICC transform built: {ImageCms.getProfileDescription(src_profile).strip()} -> sRGB ({mode})")
+
+    with _lock:
+        _transforms[key] = transform
+        while len(_transforms) > MAX_TRANSFORMS:
+            _transforms.popitem(last=False)
+    return transform
+
+
+def needs_conversion(img):
+    """True if the image carries an embedded, non-sRGB ICC profile."""
+    icc = img.info.get('icc_profile')
+    if not icc:
+        return False
+    try:
+        mode = img.mode if img.mode in ('RGB', 'RGBA') else 'RGB'
+        return _get_transform(icc, mode, DEFAULT_INTENT) is not None
+    except Exception as e:
+        logger.warning(f"ICC profile unreadable: {e}")
+        return False
+
+
+def to_srgb(img, intent=DEFAULT_INTENT):
+    """
+    Convert `img` to sRGB using its embedded ICC profile (cached transform, applied in place).
+    Returns the converted image; images without a profile (or already sRGB) pass through.
+    """
+    icc = img.info.get('icc_profile')
+    if not icc:
+        with _lock: _stats['skipped'] += 1
+        return img
+
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGB') # convert() keeps info['icc_profile']
+    img.load()
+
+    try:
+        transform = _get_transform(icc, img.mode, intent)
+    except Exception as e:
+        logger.warning(f"ICC transform failed, keeping original colours: {e}")
+        return img
+
+    if transform is None:
+        with _lock: _stats['skipped'] += 1
+        return img
+
+    ImageCms.applyTransform(img, transform, inPlace=True)
+    img.info.pop('icc_profile', None) # Pixels are sRGB now
+    return img
+
+
+def get_stats():
+    with _lock:
+        return dict(_stats, cached=len(_transforms))
@@ -1,4 +1,6 @@
+import os
 import requests
+import json
 import logging
 from datetime import datetime, timedelta
 import xml.etree.ElementTree as ET
@@ -8,38 +10,272 @@ except ImportError:
     log_debug = lambda msg, level='info': None # Fallback
 
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import cache_manager
+import resilience
+from forecast_grid import ForecastGrid
 
 logger = logging.getLogger(__name__)
 
-def fetch_with_retry(url, params, retries=3, timeout=30, label="API"):
+# --- [Response Cache] ---
+# KMA publishes each product on a fixed schedule and AirKorea once an hour, so a response is
+# valid until the next publication, not for a flat TTL. Successful responses are kept in the
+# cache manager's 'api' namespace, keyed by (endpoint, nx/ny or station, base_date/base_time),
+# and expire when the schedule (publication_expiry) says a newer base_time is available.
+# Previews, slider drags and repeated refreshes inside one publication window hit no network.
+
+KMA_PUBLISH_MINUTE = 45       # 초단기실황 / 초단기예보: hh00 / hh30 base available after hh:45 (safe margin)
+VILAGE_BASE_HOURS = [2, 5, 8, 11, 14, 17, 20, 23]
+VILAGE_PUBLISH_MINUTE = 15    # 단기예보: base hh00 available after hh:15
+VILAGE_ROWS = 1000            # Every category for the whole ~3-day horizon of one base_time
+DUST_PUBLISH_MINUTE = 15      # AirKorea: hourly values usually land by hh:15
+DUST_LATE_RETRY_MIN = 10      # Expected hour not published yet: look again soon
+
+# --- [Upstream URLs] ---
+# DATA_API_BASE_URL (or assigning API_BASE_URL) points every KMA / AirKorea call at another
+# host with the same paths, e.g. the stand-in server in benchmarks/standin.py.
+API_BASE_URL = os.environ.get('DATA_API_BASE_URL', "http://apis.data.go.kr").rstrip('/')
+KMA_PATH = "/1360000/VilageFcstInfoService_2.0"
+DUST_PATH = "/B552584/ArpltnInforInqireSvc/getMsrstnAcctoRltmMesureDnsty"
+
+
+def api_url(path):
+    return API_BASE_URL + path
+
+
+# --- [HTTP Session] ---
+# One pooled requests.Session for every upstream call (KMA, AirKorea, AI providers):
+# keep-alive connections are reused across calls instead of a DNS lookup + TCP handshake each,
+# connect failures are retried at the transport level (configured once here),
+# and pool_block caps the connections per host. Reuse counters go to the debug log.
+
+POOL_HOSTS = 4          # Distinct hosts kept in the pool (apis.data.go.kr, Vertex AI, ...)
+POOL_PER_HOST = 6       # Connections per host (concurrent requests beyond this wait)
+TRANSPORT_RETRIES = 2   # Connection errors only; HTTP status retries are resilience.call's job
+TRANSPORT_BACKOFF = 0.5
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Shared pooled session (created on first use)."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=None, connect=TRANSPORT_RETRIES, read=0, other=0, status=0,
+                          backoff_factor=TRANSPORT_BACKOFF, raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_PER_HOST,
+                                  max_retries=retry, pool_block=True)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+def connection_stats(url):
+    """(requests sent, connections opened) on the pool for `url`'s host."""
+    try:
+        parts = urlsplit(url)
+        pools = get_session().get_adapter(url).poolmanager.pools
+        sent = opened = 0
+        for key in pools.keys():
+            if key.key_scheme == parts.scheme and key.key_host == parts.hostname:
+                pool = pools[key]
+                sent, opened = sent + pool.num_requests, opened + pool.num_connections
+        return sent, opened
+    except Exception:
+        return None, None
+
+
+def log_connection_reuse(label, url):
+    sent, opened = connection_stats(url)
+    if sent is not None:
+        log_debug(f"{label} Conn: {urlsplit(url).netloc} requests={sent} opened={opened} reused={max(0, sent - opened)}")
+
+
+def fetch_with_retry(url, params, retries=3, timeout=30, label="API", deadline=None):
     """
-    Robust fetcher with retries and timeout.
+    GET with retries (backoff + jitter), a circuit breaker per endpoint and an overall deadline
+    (see resilience). Returns the response, or None when every attempt failed.
     """
-    for i in range(retries):
+    name = urlsplit(url).path.rsplit('/', 1)[-1] or label
+
+    def attempt(attempt_timeout):
+        log_debug(f"{label} Req: {url} (timeout {attempt_timeout:.1f}s)")
+        res = get_session().get(url, params=params, timeout=attempt_timeout)
+        log_connection_reuse(label, url)
+        return res
+
+    try:
+        return resilience.call(name, attempt, deadline, attempts=retries, timeout=timeout,
+                               check=resilience.check_response)
+    except resilience.UpstreamError as e:
+        log_debug(f"{label} Failed: {e}", level='error')
+        return None
+
+# --- [Request Coalescing] ---
+# The settings page preview, a save with refresh=true and the operation-mode display update can
+# ask for the same nx/ny at the same moment. fetch_json runs through one SingleFlight keyed like
+# the response cache: the first caller (leader) fetches, identical concurrent calls wait for its
+# result instead of sending their own requests. Followers wait at most COALESCE_WAIT seconds
+# (never past their deadline) and then get None, like a failed fetch. The leader fetches under
+# its own deadline, which may be shorter: when it fails or gives up, a follower with time left
+# fetches once more under its own remaining deadline (concurrent retries coalesce again).
+# Counters per endpoint: leaders, coalesced, timed_out, retried (get_fetch_stats / /api/fetch_stats).
+
+COALESCE_WAIT = 30
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.stats = {}
+
+    def _count(self, name, field):
+        per = self.stats.setdefault(name, {'leaders': 0, 'coalesced': 0, 'timed_out': 0, 'retried': 0})
+        per[field] += 1
+
+    def do(self, key, fn, wait=COALESCE_WAIT, name=None, can_retry=None):
+        """
+        fn() once for concurrent calls with the same key; followers share its result.
+        A follower whose shared result is None runs the call once more if can_retry() allows
+        (fn carries the follower's own deadline).
+        """
+        name = name or key
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            self._count(name, 'leaders' if leader else 'coalesced')
+        if leader:
+            try:
+                flight.result = fn()
+                return flight.result
+            finally:
+                with self._lock:
+                    self._flights.pop(key, None)
+                flight.done.set()
+        log_debug(f"Coalesced: {key} (waiting up to {wait:.0f}s)")
+        if not flight.done.wait(wait):
+            with self._lock:
+                self._count(name, 'timed_out')
+            log_debug(f"Coalesced wait timed out: {key}", level='warning')
+            return None
+        if flight.result is None and can_retry is not None and can_retry():
+            with self._lock:
+                self._count(name, 'retried')
+            log_debug(f"Coalesced fetch failed, retrying within own deadline: {key}")
+            return self.do(key, fn, wait, name)
+        return flight.result
+
+    def get_stats(self):
+        with self._lock:
+            return {name: dict(per) for name, per in self.stats.items()}
+
+
+_flights = SingleFlight()
+
+
+def get_fetch_stats():
+    """Coalescing counters and circuit breaker states per endpoint."""
+    return {'coalescing': _flights.get_stats(), 'breakers': resilience.breaker_states()}
+
+
+def publication_expiry(api_type, now=None):
+    """When the base_time chosen at `now` for `api_type` is superseded by a newer publication."""
+    now = now or datetime.now()
+    if api_type == 'vilage':
+        for day in (0, 1):
+            for h in VILAGE_BASE_HOURS:
+                t = (now + timedelta(days=day)).replace(hour=h, minute=VILAGE_PUBLISH_MINUTE, second=0, microsecond=0)
+                if t > now:
+                    return t
+    t = now.replace(minute=KMA_PUBLISH_MINUTE, second=0, microsecond=0)
+    return t if t > now else t + timedelta(hours=1)
+
+def _dust_expiry(data, now=None):
+    """Next hourly publication, or a short retry when the current hour is still missing."""
+    now = now or datetime.now()
+    t = now.replace(minute=DUST_PUBLISH_MINUTE, second=0, microsecond=0)
+    next_publish = t if t > now else t + timedelta(hours=1)
+    try:
+        items = data['response']['body']['items']
+        latest = datetime.strptime(items[0]['dataTime'].replace(' 24:00', ' 00:00'), '%Y-%m-%d %H:%M')
+        if items[0]['dataTime'].endswith('24:00'): latest += timedelta(days=1)
+    except (KeyError, IndexError, TypeError, ValueError):
+        return next_publish
+    expected = next_publish - timedelta(hours=1, minutes=DUST_PUBLISH_MINUTE)
+    if latest < expected:
+        return min(next_publish, now + timedelta(minutes=DUST_LATE_RETRY_MIN))
+    return next_publish
+
+def _response_ok(data):
+    """resultCode 00 with at least one item (KMA: body.items.item, AirKorea: body.items)."""
+    try:
+        resp = data['response']
+        if str(resp['header']['resultCode']) != '00':
+            return False
+        items = resp['body']['items']
+        return bool(items.get('item') if isinstance(items, dict) else items)
+    except (KeyError, TypeError, AttributeError):
+        return False
+
+def fetch_json(endpoint, url, params, scope, base, expires, label="API", deadline=None):
+    """
+    Parsed JSON of `url`, from the response cache while its publication is current.
+    `expires`: datetime, or callable(data) -> datetime computed from the response.
+    Only successful, non-empty responses are cached; concurrent identical misses share one fetch.
+    """
+    key = f"{endpoint}|{scope}|{base}|{params.get('numOfRows', '')}"
+    raw = cache_manager.get_bytes('api', key)
+    if raw is not None:
         try:
-            log_debug(f"{label} Req (Attempt {i+1}): {url}")
-            t0 = datetime.now()
-            res = requests.get(url, params=params, timeout=timeout)
-            dt = (datetime.now() - t0).total_seconds()
-            log_debug(f"{label} Res: {res.status_code} ({dt:.2f}s)")
-            
-            if res.status_code == 200:
-                return res
-            else:
-                 log_debug(f"{label} returned status {res.status_code}. Retrying...", level='warning')
-                 
-        except Exception as e:
-            log_debug(f"{label} Attempt {i+1} Failed: {e}", level='warning')
-            log_debug(f"{label} Error: {e}", level='warning')
-        
-        if i < retries - 1:
-            time.sleep(2) # Wait 2s before retry
-            
-    # Final Attempt failed
-    log_debug(f"{label} Failed after {retries} attempts.", level='error')
-    return None
+            log_debug(f"{label} Cache Hit: {key}")
+            return json.loads(raw)
+        except ValueError:
+            pass
+
+    deadline = resilience.Deadline.of(deadline) # One budget for the wait and a possible retry
+    wait = deadline.timeout(COALESCE_WAIT)
+    return _flights.do(key, lambda: _fetch_and_store(key, url, params, expires, label, deadline), wait, endpoint,
+                       can_retry=lambda: not deadline.expired())
 
-def get_fine_dust_data(api_key, station_name):
+def _fetch_and_store(key, url, params, expires, label, deadline):
+    res = fetch_with_retry(url, params, label=label, deadline=deadline)
+    if not res: return None
+    try:
+        data = res.json()
+    except ValueError:
+        log_debug(f"{label} JSON Parse Fail. Status: {res.status_code}, Raw: {res.text[:500]}", level='warning')
+        return None
+
+    if _response_ok(data):
+        expires_at = expires(data) if callable(expires) else expires
+        ttl = (expires_at - datetime.now()).total_seconds()
+        if ttl > 0:
+            try:
+                cache_manager.put_bytes('api', key, res.content, '.json', ttl=ttl)
+            except Exception as e:
+                log_debug(f"{label} Cache Store Failed: {e}", level='warning')
+    else:
+        log_debug(f"{label} Unusable response: {res.text[:500]}", level='warning')
+    return data
+
+def get_fine_dust_data(api_key, station_name, deadline=None):
     if not api_key: return None
     
     # ... (Key Handling omitted, assume context fits)
@@ -54,7 +290,7 @@ def get_fine_dust_data(api_key, station_name):
             api_key = unquote(api_key)
         except: pass
 
-    url = "http://apis.data.go.kr/B552584/ArpltnInforInqireSvc/getMsrstnAcctoRltmMesureDnsty"
+    url = api_url(DUST_PATH)
     params = {
         'serviceKey': api_key, 'returnType': 'json', 'numOfRows': '1', 
         'pageNo': '1', 'stationName': station_name, 'dataTerm': 'DAILY', 'ver': '1.3'
@@ -65,9 +301,10 @@ def get_fine_dust_data(api_key, station_name):
         except: return None # Return None for "-" or invalid (handled in renderer)
 
     try:
-        res = fetch_with_retry(url, params, label="Dust API")
-        if not res: return None
-        data = res.json()
+        data = fetch_json('getMsrstnAcctoRltmMesureDnsty', url, params, station_name,
+                          (datetime.now() - timedelta(minutes=DUST_PUBLISH_MINUTE)).strftime('%Y%m%d%H'),
+                          _dust_expiry, label="Dust API", deadline=deadline)
+        if not data: return None
         log_debug(f"Dust API Params: {params}") 
  
         items = data.get('response', {}).get('body', {}).get('items', [])
@@ -79,21 +316,41 @@ def get_fine_dust_data(api_key, station_name):
             return {
                 'pm10': safe_int(items[0].get('pm10Value')), 
                 'pm25': safe_int(items[0].get('pm25Value')),
-                'time': items[0].get('dataTime', '')
+                'time': items[0].get('dataTime', ''),
+                'station': station_name
             }
         else:
              log_debug("Dust API: No items found in response.", level='warning')
-             log_debug(f"RAW RES: {res.text[:500]}", level='warning') # Log first 500 chars
              
     except Exception as e:
         log_debug(f"Dust API Error: {e}", level='error')
-        try: log_debug(f"RAW RES (Error): {res.text[:1000]}", level='error')
-        except: pass
         
     return None
 
-def get_kma_base_time(api_type='ultrasrt'):
-    now = datetime.now()
+def _valid_dust(dust):
+    return bool(dust) and (dust.get('pm10') is not None or dust.get('pm25') is not None)
+
+def nearest_valid_dust(candidates, results):
+    """First candidate (nearest first) whose reading has a value, or None."""
+    for name in candidates:
+        if _valid_dust(results.get(name)):
+            return results[name]
+    return None
+
+def get_nearest_dust(api_key, candidates, deadline=None):
+    """Dust from the nearest station with a valid reading; the candidates are queried concurrently."""
+    candidates = [candidates] if isinstance(candidates, str) else list(candidates or [])
+    if not api_key or not candidates: return None
+    if len(candidates) == 1:
+        return get_fine_dust_data(api_key, candidates[0], deadline)
+    shared = resilience.Deadline.of(deadline)
+    futures = {name: _get_executor().submit(get_fine_dust_data, api_key, name, shared) for name in candidates}
+    done, _ = wait(list(futures.values()), timeout=shared.remaining())
+    results = {name: f.result() for name, f in futures.items() if f in done and not f.exception()}
+    return nearest_valid_dust(candidates, results)
+
+def get_kma_base_time(api_type='ultrasrt', now=None):
+    now = now or datetime.now()
     if api_type == 'ultrasrt': # 초단기실황 (매시 40분 이후)
         if now.minute < 45: # 안전하게 45분 기준
             now = now - timedelta(hours=1)
@@ -107,17 +364,17 @@ def get_kma_base_time(api_type='ultrasrt'):
         
     return base_date, base_time
 
-def get_vilage_base_time():
-    now = datetime.now()
+def get_vilage_base_time(now=None):
+    now = now or datetime.now()
     # 단기예보 base_time: 0200, 0500, 0800, 1100, 1400, 1700, 2000, 2300
-    base_times = [2, 5, 8, 11, 14, 17, 20, 23]
+    base_times = VILAGE_BASE_HOURS
     h = now.hour
     m = now.minute
     
     target_date = now
     target_hour = 23
     for bt in reversed(base_times):
-        if h > bt or (h == bt and m >= 15):
+        if h > bt or (h == bt and m >= VILAGE_PUBLISH_MINUTE):
             target_hour = bt
             break
     else:
@@ -126,160 +383,209 @@ def get_vilage_base_time():
         
     return target_date.strftime('%Y%m%d'), f"{target_hour:02d}00"
 
-def get_weather_data(api_key, nx, ny):
+def describe_sky(sky, pty):
+    """KMA SKY / PTY codes -> description used by the renderer (icon lookup)."""
+    if pty == 0:
+        return ['맑음', '맑음', '구름 많음', '흐림'][sky - 1] if 1 <= sky <= 4 else '흐림'
+    return ['', '비', '비 또는 눈', '눈', '소나기'][pty] if pty <= 4 else '비'
+
+def get_forecast_weather(api_key, nx, ny, target_time, deadline=None):
+    """
+    Weather dict (same keys as get_weather_data) predicted for `target_time`,
+    built from 단기예보 (getVilageFcst: hourly TMP/SKY/PTY/PCP/POP, ~3 days ahead).
+    Used to pre-render the next wake's frame before shutdown.
+    """
+    api_key = _decode_key(api_key)
     if not api_key: return None
+    items = get_vilage_items(api_key, nx, ny, deadline)[0]
+    return forecast_weather(items, target_time) if items else None
+
+def get_vilage_items(api_key, nx, ny, deadline=None):
+    """(getVilageFcst items for the whole ~3-day horizon, 'YYYYMMDDHHMM' base) of the current base_time."""
+    api_key = _decode_key(api_key)
+    bd, bt = get_vilage_base_time()
+    if not api_key: return [], bd + bt
+    return _kma_items('getVilageFcst', api_key, nx, ny, "Forecast", deadline), bd + bt
+
+def forecast_weather(items, target_time):
+    """Weather dict for `target_time` from getVilageFcst items or their ForecastGrid (None without hourly slots)."""
+    grid = items if isinstance(items, ForecastGrid) else ForecastGrid.from_items(items)
+    target = target_time.replace(minute=0, second=0, microsecond=0)
+    i = grid.nearest(target, category='TMP')
+    if i is None:
+        return None
+
+    weather_info = {'forecast': True, 'forecast_time': grid.stamp(i)}
+    temp = grid.value('TMP', i)
+    if temp is not None: weather_info['temp'] = temp
+    pty = int(grid.value('PTY', i, 0))
+    weather_info['weather_main_code'] = pty
+    weather_info['weather_description'] = describe_sky(int(grid.value('SKY', i, 1)), pty)
+    weather_info['current_rain_amount'] = grid.value('PCP', i, 0.0) if pty > 0 else 0.0
+    weather_info['rain_forecast'] = grid.rain_window(target, hours=6, amount='PCP')
+
+    max_temp = grid.daily_max('TMX', target)
+    if max_temp is not None: weather_info['max_temp'] = max_temp
+    weather_info['pop'] = grid.daily_max('POP', target) or 0
+    return weather_info
+
+def _kma_items(endpoint, api_key, nx, ny, label, deadline=None):
+    """Items of one KMA endpoint for the current base_time ([] on failure)."""
+    if endpoint == 'getVilageFcst':
+        bd, bt = get_vilage_base_time()
+        rows, expires = VILAGE_ROWS, publication_expiry('vilage')
+    elif endpoint == 'getUltraSrtFcst':
+        bd, bt = get_kma_base_time('ultrasrt_fcst')
+        rows, expires = 60, publication_expiry('ultrasrt_fcst')
+    else:
+        bd, bt = get_kma_base_time('ultrasrt')
+        rows, expires = 10, publication_expiry('ultrasrt')
+    params = {
+        'serviceKey': api_key, 
+        'numOfRows': str(rows), 
+        'pageNo': '1',
+        'base_date': bd, 
+        'base_time': bt, 
+        'nx': nx, 
+        'ny': ny, 
+        'dataType': 'JSON' # Changed to JSON for easier debug
+    }
+    data = fetch_json(endpoint, f"{api_url(KMA_PATH)}/{endpoint}", params, f"{nx},{ny}", bd + bt, expires, label=label,
+                      deadline=deadline)
+    try:
+        if not data: raise Exception(f"{label} Fetch Failed")
+        return data['response']['body']['items']['item']
+    except Exception as e:
+        log_debug(f"{label} Parse Fail: {e}", level='warning')
+        return []
+
+def build_weather_info(ncst_items, fcst_items, vilage_items, now=None):
+    """weather_info dict from the 초단기실황 / 초단기예보 / 단기예보 items (partial if some are missing)."""
+    now = now or datetime.now()
+    weather_info = {}
+
+    # 1. 초단기실황
+    for item in ncst_items:
+        cat = item['category']
+        val = item['obsrValue']
+        if cat == 'T1H':
+            try: weather_info['temp'] = float(val)
+            except: weather_info['temp'] = 0.0
+        elif cat == 'RN1':
+            try: weather_info['current_rain_amount'] = float(val)
+            except: weather_info['current_rain_amount'] = 0.0
+
+    # 2. 초단기예보
+    fcst = ForecastGrid.from_items(fcst_items)
+    closest = fcst.nearest(now, not_before=now - timedelta(minutes=30))
+
+    if closest is not None:
+        pty = int(fcst.value('PTY', closest, 0))
+        weather_info['weather_main_code'] = pty
+        weather_info['weather_description'] = describe_sky(int(fcst.value('SKY', closest, 1)), pty)
+    else:
+         # Fallback if no forecast
+         weather_info['weather_description'] = '정보없음'
+
+    # 6시간 강수 예보
+    weather_info['rain_forecast'] = fcst.rain_window(now, hours=6, amount='RN1')
+
+    # 3. 단기예보 (최고기온, 강수확률)
+    if vilage_items:
+        vilage = vilage_items if isinstance(vilage_items, ForecastGrid) else ForecastGrid.from_items(vilage_items)
+        tmx = vilage.daily_max('TMX', now)
+        if tmx is not None: weather_info['max_temp'] = tmx
+        weather_info['pop'] = vilage.daily_max('POP', now) or 0
+
+    # Merge Temp if present in forecast but missed in live (fallback)
+    if 'temp' not in weather_info and closest is not None:
+         t1h = fcst.value('T1H', closest)
+         if t1h is not None:
+             weather_info['temp'] = t1h
+             
+    return weather_info
+
+# --- [Concurrent Gathering] ---
+# The three KMA calls and the AirKorea call are independent: they run in parallel on a small
+# shared pool, so acquiring data takes as long as the slowest endpoint, not the sum. gather()
+# waits at most `deadline` seconds overall and returns whatever arrived (partial data);
+# late calls finish in the background and land in the response cache for the next caller.
+
+FETCH_WORKERS = 6 # 3 KMA endpoints + up to 3 dust station candidates
+FETCH_DEADLINE = 45 # Seconds for one gather() (fits a 3-minute battery wake with room to render)
+
+WEATHER_ENDPOINTS = (('getUltraSrtNcst', "Weather(1)"), ('getUltraSrtFcst', "Weather(2)"),
+                     ('getVilageFcst', "Weather(3)"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='fetch')
+        return _executor
+
+
+def _decode_key(api_key):
     # Decode API Key if it's URL encoded (Common mistake)
-    if '%' in api_key:
+    if api_key and '%' in api_key:
         try:
             from urllib.parse import unquote
             api_key = unquote(api_key)
         except: pass
-        
-    weather_info = {}
-    try:
-        # 1. 초단기실황
-        bd, bt = get_kma_base_time('ultrasrt')
-        url = "http://apis.data.go.kr/1360000/VilageFcstInfoService_2.0/getUltraSrtNcst"
-        params = {
-            'serviceKey': api_key, 
-            'numOfRows': '10', 
-            'pageNo': '1',
-            'base_date': bd, 
-            'base_time': bt, 
-            'nx': nx, 
-            'ny': ny, 
-            'dataType': 'JSON' # Changed to JSON for easier debug
-        }
-        
-        # Requests automatically encodes params, but serviceKey is tricky.
-        # We must append serviceKey manually if normal params fail.
-        # But requests usually handles it. try manual string construction if fails.
-        
-        log_debug(f"🌤️ Weather API Request: {url}")
-        log_debug(f"🔑 Key used: {api_key[:10]}... (Contains %: {'%' in api_key})")
-        
-        res = fetch_with_retry(url, params, label="Weather(1)")
-        
-        log_debug(f"📡 Final URL: {res.url if res else 'None'}") 
-        
-        try:
-            if not res: raise Exception("Weather(1) Fetch Failed")
-            data = res.json()
-            items = data['response']['body']['items']['item']
-        except: 
-            # JSON Fail -> Try XML Fallback logic or just Log
-            log_debug(f"Weather(1) Parse Fail. Raw: {res.text[:200] if res else 'NoRes'}", level='warning')
-            log_debug(f"Weather JSON Parse Fail. Status: {res.status_code}", level='error')
-            log_debug(f"Raw Response: {res.text[:500]}", level='error') # Print first 500 chars
-            items = []
-
-        for item in items:
-            cat = item['category']
-            val = item['obsrValue']
-            if cat == 'T1H':
-                try: weather_info['temp'] = float(val)
-                except: weather_info['temp'] = 0.0
-            elif cat == 'RN1':
-                try: weather_info['current_rain_amount'] = float(val)
-                except: weather_info['current_rain_amount'] = 0.0
-
-        # 2. 초단기예보
-        bd, bt = get_kma_base_time('ultrasrt_fcst')
-        url = "http://apis.data.go.kr/1360000/VilageFcstInfoService_2.0/getUltraSrtFcst"
-        params['base_date'] = bd
-        params['base_time'] = bt
-        params['numOfRows'] = '60'
-        
-        res = fetch_with_retry(url, params, label="Weather(2)")
-        
-        try:
-            if not res: raise Exception("Weather(2) Fetch Failed")
-            data = res.json()
-            items = data['response']['body']['items']['item']
-        except: items = []
-        
-        forecasts = {}
-        for item in items:
-            dt = item['fcstDate'] + item['fcstTime']
-            if dt not in forecasts: forecasts[dt] = {}
-            forecasts[dt][item['category']] = item['fcstValue']
-
-        now = datetime.now()
-        closest_time = min(
-            [t for t in forecasts.keys() if datetime.strptime(t, '%Y%m%d%H%M') >= now - timedelta(minutes=30)],
-            key=lambda x: abs(datetime.strptime(x, '%Y%m%d%H%M') - now), default=None)
-
-        if closest_time:
-            sky = int(forecasts[closest_time].get('SKY', '1'))
-            pty = int(forecasts[closest_time].get('PTY', '0'))
-            weather_info['weather_main_code'] = pty
-            if pty == 0:
-                weather_info['weather_description'] = ['맑음', '맑음', '구름 많음', '흐림'][sky - 1] if sky <= 4 else '흐림'
-            else:
-                weather_info['weather_description'] = ['', '비', '비 또는 눈', '눈', '소나기'][pty]
-        else:
-             # Fallback if no forecast
-             weather_info['weather_description'] = '정보없음'
-
-        # 6시간 강수 예보
-        max_rain = None
-        for t in sorted(forecasts.keys()):
-            ft = datetime.strptime(t, '%Y%m%d%H%M')
-            if now <= ft <= now + timedelta(hours=6):
-                pty = int(forecasts[t].get('PTY', '0'))
-                try:
-                    rn1_val = forecasts[t].get('RN1', '0')
-                    if rn1_val in ['강수없음', 'null', '-']: rn1 = 0.0
-                    else: rn1 = float(rn1_val)
-                except: rn1 = 0.0
-                if pty > 0 and rn1 > 0:
-                    if not max_rain or rn1 > max_rain['amount']:
-                        max_rain = {'amount': rn1, 'start_time': ft.strftime('%H:%M'),
-                                    'end_time': (ft + timedelta(hours=1)).strftime('%H:%M'), 'type_code': pty}
-        weather_info['rain_forecast'] = max_rain
-        
-        # 3. 단기예보 (최고기온, 강수확률)
-        try:
-            v_bd, v_bt = get_vilage_base_time()
-            url_vilage = "http://apis.data.go.kr/1360000/VilageFcstInfoService_2.0/getVilageFcst"
-            params_vilage = params.copy()
-            params_vilage['base_date'] = v_bd
-            params_vilage['base_time'] = v_bt
-            params_vilage['numOfRows'] = '300'
-            
-            res_v = fetch_with_retry(url_vilage, params_vilage, label="Weather(3)")
-            if res_v:
-                data_v = res_v.json()
-                items_v = data_v['response']['body']['items']['item']
-                today_str = now.strftime('%Y%m%d')
-                
-                tmx = None
-                pop_max = 0
-                
-                for item in items_v:
-                    if item['fcstDate'] == today_str:
-                        if item['category'] == 'TMX':
-                            try: tmx = float(item['fcstValue'])
-                            except: pass
-                        elif item['category'] == 'POP':
-                            try: 
-                                p_val = float(item['fcstValue'])
-                                if p_val > pop_max: pop_max = p_val
-                            except: pass
-                
-                if tmx is not None: weather_info['max_temp'] = tmx
-                weather_info['pop'] = pop_max
-        except Exception as e:
-            log_debug(f"Weather(3) Parse Error: {e}", level='warning')
-
-        # Merge Temp if present in forecast but missed in live (fallback)
-        if 'temp' not in weather_info and closest_time:
-             if 'T1H' in forecasts[closest_time]:
-                 weather_info['temp'] = float(forecasts[closest_time]['T1H'])
-                 
-        return weather_info
-    except Exception as e:
-        logger.error(f"Weather API Error: {e}")
-        # Return partial info if available
-        if weather_info: return weather_info
-        return None
+    return api_key
+
+
+def gather(kma_key=None, nx=None, ny=None, air_key=None, station_name=None, deadline=FETCH_DEADLINE):
+    """
+    Weather and dust fetched concurrently. Returns (weather_info or None, dust dict or None);
+    weather is skipped without a KMA key, dust without an AirKorea key or station.
+    `station_name` may be a list of candidates (nearest first): all are queried, the nearest
+    valid reading wins (see stations.for_location).
+    """
+    t0 = time.time()
+    shared = resilience.Deadline(deadline) # Bounds every attempt and backoff of the four calls
+    pool = _get_executor()
+    futures = {}
+    kma_key = _decode_key(kma_key)
+    if kma_key:
+        log_debug(f"🌤️ Weather API Request: {api_url(KMA_PATH)} ({nx},{ny})")
+        log_debug(f"🔑 Key used: {kma_key[:10]}... (Contains %: {'%' in kma_key})")
+        for endpoint, label in WEATHER_ENDPOINTS:
+            futures[endpoint] = pool.submit(_kma_items, endpoint, kma_key, nx, ny, label, shared)
+    stations = [station_name] if isinstance(station_name, str) else list(station_name or [])
+    if air_key:
+        for name in stations:
+            futures[('dust', name)] = pool.submit(get_fine_dust_data, air_key, name, shared)
+    if not futures:
+        return None, None
+
+    done, pending = wait(list(futures.values()), timeout=deadline)
+    results = {}
+    for name, future in futures.items():
+        if future in done:
+            try: results[name] = future.result()
+            except Exception as e: log_debug(f"Gather {name} Error: {e}", level='warning')
+    if pending:
+        late = [name for name, f in futures.items() if f in pending]
+        log_debug(f"Gather deadline ({deadline}s) passed, missing: {late}", level='warning')
+
+    weather = None
+    if kma_key:
+        items = [results.get(endpoint) or [] for endpoint, _ in WEATHER_ENDPOINTS]
+        if any(items):
+            try:
+                weather = build_weather_info(*items)
+            except Exception as e:
+                logger.error(f"Weather API Error: {e}")
+    dust = nearest_valid_dust(stations, {name[1]: r for name, r in results.items() if isinstance(name, tuple)})
+    log_debug(f"Gather done in {time.time() - t0:.2f}s (weather={bool(weather)}, dust={dust.get('station') if dust else None})")
+    return weather, dust
+
+
+def get_weather_data(api_key, nx, ny, deadline=FETCH_DEADLINE):
+    if not api_key: return None
+    return gather(api_key, nx, ny, deadline=deadline)[0]
@@ -0,0 +1,132 @@
+import numpy as np
+from datetime import datetime, timedelta
+
+# --- [Columnar Forecast Grid] ---
+# KMA forecast items arrive as one dict of strings per (category, fcstDate, fcstTime).
+# ForecastGrid parses them once into columns: `hours` (sorted datetime64[h]) and one float32
+# array per category aligned with it (NaN where a category has no value for that hour).
+# Queries are array operations instead of strptime() inside min() keys and rescans:
+#   nearest()      slot closest to a time (optionally not before a bound)
+#   rain_window()  heaviest precipitation hour in [start, start + hours]
+#   daily_max() / daily_min() / max_over()
+# A 3-day getVilageFcst grid is ~13 columns x 80 hours: small enough to keep many in memory.
+
+PRECIP_CATEGORIES = ('PCP', 'RN1', 'SNO') # Text amounts ('강수없음', '1mm 미만', '30.0~50.0mm')
+HOUR = np.timedelta64(1, 'h')
+
+
+def parse_precip(val):
+    """단기예보 PCP ('강수없음', '1mm 미만', '2.0mm', '30.0~50.0mm', '50.0mm 이상') -> mm."""
+    val = str(val or '').strip()
+    if not val or val in ('강수없음', '적설없음', 'null', '-'): return 0.0
+    if '미만' in val: return 0.5
+    try:
+        return float(val.replace('mm', '').replace('cm', '').replace('이상', '').split('~')[0].strip())
+    except ValueError:
+        return 0.0
+
+
+def _number(val):
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _float(v):
+    """float32 cell -> Python float without float32 noise (KMA values have at most one decimal)."""
+    return round(float(v), 2)
+
+
+class ForecastGrid:
+    def __init__(self, hours, columns):
+        self.hours = hours
+        self.columns = columns
+
+    @classmethod
+    def from_items(cls, items, value_key='fcstValue'):
+        """Grid from KMA forecast items (getUltraSrtFcst / getVilageFcst)."""
+        if not items:
+            return cls(np.array([], dtype='datetime64[h]'), {})
+        when = np.array([f"{i['fcstDate'][:4]}-{i['fcstDate'][4:6]}-{i['fcstDate'][6:8]}T{i['fcstTime'][:2]}"
+                         for i in items], dtype='datetime64[h]')
+        hours, slot = np.unique(when, return_inverse=True)
+
+        by_category = {}
+        for i, item in enumerate(items):
+            by_category.setdefault(item['category'], []).append(i)
+        columns = {}
+        for cat, idx in by_category.items():
+            parse = parse_precip if cat in PRECIP_CATEGORIES else _number
+            col = np.full(len(hours), np.nan, dtype=np.float32)
+            col[slot[idx]] = [parse(items[i][value_key]) for i in idx]
+            columns[cat] = col
+        return cls(hours, columns)
+
+    def __len__(self):
+        return len(self.hours)
+
+    def column(self, category):
+        col = self.columns.get(category)
+        return col if col is not None else np.full(len(self.hours), np.nan, dtype=np.float32)
+
+    def value(self, category, index, default=None):
+        v = self.column(category)[index]
+        return default if np.isnan(v) else _float(v)
+
+    def time(self, index):
+        return self.hours[index].astype(datetime)
+
+    def stamp(self, index):
+        """'YYYYMMDDHHMM' of a slot (KMA fcstDate + fcstTime)."""
+        return self.time(index).strftime('%Y%m%d%H%M')
+
+    def span(self, category='TMP'):
+        """(first, last) hour having `category`, or None."""
+        valid = self.hours[~np.isnan(self.column(category))]
+        return (valid[0].astype(datetime), valid[-1].astype(datetime)) if len(valid) else None
+
+    def nearest(self, when, category=None, not_before=None):
+        """Index of the slot closest to `when` (having `category`, at or after `not_before`), or None."""
+        mask = np.ones(len(self.hours), dtype=bool)
+        if category:
+            mask &= ~np.isnan(self.column(category))
+        if not_before is not None:
+            mask &= self.hours >= np.datetime64(not_before, 'm')
+        if not mask.any():
+            return None
+        dist = np.abs((self.hours - np.datetime64(when, 'm')).astype('timedelta64[m]').astype(np.int64))
+        return int(np.argmin(np.where(mask, dist, np.iinfo(np.int64).max)))
+
+    def _window(self, start, end):
+        return (self.hours >= np.datetime64(start, 'm')) & (self.hours <= np.datetime64(end, 'm'))
+
+    def rain_window(self, start, hours=6, amount='PCP'):
+        """Heaviest precipitation hour in [start, start + hours] ({amount, start_time, end_time, type_code}) or None."""
+        amounts = np.nan_to_num(self.column(amount))
+        pty = np.nan_to_num(self.column('PTY'))
+        mask = self._window(start, start + timedelta(hours=hours)) & (pty > 0) & (amounts > 0)
+        if not mask.any():
+            return None
+        i = int(np.argmax(np.where(mask, amounts, -1))) # First of equal maxima
+        ft = self.time(i)
+        return {'amount': _float(amounts[i]), 'start_time': ft.strftime('%H:%M'),
+                'end_time': (ft + timedelta(hours=1)).strftime('%H:%M'), 'type_code': int(pty[i])}
+
+    def _day(self, day):
+        first = np.datetime64(day.strftime('%Y-%m-%d'), 'h')
+        return (self.hours >= first) & (self.hours < first + 24 * HOUR)
+
+    def _reduce(self, fn, category, mask):
+        values = self.column(category)[mask]
+        values = values[~np.isnan(values)]
+        return _float(fn(values)) if len(values) else None
+
+    def daily_max(self, category, day):
+        return self._reduce(np.max, category, self._day(day))
+
+    def daily_min(self, category, day):
+        return self._reduce(np.min, category, self._day(day))
+
+    def max_over(self, category, start, end):
+        return self._reduce(np.max, category, self._window(start, end))
@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import settings
+import data_api
+import live_data
+from forecast_grid import ForecastGrid
+
+try:
+    from utils.logger import log_debug
+except ImportError:
+    log_debug = lambda msg, level='info': None # Fallback
+
+logger = logging.getLogger(__name__)
+
+# --- [Offline Forecast Store] ---
+# Connecting to Wi-Fi just to fetch weather dominates a battery wake's energy. getVilageFcst
+# returns ~3 days of hourly TMP/SKY/PTY/PCP/POP (+ daily TMX), so whenever the frame is online
+# the full forecast is kept in FORECAST_STORE_PATH, and "what will the weather be at T"
+# is answered locally (data_api.forecast_weather over the stored items' ForecastGrid).
+#
+# online_reasons() is the policy deciding whether a wake must go online:
+#   no_forecast    nothing stored for this nx/ny
+#   forecast_age   the stored forecast was issued more than max_forecast_age_hours ago
+#   horizon        it covers less than min_horizon_hours past the wake
+#   dust_age       the last dust reading is older than max_dust_age_hours (dust has no forecast)
+# With wifi_off_offline the shutdown sequence turns the Wi-Fi radio off when the next wake
+# can stay offline (and back on otherwise); off by default, the web UI needs Wi-Fi.
+
+DEFAULT_FORECAST_SETTINGS = {
+    "enabled": True,
+    "max_forecast_age_hours": 12,
+    "min_horizon_hours": 6,
+    "max_dust_age_hours": 3,
+    "wifi_off_offline": False
+}
+
+_lock = threading.Lock()
+_cache = {'mtime': None, 'data': None, 'grid': None}
+
+
+def get_forecast_settings(config=None):
+    cfg = (config or settings.load_config()).get('forecast_settings', {}) or {}
+    merged = dict(DEFAULT_FORECAST_SETTINGS)
+    merged.update({k: v for k, v in cfg.items() if k in DEFAULT_FORECAST_SETTINGS})
+    return merged
+
+
+def load():
+    """Stored forecast {scope, base, fetched_at, items} (cached in memory until the file changes)."""
+    with _lock:
+        try:
+            mtime = os.path.getmtime(settings.FORECAST_STORE_PATH)
+        except OSError:
+            return None
+        if _cache['mtime'] != mtime:
+            try:
+                with open(settings.FORECAST_STORE_PATH, 'r', encoding='utf-8') as f:
+                    _cache['data'] = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Forecast store unreadable: {e}")
+                _cache['data'] = None
+            _cache['mtime'], _cache['grid'] = mtime, None
+        return _cache['data']
+
+
+def _save(store):
+    """Atomic write (temp + rename), same pattern as settings.save_config."""
+    with _lock:
+        os.makedirs(os.path.dirname(settings.FORECAST_STORE_PATH), exist_ok=True)
+        tmp_path = f"{settings.FORECAST_STORE_PATH}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(store, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, settings.FORECAST_STORE_PATH)
+        except Exception as e:
+            logger.error(f"Forecast store save failed: {e}")
+            try: os.remove(tmp_path)
+            except OSError: pass
+
+
+def refresh(api_key, nx, ny, deadline=None):
+    """Fetch the full multi-day forecast (response cache first) and store it. Returns True on success."""
+    items, base = data_api.get_vilage_items(api_key, nx, ny, deadline)
+    if not items:
+        return False
+    current = load()
+    if current and current.get('scope') == f"{nx},{ny}" and current.get('base') == base:
+        return True # Already stored
+    _save({'scope': f"{nx},{ny}", 'base': base, 'fetched_at': time.time(), 'items': items})
+    log_debug(f"FORECAST | Stored {len(items)} items (base {base}, {nx},{ny})")
+    return True
+
+
+def grid():
+    """ForecastGrid of the stored items (parsed once per store file), or None."""
+    store = load()
+    if not store or not store.get('items'):
+        return None
+    with _lock:
+        if _cache['grid'] is None and _cache['data'] is store:
+            _cache['grid'] = ForecastGrid.from_items(store['items'])
+        return _cache['grid'] if _cache['data'] is store else ForecastGrid.from_items(store['items'])
+
+
+def coverage():
+    """(first, last) forecast hour of the stored forecast, or None."""
+    g = grid()
+    return g.span('TMP') if g else None
+
+
+def weather_at(when, nx, ny):
+    """Forecast weather dict for `when` from the store, or None if it does not cover that time."""
+    store = load()
+    if not store or store.get('scope') != f"{nx},{ny}":
+        return None
+    span = coverage()
+    if not span or not (span[0] - timedelta(hours=1) <= when <= span[1] + timedelta(hours=1)):
+        return None
+    weather = data_api.forecast_weather(grid(), when)
+    if weather:
+        weather['forecast_base'] = store.get('base')
+    return weather
+
+
+def online_reasons(when, nx, ny, station=None, config=None):
+    """Why a wake at `when` must go online (empty list: it can run from stored data)."""
+    options = get_forecast_settings(config)
+    store = load()
+    reasons = []
+    span = coverage()
+    if not store or store.get('scope') != f"{nx},{ny}" or not span:
+        reasons.append('no_forecast')
+    else:
+        issued = datetime.strptime(store['base'], '%Y%m%d%H%M')
+        if when - issued > timedelta(hours=float(options['max_forecast_age_hours'])):
+            reasons.append('forecast_age')
+        if span[1] < when + timedelta(hours=float(options['min_horizon_hours'])):
+            reasons.append('horizon')
+    if station:
+        dust = live_data.load_store().get('dust') or {}
+        fetched = dust.get('fetched_at')
+        # Age the reading will have at `when` (planned at shutdown for the next wake)
+        age_at_wake = time.time() - fetched + max(0, (when - datetime.now()).total_seconds()) if fetched else None
+        if dust.get('scope') not in live_data.dust_names(station) or age_at_wake is None or age_at_wake > float(options['max_dust_age_hours']) * 3600:
+            reasons.append('dust_age')
+    return reasons
+
+
+def can_stay_offline(when, nx, ny, station=None, config=None):
+    if not get_forecast_settings(config)['enabled']:
+        return False
+    reasons = online_reasons(when, nx, ny, station, config)
+    if reasons:
+        log_debug(f"FORECAST | Wake at {when:%m/%d %H:%M} goes online: {', '.join(reasons)}")
+    return not reasons
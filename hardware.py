@@ -273,3 +273,12 @@ class HardwareController:
         
         cmd = f"sudo nmcli dev wifi connect '{ssid}' password '{password}'"
         return os.system(cmd) == 0
+
+    def set_wifi_radio(self, enabled):
+        """Wi-Fi 라디오 켜기/끄기 (NetworkManager keeps the state across reboots)"""
+        if not IS_RPI:
+            logger.info(f"[Mock] Wi-Fi radio {'on' if enabled else 'off'}")
+            return True
+
+        cmd = f"sudo nmcli radio wifi {'on' if enabled else 'off'}"
+        return os.system(cmd) == 0
@@ -0,0 +1,89 @@
+import os
+import json
+import hashlib
+
+from flask import g, request, send_file, send_from_directory, make_response
+
+# --- [HTTP Caching Policy] ---
+# Routes pick a policy with set_policy(); the app's after_request hook applies it.
+# Anything that did not choose a policy (dynamic JSON APIs) stays 'no-store'.
+#
+#   no-store    : dynamic JSON (config, battery, wifi ...)
+#   revalidate  : always revalidate with ETag/Last-Modified (HTML shell, static preview.jpg, /api/preview)
+#   photo       : uploads / thumbnails, strong ETag (content hash) + short max-age
+#   immutable   : content-hashed asset bundles (/assets/index-<hash>.js), cache for a year
+
+PHOTO_MAX_AGE = 60
+IMMUTABLE_MAX_AGE = 31536000
+
+POLICIES = {
+    'no-store': 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0, max-age=0',
+    'revalidate': 'no-cache',
+    'private-revalidate': 'private, no-cache',
+    'photo': f'public, max-age={PHOTO_MAX_AGE}',
+    'immutable': f'public, max-age={IMMUTABLE_MAX_AGE}, immutable',
+}
+
+
+def set_policy(name):
+    g.cache_policy = name
+
+
+def apply_policy(response):
+    """after_request: stamp Cache-Control according to the policy chosen by the route."""
+    policy = g.get('cache_policy')
+    if policy is None:
+        policy = 'revalidate' if request.endpoint == 'static' else 'no-store'
+
+    response.headers['Cache-Control'] = POLICIES[policy]
+    if policy == 'no-store':
+        response.headers['Pragma'] = 'no-cache'
+        response.headers['Expires'] = '-1'
+    else:
+        response.headers.pop('Pragma', None)
+        response.headers.pop('Expires', None)
+    return response
+
+
+def make_etag(*parts):
+    """Stable ETag value from arbitrary JSON-serialisable inputs."""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def is_not_modified(etag):
+    """True if the request's If-None-Match already matches `etag` (skip the work, answer 304)."""
+    return request.if_none_match.contains(etag)
+
+
+def not_modified_response(etag):
+    response = make_response('', 304)
+    response.set_etag(etag)
+    return response
+
+
+def send_photo(path, etag=None):
+    """
+    Serve an upload/thumbnail with strong validators and Range support.
+    `etag` is the content hash when known; legacy files get werkzeug's mtime/size ETag.
+    """
+    set_policy('photo')
+    return send_file(path, conditional=True, etag=etag if etag else True,
+                     last_modified=os.path.getmtime(path))
+
+
+def send_immutable(directory, path):
+    """
+    Content-hashed bundle: long max-age + immutable (the filename changes on every build).
+    The policy is set only once the file is found; a 404 (NotFound raised here) stays no-store.
+    """
+    response = send_from_directory(directory, path, conditional=True)
+    set_policy('immutable')
+    return response
+
+
+def send_revalidated(response):
+    """Attach an ETag to an in-memory response and answer 304 when the client already has it."""
+    set_policy('revalidate')
+    response.add_etag()
+    return response.make_conditional(request)
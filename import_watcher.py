@@ -0,0 +1,334 @@
+import os
+import json
+import time
+import zlib
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import settings
+import ingest
+import shuffle_deck
+
+try:
+    from utils.logger import log_debug
+except ImportError:
+    log_debug = lambda msg, level='info': None # Fallback
+
+logger = logging.getLogger(__name__)
+
+# --- [Watched Import Folder] ---
+# Photos copied in bulk (SMB / USB) into IMPORT_DIR are ingested through the same path
+# as /upload (dedup, HEIC/ICC, index, thumbnail) by a small worker pool.
+#   - inotify (ctypes, no extra package) with a polling fallback
+#   - debounce: a file is picked up only after `debounce_sec` without events and a stable size
+#   - incremental: import_state.json remembers (size, mtime) of every processed file,
+#     so a restart only scans directory entries instead of re-ingesting everything
+
+DEFAULT_IMPORT_SETTINGS = {
+    "enabled": True,
+    "debounce_sec": 3,
+    "poll_sec": 10,
+    "workers": 2
+}
+
+IMPORT_EXTS = ('.jpg', '.jpeg', '.png', '.bmp', '.heic', '.heif')
+IGNORED_SUFFIXES = ('.tmp', '.part', '.crdownload')
+
+# inotify constants (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def get_import_settings():
+    cfg = settings.load_config().get('import_settings', {}) or {}
+    merged = dict(DEFAULT_IMPORT_SETTINGS)
+    merged.update({k: v for k, v in cfg.items() if k in DEFAULT_IMPORT_SETTINGS})
+    return merged
+
+
+def _is_candidate(path):
+    base = os.path.basename(path)
+    if base.startswith(('.', '~$')): return False
+    low = base.lower()
+    return low.endswith(IMPORT_EXTS) and not low.endswith(IGNORED_SUFFIXES)
+
+
+def _import_name(path):
+    """Upload-compatible name (secure_filename), with a fallback for non-ASCII names."""
+    from werkzeug.utils import secure_filename
+    base = os.path.basename(path)
+    ext = os.path.splitext(base)[1]
+    name = secure_filename(base)
+    if not os.path.splitext(name)[0] or name.lower() == ext.lower().lstrip('.'):
+        name = f"import_{zlib.crc32(base.encode('utf-8', 'surrogateescape')):08x}{ext.lower()}"
+    return name
+
+
+class _Inotify:
+    """Minimal inotify wrapper over libc (recursive watches are added by the caller)."""
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            raise OSError("libc not found")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {} # wd -> directory
+
+    def add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed: {path}")
+        self.watches[wd] = path
+        return wd
+
+    def read_events(self, timeout):
+        """Yield (path, mask) for events within `timeout` seconds."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN: return
+            raise
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(buf):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(buf, offset)
+            offset += _EVENT_HEADER.size
+            name = buf[offset:offset + length].rstrip(b'\0').decode('utf-8', 'surrogateescape')
+            offset += length
+            directory = self.watches.get(wd)
+            if directory is not None or mask & IN_Q_OVERFLOW:
+                yield (os.path.join(directory, name) if directory and name else directory), mask
+
+    def close(self):
+        try: os.close(self.fd)
+        except OSError: pass
+
+
+class ImportWatcher:
+    def __init__(self, import_dir=None, options=None):
+        self.import_dir = import_dir or settings.IMPORT_DIR
+        self.options = options or get_import_settings()
+        self.mode = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pending = {} # path -> (last_event_time, last_size)
+        self._in_flight = set()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(self.options['workers'])),
+                                        thread_name_prefix='import')
+        self._state = self._load_state()
+        self._state_dirty = False
+        self._last_save = 0
+        self._seen = {} # polling mode: path -> (size, mtime_ns)
+        self.stats = {'queued': 0, 'done': 0, 'duplicates': 0, 'failed': 0, 'skipped': 0}
+        self.recent = deque(maxlen=20)
+
+    # --- state ---
+    def _load_state(self):
+        try:
+            with open(settings.IMPORT_STATE_PATH, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Import state unreadable, rescanning: {e}")
+            return {}
+
+    def _save_state(self, force=False):
+        with self._lock:
+            if not self._state_dirty or (not force and time.time() - self._last_save < 2):
+                return
+            snapshot = dict(self._state)
+            self._state_dirty = False
+            self._last_save = time.time()
+        tmp_path = settings.IMPORT_STATE_PATH + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, settings.IMPORT_STATE_PATH)
+        except Exception as e:
+            logger.error(f"Import state save failed: {e}")
+
+    def _rel(self, path):
+        return os.path.relpath(path, self.import_dir)
+
+    def _already_imported(self, path, st):
+        entry = self._state.get(self._rel(path))
+        return bool(entry) and entry.get('size') == st.st_size and entry.get('mtime_ns') == st.st_mtime_ns \
+            and entry.get('status') in ('done', 'duplicate')
+
+    # --- lifecycle ---
+    def start(self):
+        os.makedirs(self.import_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name='import-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread: self._thread.join(timeout=5)
+        self._pool.shutdown(wait=True)
+        self._save_state(force=True)
+
+    def _run(self):
+        inotify = None
+        try:
+            inotify = _Inotify()
+            for root, dirs, _ in os.walk(self.import_dir):
+                inotify.add_watch(root)
+            self.mode = 'inotify'
+        except Exception as e:
+            logger.warning(f"inotify unavailable ({e}), falling back to polling")
+            if inotify: inotify.close()
+            inotify = None
+            self.mode = 'polling'
+
+        log_debug(f"IMPORT | Watching {self.import_dir} ({self.mode})")
+        self._scan(initial=True) # Incremental startup scan
+
+        last_poll = time.time()
+        try:
+            while not self._stop.is_set():
+                if inotify:
+                    for path, mask in inotify.read_events(timeout=1.0):
+                        if mask & IN_Q_OVERFLOW or path is None:
+                            self._scan() # Events lost: fall back to a directory scan
+                        elif mask & IN_ISDIR:
+                            if mask & (IN_CREATE | IN_MOVED_TO):
+                                inotify.add_watch(path)
+                                self._scan(path) # Files may have landed before the watch existed
+                        elif _is_candidate(path):
+                            self._touch(path)
+                else:
+                    self._stop.wait(1.0)
+                    if time.time() - last_poll >= float(self.options['poll_sec']):
+                        self._scan()
+                        last_poll = time.time()
+
+                self._dispatch_ready()
+                self._save_state()
+        except Exception as e:
+            logger.error(f"Import watcher crashed: {e}", exc_info=True)
+        finally:
+            if inotify: inotify.close()
+
+    # --- detection ---
+    def _touch(self, path, size=None):
+        with self._lock:
+            if path in self._in_flight: return
+            prev = self._pending.get(path)
+            self._pending[path] = (time.time(), size if size is not None else (prev[1] if prev else None))
+
+    def _scan(self, root=None, initial=False):
+        for dirpath, _, files in os.walk(root or self.import_dir):
+            for f in files:
+                path = os.path.join(dirpath, f)
+                if not _is_candidate(path): continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                sig = (st.st_size, st.st_mtime_ns)
+                if self._seen.get(path) == sig: continue # Polling: unchanged since last scan
+                self._seen[path] = sig
+                if self._already_imported(path, st):
+                    if initial: self.stats['skipped'] += 1
+                    continue
+                self._touch(path, st.st_size)
+
+    def _dispatch_ready(self):
+        debounce = float(self.options['debounce_sec'])
+        now = time.time()
+        ready = []
+        with self._lock:
+            for path, (t, last_size) in list(self._pending.items()):
+                if now - t < debounce: continue
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    del self._pending[path] # Vanished (temp file renamed away)
+                    continue
+                if size != last_size or size == 0:
+                    self._pending[path] = (now, size) # Still being written
+                    continue
+                del self._pending[path]
+                self._in_flight.add(path)
+                self.stats['queued'] += 1
+                ready.append(path)
+        for path in ready:
+            self._pool.submit(self._ingest, path)
+
+    # --- worker ---
+    def _ingest(self, path):
+        rel = self._rel(path)
+        record = {'file': rel, 'status': 'failed'}
+        try:
+            st = os.stat(path)
+            with open(path, 'rb') as f:
+                result = ingest.ingest_stream(f, _import_name(path))
+            record.update(name=result['filename'], size=st.st_size, mtime_ns=st.st_mtime_ns,
+                          status='duplicate' if result.get('duplicate') else 'done')
+            if not result.get('duplicate'):
+                shuffle_deck.insert(result['filename'])
+        except Exception as e:
+            record['error'] = str(e)
+            logger.warning(f"Import failed ({rel}): {e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(path)
+                key = {'done': 'done', 'duplicate': 'duplicates'}.get(record['status'], 'failed')
+                self.stats[key] += 1
+                self._state[rel] = {k: v for k, v in record.items() if k != 'file'}
+                self._state_dirty = True
+                self.recent.appendleft(record)
+            log_debug(f"IMPORT | {rel} -> {record.get('name')} [{record['status']}]")
+
+    def get_status(self):
+        with self._lock:
+            finished = self.stats['done'] + self.stats['duplicates'] + self.stats['failed']
+            return {
+                'running': bool(self._thread and self._thread.is_alive()),
+                'mode': self.mode,
+                'import_dir': self.import_dir,
+                'pending': len(self._pending),
+                'in_progress': len(self._in_flight),
+                'remaining': len(self._pending) + max(0, self.stats['queued'] - finished),
+                **self.stats,
+                'recent': list(self.recent)
+            }
+
+
+_watcher = None
+
+
+def start():
+    """Start the global watcher (no-op if disabled in import_settings)."""
+    global _watcher
+    options = get_import_settings()
+    if not options['enabled'] or _watcher is not None:
+        return _watcher
+    _watcher = ImportWatcher(options=options).start()
+    return _watcher
+
+
+def get_status():
+    if _watcher is None:
+        return {'running': False, 'mode': None, 'import_dir': settings.IMPORT_DIR}
+    return _watcher.get_status()
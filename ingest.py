@@ -0,0 +1,319 @@
+import os
+import shutil
+import hashlib
+import logging
+
+from datetime import datetime
+
+from PIL import Image, ImageOps, ExifTags
+
+import settings
+import photo_store
+import color_manager
+import cache_manager
+import memory_budget
+
+try:
+    from utils.logger import log_debug
+except ImportError:
+    log_debug = lambda msg, level='info': None # Fallback
+
+try:
+    import pillow_heif
+    pillow_heif.register_heif_opener()
+except ImportError:
+    pass
+
+logger = logging.getLogger(__name__)
+
+# --- [Upload Ingest] ---
+# One pass from the request stream to the final artifact in the photo store:
+#   hash -> (dedup link) -> header check -> draft/scaled decode -> sRGB -> single write.
+# No temp copy of the original, no img.copy(), no second write.
+
+DEFAULT_INGEST_SETTINGS = {
+    "max_long_edge": 2400,    # Stored derivative size (panel is 800x480; keeps zoom headroom for the web UI)
+    "max_pixels": 60000000,   # Source pixel ceiling (decompression-bomb guard)
+    "max_decode_mb": 256,     # Decoded buffer ceiling (w * h * bands)
+    "max_upload_mb": 64,      # Request body limit (MAX_CONTENT_LENGTH)
+    "jpeg_quality": 92
+}
+
+PASSTHROUGH_FORMATS = ('JPEG', 'PNG')
+
+# EXIF tags (IFD0 / Exif sub-IFD)
+EXIF_ORIENTATION = 0x0112
+EXIF_MAKE = 0x010F
+EXIF_MODEL = 0x0110
+EXIF_DATETIME = 0x0132
+EXIF_DATETIME_ORIGINAL = 0x9003
+EXIF_DATETIME_DIGITIZED = 0x9004
+THUMB_SIZE = 320
+
+
+class IngestError(ValueError):
+    """Upload rejected (bad image, over limits). `status` is the HTTP status to report."""
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def get_ingest_settings():
+    cfg = settings.load_config().get('ingest_settings', {}) or {}
+    merged = dict(DEFAULT_INGEST_SETTINGS)
+    merged.update({k: v for k, v in cfg.items() if k in DEFAULT_INGEST_SETTINGS})
+    return merged
+
+
+def _open_checked(stream, limits):
+    """
+    Open headers only (lazy) and enforce pixel/memory ceilings before any decode.
+    The ceiling is checked here rather than through Image.MAX_IMAGE_PIXELS, which is
+    process-wide and shared with the renderer and thumbnails.
+    """
+    try:
+        img = Image.open(stream)
+    except Image.DecompressionBombError as e: # Beyond Pillow's own hard limit
+        raise IngestError(f"Image too large: {e}", status=413)
+    except Exception:
+        raise IngestError("Unsupported image format")
+
+    w, h = img.size
+    bands = len(img.getbands())
+    if w * h > limits['max_pixels']:
+        raise IngestError(f"Image too large: {w}x{h}", status=413)
+    return img, w, h, bands
+
+
+def _exif_datetime(value):
+    """'YYYY:MM:DD HH:MM:SS' -> 'YYYY-MM-DDTHH:MM:SS' (None if missing/invalid)."""
+    try:
+        dt = datetime.strptime(str(value).strip().rstrip('\x00')[:19], '%Y:%m:%d %H:%M:%S')
+        return dt.isoformat()
+    except (TypeError, ValueError):
+        return None
+
+
+def _gps_degrees(dms, ref):
+    try:
+        deg = float(dms[0]) + float(dms[1]) / 60.0 + float(dms[2]) / 3600.0
+    except (TypeError, ValueError, IndexError, ZeroDivisionError):
+        return None
+    return round(-deg if ref in ('S', 'W') else deg, 6)
+
+
+def read_metadata(img):
+    """
+    EXIF summary from the file header (no pixel decode):
+    EXIF orientation, capture time, camera, GPS. Size/shape are filled in by the caller.
+    """
+    meta = {'exif_orientation': 1, 'taken': None, 'camera': None, 'gps': None}
+    try:
+        exif = img.getexif()
+    except Exception:
+        return meta
+    if not exif:
+        return meta
+
+    try: meta['exif_orientation'] = int(exif.get(EXIF_ORIENTATION, 1)) or 1
+    except (TypeError, ValueError): pass
+
+    sub = exif.get_ifd(ExifTags.IFD.Exif)
+    meta['taken'] = (_exif_datetime(sub.get(EXIF_DATETIME_ORIGINAL))
+                     or _exif_datetime(sub.get(EXIF_DATETIME_DIGITIZED))
+                     or _exif_datetime(exif.get(EXIF_DATETIME)))
+
+    make = str(exif.get(EXIF_MAKE, '') or '').strip('\x00 ')
+    model = str(exif.get(EXIF_MODEL, '') or '').strip('\x00 ')
+    if model and make and model.lower().startswith(make.lower()):
+        make = '' # "Apple" + "Apple iPhone 15" -> "Apple iPhone 15"
+    meta['camera'] = " ".join(p for p in (make, model) if p) or None
+
+    gps = exif.get_ifd(ExifTags.IFD.GPSInfo)
+    if gps and 2 in gps and 4 in gps:
+        lat = _gps_degrees(gps.get(2), gps.get(1))
+        lon = _gps_degrees(gps.get(4), gps.get(3))
+        if lat is not None and lon is not None:
+            meta['gps'] = {'lat': lat, 'lon': lon}
+    return meta
+
+
+def _target_size(w, h, max_edge):
+    scale = min(1.0, float(max_edge) / max(w, h))
+    return max(1, int(w * scale)), max(1, int(h * scale))
+
+
+def ingest_stream(stream, filename, digest=None):
+    """
+    Ingest an uploaded image stream (seekable file object) into the photo store.
+    Returns {'filename', 'duplicate', 'width', 'height', 'peak_rss_kb', 'seconds'}.
+    EXIF metadata (capture time, camera, GPS, shape) is stored on the index entry.
+    Raises IngestError for images that are rejected.
+    """
+    limits = get_ingest_settings()
+    if digest is None:
+        digest = photo_store.hash_stream(stream)
+
+    is_heic = filename.lower().endswith(('.heic', '.heif'))
+    stored_name = os.path.splitext(filename)[0] + ".jpg" if is_heic else filename
+
+    # Duplicate: metadata-only
+    if photo_store.has_blob(digest):
+        name = photo_store.link(stored_name, digest)
+        return {'filename': name, 'duplicate': True}
+
+    with memory_budget.job('ingest') as mem: # Queued while the RSS budget is busy
+        img, w, h, bands = _open_checked(stream, limits)
+        fmt = (img.format or '').upper()
+        tw, th = _target_size(w, h, limits['max_long_edge'])
+
+        meta = read_metadata(img)
+        # Rotated/mirrored EXIF orientation is baked into the stored derivative once,
+        # so the renderer, thumbnails and the web UI never have to care.
+        needs_decode = (fmt not in PASSTHROUGH_FORMATS or (tw, th) != (w, h)
+                        or meta['exif_orientation'] != 1 or color_manager.needs_conversion(img))
+
+        if not needs_decode:
+            # Already a display-ready sRGB JPEG/PNG: store the request bytes as-is (single write)
+            out_path = photo_store.temp_path(os.path.splitext(stored_name)[1])
+            stream.seek(0)
+            with open(out_path, 'wb') as f:
+                shutil.copyfileobj(stream, f, photo_store.HASH_CHUNK)
+            img.close()
+        else:
+            if fmt == 'JPEG':
+                # DCT-domain downscale while decoding (1/2, 1/4, 1/8): the full-res buffer is never allocated
+                img.draft('RGB', (tw, th))
+            dw, dh = img.size
+            if dw * dh * bands > limits['max_decode_mb'] * 1024 * 1024:
+                img.close()
+                raise IngestError(f"Decoded image exceeds memory ceiling: {dw}x{dh}x{bands}", status=413)
+
+            exif = img.info.get('exif')
+            out_fmt = 'PNG' if fmt == 'PNG' else 'JPEG'
+            if out_fmt == 'JPEG':
+                stored_name = os.path.splitext(stored_name)[0] + ".jpg"
+
+            try:
+                img.load()
+            except Exception as e:
+                raise IngestError(f"Decode failed: {e}")
+
+            if img.mode not in ('RGB', 'RGBA'):
+                img = img.convert('RGBA' if 'A' in img.getbands() and out_fmt == 'PNG' else 'RGB')
+            if img.size != (tw, th):
+                img.thumbnail((tw, th), Image.Resampling.LANCZOS, reducing_gap=3.0)
+            img = color_manager.to_srgb(img) # Cached transform, in place, at target scale
+            if meta['exif_orientation'] != 1:
+                img = ImageOps.exif_transpose(img) # At target scale (cheap)
+                if exif:
+                    fixed = Image.Exif()
+                    fixed.load(exif)
+                    fixed[EXIF_ORIENTATION] = 1
+                    exif = fixed.tobytes()
+
+            out_path = photo_store.temp_path('.png' if out_fmt == 'PNG' else '.jpg')
+            save_kwargs = {}
+            if out_fmt == 'JPEG':
+                if img.mode != 'RGB': img = img.convert('RGB')
+                save_kwargs['quality'] = int(limits['jpeg_quality'])
+            if exif: save_kwargs['exif'] = exif
+            img.save(out_path, out_fmt, **save_kwargs)
+            tw, th = img.size
+            img.close()
+
+        meta['width'], meta['height'] = tw, th # Stored (upright) dimensions
+        meta['orientation'] = 'portrait' if th > tw else ('landscape' if tw > th else 'square')
+        name = photo_store.add_file(stored_name, out_path, digest=digest, meta=meta)
+
+    # Gallery thumbnail up front, so the first /thumbs request doesn't decode the full photo
+    try:
+        thumbnail_path(name)
+    except Exception as e:
+        logger.warning(f"Thumbnail generation failed ({name}): {e}")
+
+    msg = (f"INGEST | {name} | {fmt} {w}x{h} -> {tw}x{th} | {mem.seconds:.2f}s | "
+           f"peak_rss {mem.peak_kb / 1024:.1f}MB (+{mem.delta_kb / 1024:.1f}MB)")
+    log_debug(msg)
+    return {'filename': name, 'duplicate': False, 'width': tw, 'height': th,
+            'peak_rss_kb': mem.peak_kb, 'seconds': round(mem.seconds, 3)}
+
+
+def thumbnail_path(name, size=THUMB_SIZE):
+    """
+    (path, etag) of a JPEG thumbnail for `name`, generated on first use.
+    Keyed by content hash, so renames/duplicates share one thumbnail.
+    Lives in the cache manager's 'thumbs' namespace (evicted LRU under its quota).
+    """
+    src = photo_store.resolve(name)
+    if not src:
+        return None, None
+    entry = photo_store.lookup(name)
+    if entry:
+        key = entry['hash']
+    else: # Legacy flat upload: path + mtime identifies the content
+        key = hashlib.sha1(f"{src}:{os.path.getmtime(src)}".encode('utf-8')).hexdigest()
+
+    size = max(32, min(int(size), 1024))
+    etag = f"{key}-t{size}"
+    cache_key = f"{key}_{size}"
+    thumb = cache_manager.get_path('thumbs', cache_key)
+    if thumb:
+        return thumb, etag
+
+    with Image.open(src) as img:
+        img.draft('RGB', (size, size)) # JPEG: decode at 1/2..1/8 scale
+        img = ImageOps.exif_transpose(img).convert('RGB') # Migrated legacy files keep their EXIF rotation
+        img.thumbnail((size, size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        with cache_manager.writer('thumbs', cache_key, '.jpg', tag=key) as tmp:
+            img.save(tmp, 'JPEG', quality=80)
+    return cache_manager.entry_path('thumbs', cache_key, '.jpg'), etag
+
+
+def _describe(path):
+    """EXIF summary + upright size of a stored file, from its header only (no decode)."""
+    with Image.open(path) as img:
+        meta = read_metadata(img)
+        w, h = img.size
+    if meta['exif_orientation'] in (5, 6, 7, 8): # 90/270 degree rotations
+        w, h = h, w
+    meta['width'], meta['height'] = w, h
+    meta['orientation'] = 'portrait' if h > w else ('landscape' if w > h else 'square')
+    return meta
+
+
+def migrate_legacy_uploads():
+    """
+    Move pre-store flat uploads (UPLOADS_DIR/*) into the photo store byte-for-byte under
+    their original names, so they get metadata and show up in queries. Nothing is decoded
+    or re-encoded (EXIF orientation is applied at render time, as before); the original is
+    only removed once the blob is in place and verified.
+    """
+    migrated = 0
+    for name in photo_store.legacy_files():
+        if photo_store.lookup(name):
+            continue
+        path = os.path.join(settings.UPLOADS_DIR, name)
+        tmp = photo_store.temp_path(os.path.splitext(name)[1].lower())
+        try:
+            mtime = os.path.getmtime(path)
+            digest = photo_store.hash_file(path)
+            try:
+                meta = _describe(path)
+            except Exception:
+                meta = None # Unreadable header: still moved, just without metadata
+            shutil.copy2(path, tmp) # The original stays until the copy is committed
+            stored = photo_store.add_file(name, tmp, digest=digest, meta=meta)
+            blob = photo_store.resolve(stored)
+            if stored != name or not blob or photo_store.hash_file(blob) != digest:
+                raise IOError(f"store verification failed ({stored})")
+            photo_store.set_added(name, mtime)
+            os.remove(path)
+            migrated += 1
+        except Exception as e:
+            logger.warning(f"Legacy upload migration failed ({name}): {e}")
+            try: os.remove(tmp)
+            except OSError: pass
+    if migrated:
+        log_debug(f"INGEST | Migrated {migrated} legacy uploads into the photo store")
+    return migrated
@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+
+import settings
+import data_api
+import stations
+
+try:
+    from utils.logger import log_debug
+except ImportError:
+    log_debug = lambda msg, level='info': None # Fallback
+
+logger = logging.getLogger(__name__)
+
+# --- [Last Known Good Data / Stale-While-Revalidate] ---
+# The last successful weather and dust payloads are persisted with their fetch time
+# (LAST_DATA_PATH). get() starts a refresh (data_api.gather) and waits at most
+# `network_budget_sec` for it:
+#   - refresh done in time  -> fresh data, stored as the new last known good
+#   - otherwise             -> the stored payloads, marked {'stale': True, 'age_min': ...},
+#                              while the refresh keeps running in the background and
+#                              updates the store when it lands (next render is fresh)
+# The renderer shows the age of stale data next to the time stamp.
+# A refresh already in flight for the same location / station is joined, not duplicated.
+# `station` is a name or the candidate list of stations.for_location. Dust is stored under the
+# station that actually answered, and a stored reading is usable while that station is still
+# one of the candidates (dust_names), so remembering another working station keeps the fallback.
+
+DEFAULT_DATA_SETTINGS = {
+    "network_budget_sec": 8,   # Longest a render waits on the network
+    "max_stale_hours": 12      # Older payloads are not shown at all ("--")
+}
+
+_lock = threading.Lock()
+_inflight = {} # scope -> _Refresh
+
+
+def get_data_settings(config=None):
+    cfg = (config or settings.load_config()).get('data_settings', {}) or {}
+    merged = dict(DEFAULT_DATA_SETTINGS)
+    merged.update({k: v for k, v in cfg.items() if k in DEFAULT_DATA_SETTINGS})
+    return merged
+
+
+def load_store():
+    try:
+        with open(settings.LAST_DATA_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_part(part, scope, payload):
+    """Atomic write (temp + rename), same pattern as settings.save_config."""
+    with _lock:
+        store = load_store()
+        store[part] = {'scope': scope, 'fetched_at': time.time(), 'data': payload}
+        os.makedirs(os.path.dirname(settings.LAST_DATA_PATH), exist_ok=True)
+        tmp_path = f"{settings.LAST_DATA_PATH}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(store, f, ensure_ascii=False)
+            os.replace(tmp_path, settings.LAST_DATA_PATH)
+        except Exception as e:
+            logger.error(f"Last data save failed: {e}")
+            try: os.remove(tmp_path)
+            except OSError: pass
+
+
+def _stale(entry, scope, max_stale_hours, now=None):
+    """
+    Stored payload marked with its age, or None if missing / other location / too old.
+    `scope` is one scope or a list of acceptable ones (dust: the candidate stations).
+    """
+    scopes = scope if isinstance(scope, (list, tuple)) else (scope,)
+    if not entry or entry.get('scope') not in scopes or not entry.get('data'):
+        return None
+    age = (now or time.time()) - entry.get('fetched_at', 0)
+    if age > float(max_stale_hours) * 3600:
+        return None
+    return dict(entry['data'], stale=True, age_min=int(age // 60),
+                fetched_at=datetime.fromtimestamp(entry['fetched_at']).isoformat(timespec='seconds'))
+
+
+def dust_scope(station):
+    """Key of a dust request (in-flight refreshes, preview cache): the station or the first candidate."""
+    if isinstance(station, str):
+        return station or None
+    return station[0] if station else None
+
+
+def dust_names(station):
+    """Station scopes a stored dust reading may have for `station` (a name or the candidates)."""
+    if isinstance(station, str):
+        return [station] if station else []
+    return list(station or [])
+
+
+def last_known(part, scope, config=None):
+    """
+    Stored 'weather' / 'dust' payload for `scope`, marked stale, without touching the network.
+    For dust, `scope` may be the candidate list (see dust_names).
+    """
+    options = get_data_settings(config)
+    return _stale(load_store().get(part), scope, options['max_stale_hours'])
+
+
+class _Refresh:
+    """One background gather() whose result is stored as last known good when it lands."""
+    def __init__(self, scope, args):
+        self.scope = scope
+        self.result = (None, None)
+        self.done = threading.Event()
+        threading.Thread(target=self._run, args=args, daemon=True, name='revalidate').start()
+
+    def _run(self, kma_key, nx, ny, air_key, station):
+        try:
+            weather, dust = data_api.gather(kma_key, nx, ny, air_key, station)
+            if weather: _save_part('weather', self.scope[0], weather)
+            if dust: _save_part('dust', dust.get('station') or self.scope[1], dust) # The station that answered
+            if self.scope[1]: stations.record(nx, ny, [station] if isinstance(station, str) else list(station), dust)
+            self.result = (weather, dust)
+        except Exception as e:
+            log_debug(f"Revalidate failed: {e}", level='warning')
+        finally:
+            with _lock:
+                _inflight.pop(self.scope, None)
+            self.done.set()
+
+
+def get(kma_key, nx, ny, air_key, station, budget=None, config=None):
+    """
+    (weather, dust) within the network budget: fresh when the refresh makes it in time,
+    else the last known good payloads marked stale (None when there is nothing usable).
+    """
+    options = get_data_settings(config)
+    budget = float(options['network_budget_sec'] if budget is None else budget)
+    scope = (f"{nx},{ny}" if kma_key else None, dust_scope(station) if air_key else None)
+    if scope == (None, None):
+        return None, None
+
+    with _lock:
+        refresh = _inflight.get(scope)
+        if refresh is None:
+            refresh = _inflight[scope] = _Refresh(scope, (kma_key, nx, ny, air_key, station))
+    refresh.done.wait(budget)
+    weather, dust = refresh.result
+
+    if weather and dust:
+        return weather, dust
+    store = load_store()
+    if not weather and scope[0]:
+        weather = _stale(store.get('weather'), scope[0], options['max_stale_hours'])
+    if not dust and scope[1]:
+        dust = _stale(store.get('dust'), dust_names(station), options['max_stale_hours'])
+    if not refresh.done.is_set():
+        log_debug(f"Network budget ({budget:.0f}s) passed: serving last known data, refresh continues")
+    return weather, dust
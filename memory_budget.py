@@ -0,0 +1,240 @@
+import time
+import logging
+import resource
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+import settings
+
+try:
+    from utils.logger import log_debug
+except ImportError:
+    log_debug = lambda msg, level='info': None # Fallback
+
+logger = logging.getLogger(__name__)
+
+# --- [Memory Budget] ---
+# Heavy jobs (photo decode at ingest, renders, AI generation) run through job(kind):
+#   - admission control: a job waits while current RSS + the expected cost of the job
+#     would exceed the RSS budget, or while `max_heavy_jobs` are already running.
+#     A job is always admitted when nothing else heavy is running (no deadlock).
+#   - expected cost per kind is learned from observed peaks (EWMA of the RSS delta)
+#   - peak tracking: VmHWM (reset via /proc/self/clear_refs) or ru_maxrss, plus optional
+#     tracemalloc for the Python-level peak (off by default: it slows allocation-heavy code)
+# Per-kind peaks, queue waits and rejections are exposed via get_stats() (/api/memory_stats).
+# VmHWM is process-wide, so peaks of overlapping jobs include each other.
+
+DEFAULT_MEMORY_SETTINGS = {
+    "enabled": True,
+    "rss_budget_mb": 300,     # Pi Zero 2 W: 512 MB total, leave room for the OS and the frame process
+    "max_heavy_jobs": 1,
+    "queue_timeout_sec": 120,
+    "trace_python": False
+}
+
+# Initial cost estimates before anything was measured (MB above the current RSS)
+DEFAULT_ESTIMATES_MB = {"ingest": 80, "render": 40, "prefetch": 40, "ai": 120}
+EWMA_ALPHA = 0.3
+
+
+class MemoryBusy(RuntimeError):
+    """A heavy job could not be admitted within queue_timeout_sec."""
+
+
+def get_memory_settings():
+    cfg = settings.load_config().get('memory_settings', {}) or {}
+    merged = dict(DEFAULT_MEMORY_SETTINGS)
+    merged.update({k: v for k, v in cfg.items() if k in DEFAULT_MEMORY_SETTINGS})
+    return merged
+
+
+def read_status_kb(field):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except Exception:
+        pass
+    return None
+
+
+def _reset_hwm():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5') # Reset peak RSS (VmHWM) to current RSS
+        return True
+    except Exception:
+        return False
+
+
+def current_rss_kb():
+    rss = read_status_kb('VmRSS')
+    if rss is None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # KB on Linux (upper bound)
+    return rss
+
+
+class PeakRss:
+    """
+    Peak resident memory over a block (Linux: VmHWM after resetting it via clear_refs).
+    Falls back to ru_maxrss (process lifetime peak) elsewhere.
+    """
+    def __enter__(self):
+        self.start_kb = read_status_kb('VmRSS')
+        self._reset_ok = _reset_hwm()
+        self.t0 = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.time() - self.t0
+        peak = read_status_kb('VmHWM') if self._reset_ok else None
+        if peak is None:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # KB on Linux
+        self.peak_kb = peak
+        self.delta_kb = max(0, peak - (self.start_kb or peak))
+        return False
+
+
+_cond = threading.Condition()
+_active = {} # job id -> (kind, reserved_kb)
+_waiting = 0
+_local = threading.local()
+_trace_users = 0
+_stats = {}
+
+
+def _kind_stats(kind):
+    stats = _stats.get(kind)
+    if stats is None:
+        stats = _stats[kind] = {
+            'count': 0, 'failed': 0, 'rejected': 0, 'queued': 0, 'wait_sec_total': 0.0,
+            'estimate_kb': DEFAULT_ESTIMATES_MB.get(kind, 50) * 1024,
+            'last_peak_kb': None, 'max_peak_kb': 0, 'last_delta_kb': None, 'max_delta_kb': 0,
+            'last_python_peak_kb': None, 'max_python_peak_kb': 0, 'last_seconds': None
+        }
+    return stats
+
+
+def _admit(kind, estimate_kb, options):
+    """Block until the job fits the budget. Returns the reserved KB."""
+    global _waiting
+    budget_kb = float(options['rss_budget_mb']) * 1024
+    max_jobs = max(1, int(options['max_heavy_jobs']))
+    deadline = time.time() + float(options['queue_timeout_sec'])
+    queued_at = None
+    with _cond:
+        stats = _kind_stats(kind)
+        if estimate_kb is None:
+            estimate_kb = stats['estimate_kb']
+        while True:
+            reserved = sum(r for _, r in _active.values())
+            fits = current_rss_kb() + reserved + estimate_kb <= budget_kb
+            if not _active or (fits and len(_active) < max_jobs):
+                break
+            if queued_at is None:
+                queued_at = time.time()
+                stats['queued'] += 1
+                _waiting += 1
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                _waiting -= 1
+                stats['rejected'] += 1
+                log_debug(f"MEMORY | {kind} rejected (budget {budget_kb / 1024:.0f}MB busy)", level='warning')
+                raise MemoryBusy(f"Memory budget busy ({kind}); try again later")
+            _cond.wait(min(remaining, 1.0)) # Re-check RSS periodically (other processes, GC)
+        if queued_at is not None:
+            _waiting -= 1
+            waited = time.time() - queued_at
+            stats['wait_sec_total'] += waited
+            log_debug(f"MEMORY | {kind} admitted after {waited:.1f}s in queue")
+        return estimate_kb
+
+
+@contextmanager
+def _python_trace(enabled):
+    global _trace_users
+    if not enabled:
+        yield None
+        return
+    with _cond:
+        if _trace_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _trace_users += 1
+    tracemalloc.reset_peak()
+    result = {'peak_kb': None}
+    try:
+        yield result
+    finally:
+        result['peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+        with _cond:
+            _trace_users -= 1
+            if _trace_users == 0:
+                tracemalloc.stop()
+
+
+@contextmanager
+def job(kind, estimate_mb=None):
+    """
+    Run a heavy block under the memory budget:
+        with memory_budget.job('render') as mem:
+            ...
+        mem.peak_kb, mem.delta_kb, mem.seconds
+    Raises MemoryBusy if it cannot be admitted within queue_timeout_sec.
+    Nested jobs in the same thread are measured but not admitted again.
+    """
+    options = get_memory_settings()
+    nested = getattr(_local, 'depth', 0) > 0
+    admit = options['enabled'] and not nested
+    job_id = object()
+    if admit:
+        reserved = _admit(kind, estimate_mb * 1024 if estimate_mb else None, options)
+        with _cond:
+            _active[job_id] = (kind, reserved)
+
+    _local.depth = getattr(_local, 'depth', 0) + 1
+    mem, trace, failed = PeakRss(), None, False
+    try:
+        with _python_trace(options['trace_python'] and not nested) as trace, mem:
+            yield mem
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        _local.depth -= 1
+        with _cond:
+            _active.pop(job_id, None)
+            if hasattr(mem, 'peak_kb'):
+                _record(kind, mem, trace, failed)
+            _cond.notify_all()
+
+
+def _record(kind, mem, trace, failed):
+    stats = _kind_stats(kind)
+    stats['count'] += 1
+    if failed: stats['failed'] += 1
+    stats['last_peak_kb'] = mem.peak_kb
+    stats['max_peak_kb'] = max(stats['max_peak_kb'], mem.peak_kb)
+    stats['last_delta_kb'] = mem.delta_kb
+    stats['max_delta_kb'] = max(stats['max_delta_kb'], mem.delta_kb)
+    stats['last_seconds'] = round(mem.seconds, 3)
+    if trace and trace['peak_kb'] is not None:
+        stats['last_python_peak_kb'] = trace['peak_kb']
+        stats['max_python_peak_kb'] = max(stats['max_python_peak_kb'], trace['peak_kb'])
+    # Learn the admission estimate from what this kind of job really costs
+    stats['estimate_kb'] = int((1 - EWMA_ALPHA) * stats['estimate_kb'] + EWMA_ALPHA * mem.delta_kb)
+
+
+def get_stats():
+    options = get_memory_settings()
+    with _cond:
+        return {
+            'enabled': options['enabled'],
+            'rss_kb': current_rss_kb(),
+            'budget_kb': int(float(options['rss_budget_mb']) * 1024),
+            'active': [kind for kind, _ in _active.values()],
+            'waiting': _waiting,
+            'jobs': {kind: dict(stats, wait_sec_total=round(stats['wait_sec_total'], 3))
+                     for kind, stats in _stats.items()}
+        }
@@ -0,0 +1,217 @@
+import os
+import json
+import mmap
+import hashlib
+import logging
+from datetime import datetime
+from contextlib import contextmanager
+
+import settings
+import data_api
+import renderer
+import render_sink
+import photo_store
+import shuffle_deck
+import preview_cache
+import resilience
+import forecast_store
+import stations
+
+try:
+    from utils.logger import log_debug
+except ImportError:
+    log_debug = lambda msg, level='info': None # Fallback
+
+logger = logging.getLogger(__name__)
+
+# --- [Next Wake Pre-render] ---
+# A battery wake used to spend most of its window fetching data and rendering before the panel
+# even started its refresh. Before shutdown we now know the next wake time (RTC alarm) and the
+# next photo (shuffle deck peek / pinned photo), and getVilageFcst has hourly forecasts for days:
+#   prerender()  composes the next frame with the forecast for the wake time and stores
+#                NEXT_FRAME_DIR/frame.bin (packed panel buffer), the previews and meta.json
+#   open_frame() on wake: mmap of frame.bin when it was made for this photo / layout / time,
+#                pushed to the panel right away
+#   differs()    fresh observed data vs the forecast it was drawn with; only a visible
+#                difference (temp delta, sky, dust grade, rain / battery widgets) re-renders
+# The files are one-shot: discard() after the wake that used (or rejected) them.
+
+DEFAULT_NEXT_FRAME_SETTINGS = {
+    "enabled": True,
+    "max_skew_min": 15,   # Accept the frame this far from the planned wake time
+    "temp_delta": 2.0     # °C between forecast and observation before re-rendering
+}
+
+FRAME_NAME = 'frame.bin'
+META_NAME = 'meta.json'
+# Previews of the pre-rendered frame, moved into place when the frame is shown
+PREVIEW_FILES = {
+    'preview.jpg': settings.PREVIEW_PATH,
+    'preview_eink.png': settings.PREVIEW_EINK_PATH,
+    'preview_thumb.jpg': settings.PREVIEW_THUMB_PATH
+}
+
+
+def get_next_frame_settings(config=None):
+    cfg = (config or settings.load_config()).get('next_frame_settings', {}) or {}
+    merged = dict(DEFAULT_NEXT_FRAME_SETTINGS)
+    merged.update({k: v for k, v in cfg.items() if k in DEFAULT_NEXT_FRAME_SETTINGS})
+    return merged
+
+
+def _path(name):
+    return os.path.join(settings.NEXT_FRAME_DIR, name)
+
+
+def next_photo_name(config):
+    """Photo the next refresh will show, if it is predictable (shuffle deck or pinned photo)."""
+    if config.get('shuffle_mode', False):
+        return shuffle_deck.peek_next(config)
+    return config.get('selected_photo')
+
+
+def signature(image_path, config):
+    """Everything besides weather / time that changes the frame."""
+    parts = [preview_cache.photo_identity(None, image_path),
+             preview_cache.normalize_layout(config.get('layout', {})),
+             config.get('location', {}).get('name', ''),
+             render_sink.BASE_LAYER_VERSION]
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def visible_state(weather_data, dust_data, batt_info=None):
+    """What the widgets show, minus the exact temperature (compared with a tolerance)."""
+    w, d = weather_data or {}, dust_data or {}
+    rain = w.get('rain_forecast')
+    return {
+        'temp': w.get('temp'),
+        'description': w.get('weather_description'),
+        'raining': (w.get('current_rain_amount') or 0) > 0,
+        'rain_start': rain['start_time'].split(':')[0] if rain else None,
+        'max_temp': int(w['max_temp']) if w.get('max_temp') is not None else None,
+        'pm10_grade': renderer.get_dust_grade_info(d.get('pm10'), 0)[0] if d.get('pm10') is not None else None,
+        'pm25_grade': renderer.get_dust_grade_info(0, d.get('pm25'))[0] if d.get('pm25') is not None else None,
+        'battery_alert': renderer.battery_alert_shown(batt_info)
+    }
+
+
+def prerender(wake_time, config=None, batt_info=None):
+    """
+    Render the frame for `wake_time` from the forecast (dust: latest observation) and store it.
+    Returns the meta dict, or None when there is nothing predictable to render.
+    """
+    config = config or settings.load_config()
+    discard()
+    if not get_next_frame_settings(config)['enabled']:
+        return None
+    name = next_photo_name(config)
+    image_path = photo_store.resolve(name) if name else None
+    if not image_path:
+        return None
+
+    loc = config.get('location', {})
+    nx, ny = int(loc.get('nx', 61)), int(loc.get('ny', 115))
+    deadline = resilience.Deadline(data_api.FETCH_DEADLINE) # Shutdown must not hang on the network
+    # Stored multi-day forecast first; fetch (and store) it only when it does not cover the wake
+    weather = forecast_store.weather_at(wake_time, nx, ny)
+    if not weather and forecast_store.refresh(config.get('api_key_kma', config.get('api_key', "")), nx, ny, deadline):
+        weather = forecast_store.weather_at(wake_time, nx, ny)
+    if not weather:
+        log_debug("NEXT FRAME | No forecast for the next wake, skipped", level='warning')
+        return None
+    dust = data_api.get_nearest_dust(config.get('api_key_air', config.get('api_key', "")),
+                                     stations.for_location(nx, ny, config.get('station_name', "고덕")), deadline=deadline)
+
+    comp = render_sink.compose(image_path, weather, dust, config.get('layout', {}), loc.get('name', ''),
+                               batt_info, now=wake_time, persist=True)
+    sinks = [render_sink.PanelFramebuffer(),
+             render_sink.EncodedImage(path=_path('preview.jpg')),
+             render_sink.EinkPreview(path=_path('preview_eink.png')),
+             render_sink.Thumbnail(path=_path('preview_thumb.jpg'))]
+    outputs = render_sink.render(comp, sinks)
+    render_sink.write_atomic(_path(FRAME_NAME), bytes(outputs['framebuffer']))
+
+    meta = {'wake_time': wake_time.isoformat(timespec='seconds'), 'photo': name,
+            'signature': signature(image_path, config), 'size': len(outputs['framebuffer']),
+            'state': visible_state(weather, dust, batt_info),
+            'created': datetime.now().isoformat(timespec='seconds')}
+    # Meta last: its presence marks a complete set
+    render_sink.write_atomic(_path(META_NAME), json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+    log_debug(f"NEXT FRAME | Pre-rendered {name} for {meta['wake_time']}")
+    return meta
+
+
+def load_meta(image_path, config, now=None):
+    """meta.json of a stored frame usable for `image_path` now, else None."""
+    try:
+        with open(_path(META_NAME), encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    options = get_next_frame_settings(config)
+    if not options['enabled']:
+        return None
+    now = now or datetime.now()
+    try:
+        skew = abs((now - datetime.fromisoformat(meta['wake_time'])).total_seconds())
+    except (KeyError, TypeError, ValueError):
+        return None
+    if skew > float(options['max_skew_min']) * 60:
+        return None
+    if meta.get('signature') != signature(image_path, config):
+        return None
+    expected = renderer.DISPLAY_WIDTH * renderer.DISPLAY_HEIGHT // 2
+    try:
+        if meta.get('size') != expected or os.path.getsize(_path(FRAME_NAME)) != expected:
+            return None
+    except OSError:
+        return None
+    return meta
+
+
+@contextmanager
+def open_frame():
+    """
+    Memory-mapped panel buffer (read-only), usable directly with epd.display():
+        with next_frame.open_frame() as buf:
+            epd.display(buf)
+    """
+    with open(_path(FRAME_NAME), 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield buf
+        finally:
+            buf.close()
+
+
+def differs(meta, weather_data, dust_data, batt_info=None, config=None):
+    """True when the fresh data would visibly change the pre-rendered frame."""
+    fresh = lambda d: bool(d) and not d.get('stale')
+    if not fresh(weather_data) and not fresh(dust_data):
+        return False # Nothing newer than the forecast frame
+    old, new = meta.get('state', {}), visible_state(weather_data, dust_data, batt_info)
+    keys = ['battery_alert']
+    if fresh(weather_data):
+        temp_delta = float(get_next_frame_settings(config)['temp_delta'])
+        if old.get('temp') is None or new['temp'] is None or abs(old['temp'] - new['temp']) >= temp_delta:
+            return True
+        keys += ['description', 'raining', 'rain_start', 'max_temp']
+    if fresh(dust_data):
+        keys += ['pm10_grade', 'pm25_grade']
+    return any(old.get(k) != new[k] for k in keys)
+
+
+def publish_previews():
+    """Move the pre-rendered previews into the web static paths."""
+    for name, target in PREVIEW_FILES.items():
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(_path(name), target)
+        except OSError:
+            pass
+
+
+def discard():
+    for name in [META_NAME, FRAME_NAME] + list(PREVIEW_FILES):
+        try: os.remove(_path(name))
+        except OSError: pass
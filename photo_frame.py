@@ -3,6 +3,7 @@ import os
 import sys
 import time
 import random
+import io
 import json
 import logging
 from datetime import datetime, timedelta
@@ -13,7 +14,16 @@ import threading
 # Use project settings
 import settings
 import data_api
+import live_data
+import stations
+import forecast_store
+import photo_store
+import shuffle_deck
+import preview_cache
+import memory_budget
 import renderer # Use renderer to create composed image
+import render_sink
+import next_frame
 import hardware # Use existing hardware controller wrapper if compatible
 # But user code imports waveshare directly in try/except.
 # We will adopt user's direct approach for EPD to be safe with their provided code,
@@ -82,6 +92,8 @@ class EInkPhotoFrame:
         loc = self.config.get('location', {})
         self.kma_nx = int(loc.get('nx', 61))
         self.kma_ny = int(loc.get('ny', 115))
+        # Nearest AirKorea stations (or the one known to work) for this location
+        self.dust_stations = stations.for_location(self.kma_nx, self.kma_ny, self.station_name)
 
         # 사진 경로
         self.photos_dir = getattr(settings, 'UPLOADS_DIR', UPLOADS_DIR)
@@ -118,14 +130,7 @@ class EInkPhotoFrame:
             self.hw = None
 
     def get_7color_palette(self):
-        standard_7_colors = [0, 0, 0, 255, 255, 255, 255, 0, 0, 0, 255, 0, 0, 0, 255, 255, 255, 0, 255, 165, 0]
-        filler = [255, 255, 255]
-        full_palette_data = standard_7_colors + filler * (256 - len(standard_7_colors) // 3)
-        palette_image = Image.new('P', (1, 1), 0)
-        palette_image.putpalette(full_palette_data[:768])
-        return palette_image
-
-
+        return render_sink.panel_palette()
 
     def init_display(self):
         if self.is_preview_mode: return True
@@ -139,17 +144,16 @@ class EInkPhotoFrame:
 
     def get_fine_dust_data(self):
         # Delegate to shared data_api for consistency
-        return data_api.get_fine_dust_data(self.airkorea_api_key, self.station_name)
+        return data_api.get_nearest_dust(self.airkorea_api_key, self.dust_stations)
 
     def get_weather_data(self):
         # Delegate to shared data_api for consistency
         return data_api.get_weather_data(self.kma_weather_api_key, self.kma_nx, self.kma_ny)
 
     def get_photo_list(self):
-        if not os.path.exists(self.photos_dir): return []
-        exts = ('.jpg', '.jpeg', '.png', '.bmp')
-        return [os.path.join(self.photos_dir, f) for f in os.listdir(self.photos_dir) if
-                f.lower().endswith(exts) and not f.startswith('.')]
+        # Resolved through the photo index (content-addressed store + legacy uploads)
+        paths = [photo_store.resolve(name) for name in photo_store.list_photos()]
+        return [p for p in paths if p]
 
 
 
@@ -187,81 +191,164 @@ class EInkPhotoFrame:
         try:
             logger.info(f"Processing: {os.path.basename(image_path)}")
 
-            # 데이터 로드 (날씨/미세먼지 대기 및 반복 요청 적용)
-            d_data = None
-            w_data = None
-            
-            max_retries = 10  # 10회 * 2초 = 최대 20초 대기
-            for i in range(max_retries):
-                logger.info(f"Fetching weather/dust data (Attempt {i+1}/{max_retries})...")
-                if d_data is None:
-                    d_data = self.get_fine_dust_data()
-                if w_data is None:
-                    w_data = self.get_weather_data()
-                
-                if d_data and w_data:
-                    logger.info("Both weather and dust data successfully fetched.")
-                    break
-                
-                time.sleep(2)
-            
-            if not d_data: logger.warning("Fine dust data fetch failed after retries.")
-            if not w_data: logger.warning("Weather data fetch failed after retries.")
-            
-            # Fetch Battery Data
-            batt_info = None
-            if self.hw:
-                try:
-                    batt_info = self.hw.get_battery_status()
-                    logger.info(f"Battery Info: {batt_info}")
-                except Exception as e:
-                    logger.warning(f"Failed to fetch battery info: {e}")
-
-            logger.info(f"Data Fetch Complete. Dust: {bool(d_data)}, Weather: {bool(w_data)}")
-            
-            # 설정 및 위치 이름 로드
-            layout_config = self.config.get('layout', {})
-            location_name = self.config.get('location', {}).get('name', '')
+            # Frame pre-rendered from the forecast before the last shutdown: push it right away,
+            # fetch the observed data meanwhile, re-render only if it visibly differs
+            if self.epd and not self.is_preview_mode and self.show_prerendered(image_path):
+                return
+
+            d_data, w_data, batt_info = self.fetch_display_data()
+            self.render_and_display(image_path, w_data, d_data, batt_info)
+
+        except Exception as e:
+            logger.error(f"Display Error: {e}", exc_info=True)
+
+    def fetch_display_data(self):
+        """(dust, weather, battery) for the widgets, waiting on the network at most data_settings.network_budget_sec."""
+        now = datetime.now()
+        if forecast_store.can_stay_offline(now, self.kma_nx, self.kma_ny, self.dust_stations, self.config):
+            # Stored forecast still covers this wake: no network at all
+            logger.info("📴 Offline wake: weather from the stored forecast, last known dust.")
+            w_data = forecast_store.weather_at(now, self.kma_nx, self.kma_ny)
+            d_data = live_data.last_known('dust', live_data.dust_names(self.dust_stations), self.config)
+        else:
+            self.go_online()
+            # Weather (3 KMA calls) and dust in parallel; last known data (marked stale) if they are late
+            logger.info("Fetching weather/dust data...")
+            w_data, d_data = live_data.get(self.kma_weather_api_key, self.kma_nx, self.kma_ny,
+                                           self.airkorea_api_key, self.dust_stations, config=self.config)
+            if w_data and not w_data.get('stale') and forecast_store.get_forecast_settings(self.config)['enabled']:
+                # Same getVilageFcst response gather() just cached: keep it for offline wakes
+                try: forecast_store.refresh(self.kma_weather_api_key, self.kma_nx, self.kma_ny, deadline=5)
+                except Exception as e: logger.warning(f"Forecast store update failed: {e}")
+        
+        if d_data and d_data.get('stale'): logger.warning(f"Using last known dust data ({d_data['age_min']} min old).")
+        if w_data and w_data.get('stale'): logger.warning(f"Using last known weather data ({w_data['age_min']} min old).")
+        if not d_data: logger.warning("Fine dust data unavailable.")
+        if not w_data: logger.warning("Weather data unavailable.")
+        
+        # Fetch Battery Data
+        batt_info = None
+        if self.hw:
+            try:
+                batt_info = self.hw.get_battery_status()
+                logger.info(f"Battery Info: {batt_info}")
+            except Exception as e:
+                logger.warning(f"Failed to fetch battery info: {e}")
+
+        logger.info(f"Data Fetch Complete. Dust: {bool(d_data)}, Weather: {bool(w_data)}")
+        return d_data, w_data, batt_info
 
-            # [핵심] Renderer 모듈 사용 (Web Preview와 동일한 로직)
-            logger.info("Starting Renderer...")
+    def go_online(self, wait_sec=20):
+        """Turn the Wi-Fi radio back on if an offline shutdown switched it off, and wait for a route."""
+        if not self.hw or not forecast_store.get_forecast_settings(self.config)['wifi_off_offline']:
+            return
+        self.hw.set_wifi_radio(True)
+        import socket
+        from urllib.parse import urlsplit
+        upstream = urlsplit(data_api.API_BASE_URL)
+        deadline = time.monotonic() + wait_sec
+        while time.monotonic() < deadline:
             try:
-                final_img, _, _, _, _ = renderer.create_composed_image(
+                socket.create_connection((upstream.hostname, upstream.port or 80), timeout=2).close()
+                return
+            except OSError:
+                time.sleep(1)
+        if wait_sec: logger.warning("Network still unreachable after turning Wi-Fi on.")
+
+    def show_prerendered(self, image_path):
+        """
+        Push the pre-rendered frame for this wake, then re-render it if the observed data differs.
+        Returns False when there is no usable frame (the caller renders as usual).
+        """
+        meta = next_frame.load_meta(image_path, self.config)
+        if meta is None:
+            next_frame.discard()
+            return False
+
+        fetched = {}
+        fetcher = threading.Thread(target=lambda: fetched.update(data=self.fetch_display_data()))
+        fetcher.start()
+        try:
+            logger.info(f"⚡ Pushing pre-rendered frame ({meta['wake_time']})...")
+            with next_frame.open_frame() as buf:
+                self.epd.init()
+                self.epd.display(buf)
+                self.epd.sleep()
+            next_frame.publish_previews()
+            pushed = True
+        except Exception as e:
+            logger.warning(f"Pre-rendered frame failed: {e}")
+            pushed = False
+        fetcher.join()
+        next_frame.discard()
+
+        d_data, w_data, batt_info = fetched.get('data') or (None, None, None)
+        if pushed and not next_frame.differs(meta, w_data, d_data, batt_info, self.config):
+            logger.info("Observed data matches the forecast frame. Done.")
+            return True
+        logger.info("Observed data differs from the forecast frame. Re-rendering..." if pushed else "Re-rendering...")
+        self.render_and_display(image_path, w_data, d_data, batt_info)
+        return True
+
+    def render_and_display(self, image_path, w_data, d_data, batt_info):
+        # 설정 및 위치 이름 로드
+        layout_config = self.config.get('layout', {})
+        location_name = self.config.get('location', {}).get('name', '')
+
+        # [핵심] Renderer 모듈 사용 (Web Preview와 동일한 로직)
+        logger.info("Starting Renderer...")
+        try:
+            with memory_budget.job('render') as mem:
+                comp = render_sink.compose(
                     image_path, 
                     w_data, 
                     d_data, 
                     layout_config, 
                     location_name,
-                    batt_info  # Passed to renderer
+                    batt_info,  # Passed to renderer
+                    persist=True # Wake path: keep the base layer for the next time this photo is shown
                 )
-                logger.info("Renderer Success.")
-            except Exception as e:
-                logger.error(f"Renderer Failed: {e}", exc_info=True)
-                raise e
 
-            # [중요] 웹 미리보기 저장
-            preview_path = settings.PREVIEW_PATH
-            os.makedirs(os.path.dirname(preview_path), exist_ok=True)
-            final_img.save(preview_path)
-            logger.info(f"Preview Saved: {preview_path}")
+                # One composition -> web preview (file + preview cache share one JPEG encode),
+                # simulated panel preview, thumbnail and the panel framebuffer (one dither pass)
+                sinks = [render_sink.EncodedImage(path=settings.PREVIEW_PATH),
+                         render_sink.EinkPreview(path=settings.PREVIEW_EINK_PATH),
+                         render_sink.Thumbnail(path=settings.PREVIEW_THUMB_PATH)]
+                if self.epd and not self.is_preview_mode:
+                    sinks.append(render_sink.PanelFramebuffer())
+                outputs = render_sink.render(comp, sinks)
+            logger.info(f"Renderer Success. (peak RSS {mem.peak_kb / 1024:.1f}MB)")
+        except Exception as e:
+            logger.error(f"Renderer Failed: {e}", exc_info=True)
+            raise e
+        logger.info(f"Preview Saved: {settings.PREVIEW_PATH}")
 
-            if self.is_preview_mode: 
-                return
+        # Share this render with /api/preview (same cache key as the web preview path).
+        # Not when it carries the low-battery popup: the web preview never draws it.
+        if not renderer.battery_alert_shown(batt_info):
+            try:
+                bucket = preview_cache.minute_bucket()
+                version = preview_cache.put_data(
+                    preview_cache.data_key_for(self.config, live_data.dust_scope(self.dust_stations)), bucket, w_data, d_data)
+                photo_id = preview_cache.photo_identity(None, image_path)
+                key = preview_cache.make_key(photo_id, layout_config, location_name, version, bucket)
+                preview_cache.put(key, outputs['preview'], comp.widget_headers, photo_id)
+            except Exception as e:
+                logger.warning(f"Preview cache update failed: {e}")
 
-            # E-Ink 전송
-            if self.epd:
-                logger.info("Updating E-Ink Display...")
-                try:
-                    self.epd.init()
-                    final_quantized = final_img.quantize(palette=self.get_7color_palette(), method=Image.FLOYDSTEINBERG)
-                    self.epd.display(self.epd.getbuffer(final_quantized))
-                    self.epd.sleep()
-                    logger.info("Done.")
-                except Exception as e:
-                    logger.error(f"EPD Error: {e}")
+        if self.is_preview_mode: 
+            return
 
-        except Exception as e:
-            logger.error(f"Display Error: {e}", exc_info=True)
+        # E-Ink 전송
+        if self.epd:
+            logger.info("Updating E-Ink Display...")
+            try:
+                self.epd.init()
+                self.epd.display(outputs['framebuffer'])
+                self.epd.sleep()
+                logger.info("Done.")
+            except Exception as e:
+                logger.error(f"EPD Error: {e}")
 
     # --- Power Management ---
     def is_charging(self):
@@ -287,8 +374,8 @@ class EInkPhotoFrame:
         # Support Selected Photo Logic
         # If target_photo is passed (Manual Override from Web), use it!
         if target_photo:
-             full_path = os.path.join(self.photos_dir, target_photo)
-             if os.path.exists(full_path):
+             full_path = photo_store.resolve(target_photo)
+             if full_path:
                  target_photo = full_path # Resolve to full path
              # If target_photo is provided, we SKIP shuffle checks logic entirely for selection
              # But we still let it flow to display_image
@@ -300,15 +387,15 @@ class EInkPhotoFrame:
              selected_photo = target_photo
              logger.info(f"🎯 Forced display of photo: {os.path.basename(selected_photo)}")
         elif pinned_photo:
-            full_path = os.path.join(self.photos_dir, pinned_photo)
+            full_path = photo_store.resolve(pinned_photo)
             logger.info(f"Checking pinned photo path: {full_path}")
-            if os.path.exists(full_path):
+            if full_path:
                 selected_photo = full_path
                 logger.info(f"✅ Found pinned photo: {full_path}")
             else:
                 # Try checking if it's just a filename that needs to be found in uploads
                 # Sometimes path might be mixed up
-                logger.warning(f"❌ Pinned photo NOT found at: {full_path}")
+                logger.warning(f"❌ Pinned photo NOT found: {pinned_photo}")
                 
         if not selected_photo:
             # Fallback logic
@@ -316,21 +403,16 @@ class EInkPhotoFrame:
             
         # [Shuffle Logic]
         shuffle_mode = self.config.get('shuffle_mode', False)
-        shuffle_playlist = self.config.get('shuffle_playlist', [])
         
         # Only apply shuffle if NO target_photo was forced
         if shuffle_mode and not target_photo:
             logger.info("🔀 Shuffle Mode Enabled")
-            # Filter playlist for existing files
-            valid_playlist = []
-            for p in shuffle_playlist:
-                full_p = os.path.join(self.photos_dir, p)
-                if os.path.exists(full_p):
-                    valid_playlist.append(full_p)
+            # Deal from the persistent deck (playlist, or all photos if no playlist)
+            next_name = shuffle_deck.next_photo(self.config)
             
-            if valid_playlist:
-                selected_photo = random.choice(valid_playlist)
-                logger.info(f"🎲 Randomly selected from playlist: {os.path.basename(selected_photo)}")
+            if next_name:
+                selected_photo = photo_store.resolve(next_name)
+                logger.info(f"🃏 Dealt from shuffle deck: {next_name}")
             else:
                 logger.warning("Shuffle playlist empty or files missing. Falling back to all photos.")
                 all_photos = self.get_photo_list()
@@ -350,6 +432,40 @@ class EInkPhotoFrame:
         else:
             logger.warning("No photos to display.")
 
+        # Idle time before shutdown: get the next wake's photo decoded and dithered
+        if self.config.get('prefetch_next', True):
+            self.prefetch_next()
+
+    def prefetch_next(self):
+        """
+        Decode/normalize/dither the photo the next refresh will show into the base-layer cache,
+        so the next wake only draws widgets. Unpredictable picks (random fallback) are skipped.
+        """
+        next_name = next_frame.next_photo_name(self.config)
+        next_path = photo_store.resolve(next_name) if next_name else None
+        if not next_path:
+            return
+        try:
+            with memory_budget.job('prefetch') as mem:
+                render_sink.prefetch(next_path)
+            logger.info(f"⏭️ Prefetched next photo: {next_name} ({mem.seconds:.2f}s)")
+        except Exception as e:
+            logger.warning(f"Prefetch failed ({next_name}): {e}")
+
+    def prerender_next(self, wake_time):
+        """Render the next wake's frame from the forecast (pushed instantly on wake)."""
+        batt_info = None
+        if self.hw:
+            try: batt_info = self.hw.get_battery_status()
+            except Exception: pass
+        try:
+            with memory_budget.job('render') as mem:
+                meta = next_frame.prerender(wake_time, self.config, batt_info)
+            if meta:
+                logger.info(f"🖼️ Pre-rendered next frame for {meta['wake_time']} ({mem.seconds:.2f}s)")
+        except Exception as e:
+            logger.warning(f"Next frame pre-render failed: {e}")
+
     def run(self):
         """메인 실행 로직 (Standalone)"""
         if not self.init_display(): return
@@ -366,6 +482,7 @@ class EInkPhotoFrame:
 
         if self.is_charging():
             logger.info("⚡ 전원 케이블 연결됨 감지! 웹 서버 실행.")
+            self.go_online(wait_sec=0)
             try:
                 # Use absolute path for app.py
                 app_path = os.path.join(settings.BASE_DIR, 'app.py')
@@ -394,6 +511,12 @@ class EInkPhotoFrame:
                 next_wake = final_wake
                 logger.info(f"Night Mode Active. Sleeping until {next_wake}")
 
+            self.prerender_next(next_wake)
+            if forecast_store.get_forecast_settings(self.config)['wifi_off_offline']:
+                self.hw.set_wifi_radio(not forecast_store.can_stay_offline(
+                    next_wake, self.kma_nx, self.kma_ny, self.dust_stations, self.config))
+
+            now = datetime.now()
             diff_seconds = (next_wake - now).total_seconds()
             rtc_minutes = int(diff_seconds / 60)
             if rtc_minutes < 1: rtc_minutes = 1
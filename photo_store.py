@@ -0,0 +1,319 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+import settings
+import cache_manager
+
+logger = logging.getLogger(__name__)
+
+# --- [Content-Addressed Photo Store] ---
+# Blobs live under PHOTO_STORE_DIR/<hash[:2]>/<hash><ext>.
+# The photo index (photo_index.json) maps user-visible names to blob hashes,
+# so duplicate uploads only add a name entry and never touch the SD card twice.
+# Files uploaded before the store existed (flat UPLOADS_DIR) are still resolved.
+
+PHOTO_EXTS = ('.png', '.jpg', '.jpeg', '.bmp')
+HASH_CHUNK = 1024 * 1024
+
+_lock = threading.RLock()
+_index_cache = {'mtime': None, 'data': None}
+
+
+def _empty_index():
+    return {"version": 1, "names": {}, "blobs": {}}
+
+
+def load_index():
+    """Load photo_index.json (cached in memory until the file changes)."""
+    with _lock:
+        try:
+            mtime = os.path.getmtime(settings.PHOTO_INDEX_PATH)
+        except OSError:
+            mtime = None
+
+        if _index_cache['data'] is not None and _index_cache['mtime'] == mtime:
+            return _index_cache['data']
+
+        data = _empty_index()
+        if mtime is not None:
+            try:
+                with open(settings.PHOTO_INDEX_PATH, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                data.setdefault('names', {})
+                data.setdefault('blobs', {})
+            except Exception as e:
+                logger.error(f"Photo index load failed: {e}")
+                data = _empty_index()
+
+        _index_cache['data'] = data
+        _index_cache['mtime'] = mtime
+        return data
+
+
+def save_index(data):
+    """Atomic write (temp + rename), same pattern as settings.save_config."""
+    with _lock:
+        os.makedirs(os.path.dirname(settings.PHOTO_INDEX_PATH), exist_ok=True)
+        tmp_path = settings.PHOTO_INDEX_PATH + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=1, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, settings.PHOTO_INDEX_PATH)
+            _index_cache['data'] = data
+            _index_cache['mtime'] = os.path.getmtime(settings.PHOTO_INDEX_PATH)
+        except Exception as e:
+            logger.error(f"Photo index save failed: {e}")
+            if os.path.exists(tmp_path):
+                try: os.remove(tmp_path)
+                except: pass
+
+
+def hash_stream(stream):
+    """SHA-256 of a file-like object. Rewinds the stream afterwards."""
+    h = hashlib.sha256()
+    try: stream.seek(0)
+    except Exception: pass
+    while True:
+        chunk = stream.read(HASH_CHUNK)
+        if not chunk: break
+        h.update(chunk)
+    try: stream.seek(0)
+    except Exception: pass
+    return h.hexdigest()
+
+
+def hash_file(path):
+    with open(path, 'rb') as f:
+        return hash_stream(f)
+
+
+def blob_path(digest, ext):
+    return os.path.join(settings.PHOTO_STORE_DIR, digest[:2], digest + ext)
+
+
+def temp_path(suffix=''):
+    """Scratch path inside the store (same filesystem, so commit is a rename)."""
+    tmp_dir = os.path.join(settings.PHOTO_STORE_DIR, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    return os.path.join(tmp_dir, f"{os.getpid()}_{threading.get_ident()}_{time.time_ns()}{suffix}")
+
+
+def has_blob(digest):
+    return digest in load_index()['blobs']
+
+
+def _unique_name(names, name, digest):
+    """Same name + same content -> reuse. Same name + other content -> name_2.ext ..."""
+    entry = names.get(name)
+    if entry is None or entry['hash'] == digest:
+        return name
+    stem, ext = os.path.splitext(name)
+    n = 2
+    while True:
+        candidate = f"{stem}_{n}{ext}"
+        entry = names.get(candidate)
+        if entry is None or entry['hash'] == digest:
+            return candidate
+        n += 1
+
+
+def link(name, digest):
+    """
+    Register `name` for an existing blob (O(1) metadata update, no file I/O
+    besides the index). Returns the final (collision-free) name.
+    """
+    with _lock:
+        data = load_index()
+        blob = data['blobs'].get(digest)
+        if blob is None:
+            raise KeyError(f"Unknown blob: {digest}")
+        name = _unique_name(data['names'], name, digest)
+        if name in data['names']:
+            return name # Exact duplicate (same name, same content)
+        data['seq'] = data.get('seq', 0) + 1 # Monotonic change counter (incremental backup token)
+        data['names'][name] = {"hash": digest, "added": time.time(), "seq": data['seq']}
+        blob['refs'] = blob.get('refs', 0) + 1
+        save_index(data)
+        logger.info(f"Photo linked: {name} -> {digest[:12]} (refs={blob['refs']})")
+        return name
+
+
+def add_file(name, src_path, digest=None, meta=None):
+    """
+    Move a finished file into the store under its content hash and register `name`.
+    If the blob already exists the source file is discarded (dedup).
+    `meta` (EXIF summary from ingest) is kept on the blob entry.
+    Returns the final name.
+    """
+    if digest is None:
+        digest = hash_file(src_path)
+    ext = os.path.splitext(name)[1].lower() or '.jpg'
+
+    with _lock:
+        data = load_index()
+        if digest in data['blobs']:
+            try: os.remove(src_path)
+            except OSError: pass
+            return link(name, digest)
+
+        dst = blob_path(digest, ext)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        os.replace(src_path, dst)
+
+        data['blobs'][digest] = {"ext": ext, "size": os.path.getsize(dst), "refs": 0}
+        if meta:
+            data['blobs'][digest]['meta'] = meta
+        save_index(data)
+        return link(name, digest)
+
+
+def set_added(name, timestamp):
+    """Override the 'added' time of an entry (keeps gallery order for migrated photos)."""
+    with _lock:
+        data = load_index()
+        if name in data['names']:
+            data['names'][name]['added'] = timestamp
+            save_index(data)
+
+
+def current_seq():
+    return load_index().get('seq', 0)
+
+
+def lookup(name):
+    """Index entry for name (with blob info merged) or None."""
+    data = load_index()
+    entry = data['names'].get(name)
+    if entry is None:
+        return None
+    blob = data['blobs'].get(entry['hash'], {})
+    return {"name": name, "hash": entry['hash'], "added": entry.get('added'),
+            "ext": blob.get('ext', ''), "size": blob.get('size'), "meta": blob.get('meta') or {}}
+
+
+def resolve(name):
+    """
+    Absolute path for a photo name, or None.
+    Indexed names resolve through the hash mapping; legacy flat uploads fall back
+    to UPLOADS_DIR so existing filenames (config, playlists) keep working.
+    """
+    if not name:
+        return None
+    entry = lookup(name)
+    if entry:
+        return blob_path(entry['hash'], entry['ext'])
+
+    # Legacy flat file (pre-store uploads). Guard against path traversal.
+    base = os.path.basename(name)
+    if base != name:
+        return None
+    legacy = os.path.join(settings.UPLOADS_DIR, name)
+    if os.path.isfile(legacy):
+        return legacy
+    return None
+
+
+def contains(name):
+    """Cheap membership check (index lookup, stat only for legacy names)."""
+    if name in load_index()['names']:
+        return True
+    return resolve(name) is not None
+
+
+def legacy_files():
+    if not os.path.exists(settings.UPLOADS_DIR):
+        return []
+    return [f for f in os.listdir(settings.UPLOADS_DIR)
+            if f.lower().endswith(PHOTO_EXTS) and not f.startswith('.')]
+
+
+def list_photos():
+    """All photo names, newest first (index entries + legacy flat uploads)."""
+    data = load_index()
+    items = [(name, entry.get('added') or 0) for name, entry in data['names'].items()]
+    for f in legacy_files():
+        if f in data['names']: continue
+        try:
+            items.append((f, os.path.getmtime(os.path.join(settings.UPLOADS_DIR, f))))
+        except OSError:
+            pass
+    items.sort(key=lambda x: x[1], reverse=True)
+    return [name for name, _ in items]
+
+
+def delete(name):
+    """Remove a name. The blob is deleted once no other name references it."""
+    with _lock:
+        data = load_index()
+        entry = data['names'].pop(name, None)
+        if entry is None:
+            legacy = resolve(name)
+            if legacy:
+                os.remove(legacy)
+                return True
+            return False
+
+        digest = entry['hash']
+        blob = data['blobs'].get(digest)
+        if blob is not None:
+            blob['refs'] = blob.get('refs', 1) - 1
+            if blob['refs'] <= 0:
+                path = blob_path(digest, blob.get('ext', ''))
+                data['blobs'].pop(digest, None)
+                try: os.remove(path)
+                except OSError as e: logger.warning(f"Blob remove failed ({path}): {e}")
+                cache_manager.invalidate(tag=digest) # Thumbnails etc. of this blob
+        save_index(data)
+        return True
+
+
+# --- [Metadata Queries] ---
+# Served from the in-memory index (EXIF extracted at ingest), never from the files.
+
+def _photo_record(name, entry, blob):
+    meta = blob.get('meta') or {}
+    return {"name": name, "taken": meta.get('taken'), "orientation": meta.get('orientation'),
+            "width": meta.get('width'), "height": meta.get('height'),
+            "camera": meta.get('camera'), "gps": meta.get('gps'), "added": entry.get('added')}
+
+
+def iter_records():
+    data = load_index()
+    for name, entry in data['names'].items():
+        yield _photo_record(name, entry, data['blobs'].get(entry['hash'], {}))
+
+
+def query(date_from=None, date_to=None, orientation=None):
+    """
+    Photos whose capture time is within [date_from, date_to] ('YYYY-MM-DD', inclusive)
+    and/or with the given orientation ('portrait' | 'landscape' | 'square').
+    Sorted by capture time (newest first); photos without a capture time sort last.
+    """
+    results = []
+    for rec in iter_records():
+        taken = rec['taken']
+        if date_from or date_to:
+            if not taken: continue
+            day = taken[:10]
+            if date_from and day < date_from: continue
+            if date_to and day > date_to: continue
+        if orientation and rec['orientation'] != orientation: continue
+        results.append(rec)
+    results.sort(key=lambda r: (r['taken'] is not None, r['taken'] or ''), reverse=True)
+    return results
+
+
+def on_this_day(month, day, exclude_year=None):
+    """Photos taken on month/day in any year (newest year first)."""
+    suffix = f"-{int(month):02d}-{int(day):02d}"
+    results = [rec for rec in iter_records()
+               if rec['taken'] and rec['taken'][4:10] == suffix
+               and (exclude_year is None or int(rec['taken'][:4]) != exclude_year)]
+    results.sort(key=lambda r: r['taken'], reverse=True)
+    return results
@@ -0,0 +1,151 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import settings
+import photo_store
+
+logger = logging.getLogger(__name__)
+
+# --- [Rendered Preview Cache] ---
+# LRU of encoded preview JPEGs keyed by everything that changes the pixels:
+#   (photo content identity, normalized layout, location, weather/dust data version, minute bucket)
+# The minute bucket matches the "MM/DD HH:MM 기준" stamp drawn by the renderer.
+# Weather/dust payloads used for previews are memoized per minute bucket as well, so a
+# burst of identical /api/preview requests costs one fetch and one render.
+
+DEFAULT_BUDGET_MB = 8
+
+# Renderer defaults (renderer.create_composed_image) so equivalent layouts share an entry
+LAYOUT_DEFAULTS = {"widget_size": 1.0, "font_scale": 1.0, "opacity": 0.85,
+                   "position": None, "type": "type_A", "x": None, "y": None}
+
+_lock = threading.Lock()
+_entries = OrderedDict() # key -> {'data': bytes, 'meta': dict, 'photo': photo_id}
+_data_memo = {} # data_key -> (bucket, w_data, d_data, version)
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+
+
+def _budget_bytes():
+    try:
+        mb = float(settings.load_config().get('preview_cache_mb', DEFAULT_BUDGET_MB))
+    except (TypeError, ValueError):
+        mb = DEFAULT_BUDGET_MB
+    return int(mb * 1024 * 1024)
+
+
+def minute_bucket(now=None):
+    return (now or datetime.now()).strftime('%Y%m%d%H%M')
+
+
+def photo_identity(name, path):
+    """Content hash for indexed photos; (path, mtime) for legacy flat uploads."""
+    if not path:
+        return None
+    entry = photo_store.lookup(name) if name else None
+    if entry:
+        return entry['hash']
+    if os.path.dirname(os.path.dirname(path)) == settings.PHOTO_STORE_DIR:
+        return os.path.splitext(os.path.basename(path))[0] # Blob file name is the hash
+    try:
+        return f"{path}:{os.path.getmtime(path)}"
+    except OSError:
+        return path
+
+
+def normalize_layout(layout):
+    norm = {}
+    for k, default in LAYOUT_DEFAULTS.items():
+        v = (layout or {}).get(k, default)
+        if v in (None, ''):
+            v = default
+        if k in ('widget_size', 'font_scale', 'opacity', 'x', 'y') and v is not None:
+            try: v = round(float(v), 3)
+            except (TypeError, ValueError): v = default
+        norm[k] = v
+    if norm['type'] != 'custom': # x/y only matter for custom placement
+        norm['x'] = norm['y'] = None
+    return norm
+
+
+def data_key_for(config, station):
+    """Memo key for the weather/dust payload (same location + station -> same data)."""
+    loc = config.get('location', {})
+    return (bool(config.get('api_key_kma')), int(loc.get('nx', 61)), int(loc.get('ny', 115)),
+            bool(config.get('api_key_air')), station)
+
+
+def data_version(w_data, d_data):
+    raw = json.dumps([w_data, d_data], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def make_key(photo_id, layout, location_name, version, bucket, variant='jpeg'):
+    raw = json.dumps([photo_id, normalize_layout(layout), location_name, version, bucket, variant],
+                     sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def get_data(data_key, bucket):
+    """(w_data, d_data, version) fetched during this minute bucket, or None."""
+    with _lock:
+        memo = _data_memo.get(data_key)
+        if memo and memo[0] == bucket:
+            return memo[1], memo[2], memo[3]
+    return None
+
+
+def put_data(data_key, bucket, w_data, d_data):
+    version = data_version(w_data, d_data)
+    with _lock:
+        _data_memo[data_key] = (bucket, w_data, d_data, version)
+    return version
+
+
+def get(key):
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            _stats['misses'] += 1
+            return None
+        _entries.move_to_end(key)
+        _stats['hits'] += 1
+        return entry
+
+
+def put(key, data, meta=None, photo_id=None):
+    budget = _budget_bytes()
+    if len(data) > budget:
+        return
+    with _lock:
+        old = _entries.pop(key, None)
+        if old: _stats['bytes'] -= len(old['data'])
+        _entries[key] = {'data': data, 'meta': meta or {}, 'photo': photo_id}
+        _stats['bytes'] += len(data)
+        while _stats['bytes'] > budget and _entries:
+            _, evicted = _entries.popitem(last=False)
+            _stats['bytes'] -= len(evicted['data'])
+            _stats['evictions'] += 1
+
+
+def invalidate(photo_id=None):
+    """Drop entries for one photo, or everything (config change) when photo_id is None."""
+    with _lock:
+        if photo_id is None:
+            _entries.clear()
+            _data_memo.clear()
+            _stats['bytes'] = 0
+            return
+        for key in [k for k, e in _entries.items() if e['photo'] == photo_id]:
+            _stats['bytes'] -= len(_entries.pop(key)['data'])
+
+
+def get_stats():
+    with _lock:
+        total = _stats['hits'] + _stats['misses']
+        return dict(_stats, entries=len(_entries), budget_bytes=_budget_bytes(),
+                    hit_rate=round(_stats['hits'] / total, 3) if total else 0.0)
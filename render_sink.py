@@ -0,0 +1,255 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image, ImageChops
+
+import renderer
+import cache_manager
+import preview_cache
+
+# --- [Render Sink] ---
+# One composition pass (renderer.create_composed_image) fans out to any set of outputs:
+#   EncodedImage      preview JPEG / WebP (bytes, optionally written to a file)
+#   PanelFramebuffer  packed 4bpp buffer for the 7-color panel (epd.display)
+#   EinkPreview       PNG of what the panel will actually show (dithered palette colors)
+#   Thumbnail         small JPEG of the composite
+# Shared intermediates live on the Composition and are computed once, on first use:
+# the RGB composite, the dithered palette indices, and every (format, quality) encoding.
+#
+# Base layers (photo decoded, cropped, enhanced at panel size) and their dithered indices are
+# kept in the cache manager, so a prefetched photo (prefetch(), run after a refresh) only needs
+# its widgets drawn on the next wake, and only the pixels the widgets changed are re-dithered.
+# Only prefetch() and the wake path persist them (compose(persist=True)); one-off web previews
+# keep their base layers in a small in-memory LRU instead of writing 1.15 MB to the SD card.
+
+# 7-color panel palette used for dithering (index order = palette index in the quantized image)
+PANEL_COLORS = [(0, 0, 0), (255, 255, 255), (255, 0, 0), (0, 255, 0),
+                (0, 0, 255), (255, 255, 0), (255, 165, 0)]
+# Waveshare 7.3" F color codes for the palette indices above
+# (black 0, white 1, green 2, blue 3, red 4, yellow 5, orange 6)
+PANEL_CODES = np.array([0, 1, 4, 2, 3, 5, 6] + [1] * (256 - 7), dtype=np.uint8)
+
+BASE_LAYER_VERSION = 1 # Bump when renderer.load_base_layer output changes
+DITHER_MARGIN = 4 # Pixels re-dithered around each changed area (error diffusion spill)
+REGION_TILE = 32 # Granularity of the changed-area search
+MEMORY_BASE_LAYERS = 2 # Preview base layers kept in memory (~1.15 MB each)
+
+_palette_image = None
+_palette_lock = threading.Lock()
+_memory = OrderedDict() # key -> base layer RGB (not persisted)
+_memory_lock = threading.Lock()
+
+
+def panel_palette():
+    """'P' image carrying the panel palette (for Image.quantize(palette=...))."""
+    global _palette_image
+    with _palette_lock:
+        if _palette_image is None:
+            data = [c for rgb in PANEL_COLORS for c in rgb]
+            data += [255, 255, 255] * (256 - len(PANEL_COLORS)) # Filler: white
+            img = Image.new('P', (1, 1), 0)
+            img.putpalette(data[:768])
+            _palette_image = img
+        return _palette_image
+
+
+def _base_key(image_path):
+    identity = preview_cache.photo_identity(None, image_path) or 'blank'
+    return identity, f"{identity}:{renderer.DISPLAY_WIDTH}x{renderer.DISPLAY_HEIGHT}:v{BASE_LAYER_VERSION}"
+
+
+def _dither(image):
+    return image.quantize(palette=panel_palette(), dither=Image.Dither.FLOYDSTEINBERG)
+
+
+def _changed_regions(image, base, tile=REGION_TILE):
+    """
+    Bounding boxes of the separate areas where `image` differs from `base`
+    (connected groups of changed tiles), e.g. the weather card and the summary widget.
+    """
+    diff = np.asarray(ImageChops.difference(image, base).convert('L')) > 0
+    h, w = diff.shape
+    rows, cols = -(-h // tile), -(-w // tile)
+    padded = np.zeros((rows * tile, cols * tile), dtype=bool)
+    padded[:h, :w] = diff
+    changed = padded.reshape(rows, tile, cols, tile).any(axis=(1, 3))
+
+    regions, seen = [], np.zeros_like(changed)
+    for r, c in zip(*np.nonzero(changed)):
+        if seen[r, c]: continue
+        stack, r0, c0, r1, c1 = [(r, c)], r, c, r, c
+        seen[r, c] = True
+        while stack:
+            y, x = stack.pop()
+            r0, c0, r1, c1 = min(r0, y), min(c0, x), max(r1, y), max(c1, x)
+            for ny, nx in ((y - 1, x), (y + 1, x), (y, x - 1), (y, x + 1)):
+                if 0 <= ny < rows and 0 <= nx < cols and changed[ny, nx] and not seen[ny, nx]:
+                    seen[ny, nx] = True
+                    stack.append((ny, nx))
+        regions.append((int(c0) * tile, int(r0) * tile, min(w, (int(c1) + 1) * tile), min(h, (int(r1) + 1) * tile)))
+    return regions
+
+
+def _remember(key, base):
+    with _memory_lock:
+        _memory[key] = base
+        _memory.move_to_end(key)
+        while len(_memory) > MEMORY_BASE_LAYERS:
+            _memory.popitem(last=False)
+
+
+def load_base(image_path, with_indices=False, persist=False):
+    """
+    (base layer RGB, dithered indices or None) for a photo, from the cache when possible.
+    A base layer computed here is written to the cache only when `persist` (prefetch / wake),
+    otherwise kept in memory; indices are only computed when `with_indices`.
+    """
+    size = (renderer.DISPLAY_WIDTH, renderer.DISPLAY_HEIGHT)
+    tag, key = _base_key(image_path)
+
+    with _memory_lock:
+        base = _memory.get(key)
+    raw = cache_manager.get_bytes('base_layers', key) if base is None or persist else None
+    if raw is not None and len(raw) == size[0] * size[1] * 3:
+        base = Image.frombytes('RGB', size, raw)
+    elif base is None:
+        base = renderer.load_base_layer(image_path)
+        if image_path and not persist:
+            _remember(key, base)
+    if persist and image_path and raw is None:
+        cache_manager.put_bytes('base_layers', key, base.tobytes(), '.rgb', tag=tag)
+
+    indices = None
+    raw = cache_manager.get_bytes('framebuffers', key)
+    if raw is not None and len(raw) == size[0] * size[1]:
+        indices = Image.frombytes('P', size, raw)
+        indices.putpalette(panel_palette().getpalette())
+    elif with_indices:
+        indices = _dither(base)
+        if image_path and persist:
+            cache_manager.put_bytes('framebuffers', key, indices.tobytes(), '.idx', tag=tag)
+    return base, indices
+
+
+def prefetch(image_path):
+    """Decode + normalize + dither a photo ahead of time (idle time after a refresh)."""
+    load_base(image_path, with_indices=True, persist=True)
+
+
+class Composition:
+    """A composed frame plus lazily computed, shared intermediates."""
+    def __init__(self, image, box, base=None, base_indices=None):
+        self.image = image # RGB composite (DISPLAY_WIDTH x DISPLAY_HEIGHT)
+        self.box = box # (x, y, w, h) of the weather widget
+        self.base = base # Photo layer under the widgets
+        self.base_indices = base_indices # Pre-dithered base layer
+        self._quantized = None
+        self._encoded = {}
+
+    @property
+    def widget_headers(self):
+        x, y, w, h = self.box
+        return {'X-Widget-X': x, 'X-Widget-Y': y, 'X-Widget-Width': w, 'X-Widget-Height': h}
+
+    def quantized(self):
+        """Floyd-Steinberg dither onto the panel palette ('P' image), done once."""
+        if self._quantized is None:
+            if self.base_indices is not None:
+                # Pre-dithered photo: re-dither only the regions the widgets changed
+                quantized = self.base_indices.copy()
+                w, h = self.image.size
+                for x0, y0, x1, y1 in _changed_regions(self.image, self.base):
+                    bbox = (max(0, x0 - DITHER_MARGIN), max(0, y0 - DITHER_MARGIN),
+                            min(w, x1 + DITHER_MARGIN), min(h, y1 + DITHER_MARGIN))
+                    quantized.paste(_dither(self.image.crop(bbox)), bbox[:2])
+                self._quantized = quantized
+            else:
+                self._quantized = _dither(self.image)
+        return self._quantized
+
+    def encoded(self, fmt='JPEG', quality=70):
+        key = (fmt, quality)
+        if key not in self._encoded:
+            buf = io.BytesIO()
+            self.image.save(buf, fmt, quality=quality)
+            self._encoded[key] = buf.getvalue()
+        return self._encoded[key]
+
+
+def compose(image_path, weather_data, dust_data, layout_config=None, location_name="위치 미설정", batt_info=None,
+            now=None, persist=False):
+    """Compose a frame. `persist` (wake path) writes a newly decoded base layer to the cache."""
+    base, base_indices = load_base(image_path, persist=persist)
+    img, box_x, box_y, box_w, box_h = renderer.create_composed_image(
+        image_path, weather_data, dust_data, layout_config, location_name, batt_info, base_layer=base, now=now)
+    return Composition(img.convert('RGB') if img.mode != 'RGB' else img, (box_x, box_y, box_w, box_h),
+                       base, base_indices)
+
+
+def write_atomic(path, data):
+    """The web server may be serving the previous file: temp + rename."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class EncodedImage:
+    """Preview encoding (JPEG / WebP). Returns bytes; also writes `path` if given."""
+    def __init__(self, name='preview', fmt='JPEG', quality=70, path=None):
+        self.name, self.fmt, self.quality, self.path = name, fmt.upper(), quality, path
+
+    def write(self, comp):
+        data = comp.encoded(self.fmt, self.quality)
+        if self.path:
+            write_atomic(self.path, data)
+        return data
+
+
+class PanelFramebuffer:
+    """Packed panel buffer (two pixels per byte, high nibble first), ready for epd.display()."""
+    name = 'framebuffer'
+
+    def write(self, comp):
+        indices = np.asarray(comp.quantized(), dtype=np.uint8)
+        codes = PANEL_CODES[indices]
+        packed = (codes[:, 0::2] << 4) | codes[:, 1::2]
+        return bytearray(packed.tobytes())
+
+
+class EinkPreview:
+    """PNG of the dithered frame, i.e. what the panel shows (palette colors, no smooth gradients)."""
+    def __init__(self, name='eink_preview', path=None):
+        self.name, self.path = name, path
+
+    def write(self, comp):
+        buf = io.BytesIO()
+        comp.quantized().save(buf, 'PNG', optimize=False) # Palette PNG: small and fast
+        data = buf.getvalue()
+        if self.path:
+            write_atomic(self.path, data)
+        return data
+
+
+class Thumbnail:
+    def __init__(self, name='thumbnail', size=320, quality=80, path=None):
+        self.name, self.size, self.quality, self.path = name, size, quality, path
+
+    def write(self, comp):
+        thumb = comp.image.copy()
+        thumb.thumbnail((self.size, self.size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        buf = io.BytesIO()
+        thumb.save(buf, 'JPEG', quality=self.quality)
+        data = buf.getvalue()
+        if self.path:
+            write_atomic(self.path, data)
+        return data
+
+
+def render(comp, sinks):
+    """Run every sink over one composition. Returns {sink.name: output}."""
+    return {sink.name: sink.write(comp) for sink in sinks}
@@ -1,4 +1,4 @@
-from PIL import Image, ImageDraw, ImageFont, ImageEnhance
+from PIL import Image, ImageDraw, ImageFont, ImageEnhance, ImageOps
 import os
 import logging
 from datetime import datetime
@@ -94,21 +94,27 @@ def _load_weather_icons(icon_dir):
                 pass
     return icons
 
-def create_composed_image(image_path, weather_data, dust_data, layout_config=None, location_name="위치 미설정", batt_info=None):
-    # Defaults
-    if layout_config is None: layout_config = {}
-    
-    # Load Image
+def load_base_layer(image_path):
+    """Decoded, cropped and enhanced photo at panel size (everything before the widgets)."""
     try:
         if image_path and os.path.exists(image_path):
             img = Image.open(image_path)
+            # Photos from the store are already upright; legacy uploads may still carry EXIF rotation
+            ImageOps.exif_transpose(img, in_place=True)
         else:
             img = Image.new('RGB', (DISPLAY_WIDTH, DISPLAY_HEIGHT), (200, 200, 200))
     except:
         img = Image.new('RGB', (DISPLAY_WIDTH, DISPLAY_HEIGHT), (200, 200, 200))
         
     img = resize_image_fill(img)
-    img = enhance_image(img)
+    return enhance_image(img)
+
+def create_composed_image(image_path, weather_data, dust_data, layout_config=None, location_name="위치 미설정", batt_info=None, base_layer=None, now=None):
+    # Defaults
+    if layout_config is None: layout_config = {}
+    
+    # Load Image (or reuse a prepared base layer, see render_sink.load_base)
+    img = base_layer if base_layer is not None else load_base_layer(image_path)
     
     # Overlay
     overlay = Image.new('RGBA', (DISPLAY_WIDTH, DISPLAY_HEIGHT), (255, 255, 255, 0))
@@ -190,10 +196,15 @@ def create_composed_image(image_path, weather_data, dust_data, layout_config=Non
         color_pm10 = c10
         color_pm25 = c25
 
-    # Time
-    now = datetime.now()
+    # Time (fixed `now` keeps golden-image comparisons deterministic)
+    now = now or datetime.now()
     # User Req: "12/18 05:30 기준" format
     time_str = now.strftime('%m/%d %H:%M 기준')
+    # Last known data served while the network was slow: show how old it is (e.g. "· 2시간 전")
+    ages = [d.get('age_min', 0) for d in (weather_data, dust_data) if d and d.get('stale')]
+    if ages:
+        age = max(ages)
+        time_str += f" · {age // 60}시간 전" if age >= 60 else f" · {age}분 전"
     
     # Battery String (Optional in Main Widget, typically not shown but can be added if needed)
     # User only requested Popup.
@@ -404,15 +415,17 @@ def create_daily_summary_widget(weather_data):
     
     return img
 
+def battery_alert_shown(batt_info):
+    """True when create_battery_alert_widget draws the popup (< 15% and NOT charging)."""
+    return bool(batt_info) and batt_info.get('level', 100) < 15 and not batt_info.get('charging', False)
+
 def create_battery_alert_widget(batt_info):
     """
     Creates a popup if battery is < 15% and NOT charging
     """
-    level = batt_info.get('level', 100)
-    charging = batt_info.get('charging', False)
-    
-    if level >= 15 or charging:
+    if not battery_alert_shown(batt_info):
         return None
+    level = batt_info.get('level', 100)
         
     message = f"🪫 배터리 부족 ({int(level)}%), 충전해 주세요!"
     
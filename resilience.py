@@ -0,0 +1,236 @@
+import json
+import time
+import random
+import logging
+import threading
+import xml.etree.ElementTree as ET
+
+try:
+    from utils.logger import log_debug
+except ImportError:
+    log_debug = lambda msg, level='info': None # Fallback
+
+logger = logging.getLogger(__name__)
+
+# --- [Resilience: deadlines, retries, circuit breakers] ---
+# Worst case used to be 10 outer attempts x 3 retries x 30 s timeout, far past a 3-minute wake.
+#   Deadline        one overall time budget, passed down through data_api / AI calls; every
+#                   attempt's timeout and every backoff sleep is clipped to what is left
+#   call()          attempts with exponential backoff + full jitter, retrying only errors
+#                   that can succeed on retry (network, 5xx, 429, transient KMA codes)
+#   CircuitBreaker  per endpoint: after `failure_threshold` consecutive failures the endpoint
+#                   fails fast for `reset_sec`, then one trial call decides (half-open)
+#   check_response  HTTP errors vs data.go.kr error bodies: the gateway answers key / quota
+#                   problems with HTTP 200 and an XML <OpenAPI_ServiceResponse> (SERVICE_KEY...)
+#                   even when JSON was requested; JSON bodies carry header.resultCode
+# Every attempt is logged as one structured line: "RESILIENCE {json}".
+
+DEFAULT_ATTEMPTS = 3
+BASE_DELAY = 0.5
+MAX_DELAY = 8.0
+FAILURE_THRESHOLD = 3
+RESET_SEC = 60
+
+# data.go.kr gateway returnReasonCode -> (kind, retryable)
+GATEWAY_CODES = {
+    '1': ('application', True),       # APPLICATION_ERROR
+    '4': ('http', True),              # HTTP_ERROR
+    '12': ('config', False),          # NO_OPENAPI_SERVICE_ERROR
+    '20': ('auth', False),            # SERVICE_ACCESS_DENIED_ERROR
+    '22': ('quota', False),           # LIMITED_NUMBER_OF_SERVICE_REQUESTS_EXCEEDS_ERROR
+    '30': ('auth', False),            # SERVICE_KEY_IS_NOT_REGISTERED_ERROR
+    '31': ('auth', False),            # DEADLINE_HAS_EXPIRED_ERROR (key expired)
+    '32': ('auth', False),            # UNREGISTERED_IP_ERROR
+}
+# JSON header.resultCode (KMA / AirKorea) -> (kind, retryable); '00' is success
+RESULT_CODES = {
+    '01': ('application', True), '02': ('application', True), '03': ('no_data', False),
+    '04': ('http', True), '05': ('timeout', True), '10': ('request', False), '11': ('request', False),
+    '12': ('config', False), '20': ('auth', False), '21': ('request', False), '22': ('quota', False),
+    '30': ('auth', False), '31': ('auth', False), '32': ('auth', False), '99': ('application', True),
+}
+
+
+class UpstreamError(Exception):
+    """A failed upstream attempt: `kind` (http, auth, quota, network, ...) and whether to retry."""
+    def __init__(self, message, kind='application', retryable=True, status=None):
+        super().__init__(message)
+        self.kind, self.retryable, self.status = kind, retryable, status
+
+
+class CircuitOpen(UpstreamError):
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name}: circuit open (retry in {retry_in:.0f}s)", kind='circuit_open', retryable=False)
+
+
+class DeadlineExceeded(UpstreamError):
+    def __init__(self, name):
+        super().__init__(f"{name}: deadline exceeded", kind='deadline', retryable=False)
+
+
+class Deadline:
+    """Overall time budget shared by every call made on behalf of one operation."""
+    def __init__(self, seconds=None):
+        self.expires = time.monotonic() + seconds if seconds is not None else None
+
+    @classmethod
+    def of(cls, value):
+        """Deadline, seconds, or None (no limit) -> Deadline."""
+        return value if isinstance(value, Deadline) else cls(value)
+
+    def remaining(self):
+        return None if self.expires is None else max(0.0, self.expires - time.monotonic())
+
+    def expired(self):
+        return self.expires is not None and time.monotonic() >= self.expires
+
+    def timeout(self, cap):
+        """Per-attempt timeout: `cap`, but never past the deadline."""
+        remaining = self.remaining()
+        return cap if remaining is None else min(cap, remaining)
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, reset_sec=RESET_SEC):
+        self.name = name
+        self.failure_threshold, self.reset_sec = failure_threshold, reset_sec
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half_open' if time.monotonic() - self.opened_at >= self.reset_sec else 'open'
+
+    def allow(self):
+        """Raise CircuitOpen while open; let one trial call through once reset_sec has passed."""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return
+            if state == 'half_open' and not self._trial:
+                self._trial = True
+                return
+            raise CircuitOpen(self.name, max(0.0, self.reset_sec - (time.monotonic() - self.opened_at)))
+
+    def record(self, success):
+        with self._lock:
+            self._trial = False
+            if success:
+                self.failures, self.opened_at = 0, None
+                return
+            self.failures += 1
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                if self.opened_at is None:
+                    log_debug(f"RESILIENCE | {self.name}: circuit opened after {self.failures} failures", level='warning')
+                self.opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(name):
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def reset_breakers():
+    """Forget every breaker (a fresh process / benchmark run)."""
+    with _breakers_lock:
+        _breakers.clear()
+
+
+def breaker_states():
+    with _breakers_lock:
+        return {name: {'state': b.state, 'failures': b.failures} for name, b in _breakers.items()}
+
+
+def check_response(res):
+    """Raise UpstreamError for HTTP errors and data.go.kr error bodies; return `res` otherwise."""
+    if res.status_code != 200:
+        retryable = res.status_code >= 500 or res.status_code == 429
+        raise UpstreamError(f"HTTP {res.status_code}", kind='http', retryable=retryable, status=res.status_code)
+    head = res.content[:512].lstrip()
+    if head.startswith(b'<') and b'OpenAPI_ServiceResponse' in res.content[:2048]:
+        try:
+            root = ET.fromstring(res.content)
+            code = (root.findtext('.//returnReasonCode') or '').strip()
+            msg = (root.findtext('.//returnAuthMsg') or root.findtext('.//errMsg') or 'SERVICE ERROR').strip()
+        except ET.ParseError:
+            code, msg = '', 'unparsable gateway error'
+        kind, retryable = GATEWAY_CODES.get(code.lstrip('0') or code, ('application', True))
+        raise UpstreamError(f"{msg} ({code})", kind=kind, retryable=retryable, status=200)
+    if head.startswith(b'{'):
+        try:
+            header = res.json().get('response', {}).get('header', {})
+        except (ValueError, AttributeError):
+            return res
+        code = str(header.get('resultCode', '00'))
+        if code not in ('00', '0'):
+            kind, retryable = RESULT_CODES.get(code, ('application', True))
+            raise UpstreamError(f"{header.get('resultMsg', 'ERROR')} ({code})", kind=kind, retryable=retryable, status=200)
+    return res
+
+
+def _log(name, attempt, outcome, t0, deadline, error=None, status=None):
+    record = {'endpoint': name, 'attempt': attempt, 'outcome': outcome,
+              'latency_ms': int((time.monotonic() - t0) * 1000)}
+    if status is not None: record['status'] = status
+    if error is not None: record['error'] = str(error)[:200]
+    remaining = deadline.remaining()
+    if remaining is not None: record['remaining_s'] = round(remaining, 1)
+    log_debug("RESILIENCE " + json.dumps(record, ensure_ascii=False),
+              level='info' if outcome == 'ok' else 'warning')
+
+
+def call(name, fn, deadline=None, attempts=DEFAULT_ATTEMPTS, timeout=30, check=None,
+         base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+    """
+    fn(timeout) with retries under `deadline` and the `name` circuit breaker.
+    `check(result)` raises UpstreamError for bad results (e.g. check_response).
+    Returns the result; raises the last UpstreamError when every attempt failed.
+    """
+    deadline = Deadline.of(deadline)
+    circuit = breaker(name)
+    last = None
+    for attempt in range(1, attempts + 1):
+        if deadline.expired():
+            last = DeadlineExceeded(name)
+            _log(name, attempt, 'deadline', time.monotonic(), deadline, last)
+            break
+        t0 = time.monotonic()
+        try:
+            circuit.allow()
+        except CircuitOpen as e: # Fail fast, no attempt made
+            _log(name, attempt, e.kind, t0, deadline, e)
+            raise
+        try:
+            result = fn(deadline.timeout(timeout))
+            if check: check(result)
+        except UpstreamError as e:
+            last = e
+        except Exception as e: # Timeouts, DNS, connection resets
+            last = UpstreamError(f"{type(e).__name__}: {e}", kind='network', retryable=True)
+        else:
+            circuit.record(True)
+            _log(name, attempt, 'ok', t0, deadline, status=getattr(result, 'status_code', None))
+            return result
+
+        circuit.record(last.kind == 'no_data') # Not published yet: the endpoint itself is fine
+        _log(name, attempt, last.kind, t0, deadline, last, last.status)
+        if not last.retryable or attempt == attempts:
+            break
+        # Exponential backoff with full jitter, never sleeping past the deadline
+        delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+        remaining = deadline.remaining()
+        if remaining is not None and delay >= remaining:
+            last = DeadlineExceeded(name)
+            break
+        time.sleep(delay)
+    raise last
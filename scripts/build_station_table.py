@@ -0,0 +1,41 @@
+"""
+Build the AirKorea station table (settings.STATIONS_DB_PATH, my_frame_web/stations.db) from getMsrstnList.
+
+    python scripts/build_station_table.py                # AirKorea key from config.json
+    python scripts/build_station_table.py --key KEY
+
+Needed once (the web UI also builds it in the background on the first location save);
+rerun when stations are added or moved.
+"""
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import settings
+import stations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the AirKorea station table")
+    parser.add_argument('--key', help="AirKorea (data.go.kr) service key")
+    args = parser.parse_args()
+
+    config = settings.load_config()
+    key = args.key or config.get('api_key_air', config.get('api_key'))
+    if not key:
+        print("No AirKorea key (config api_key_air or --key)")
+        return 1
+    count = stations.build_table(key)
+    print(f"Stored {count} stations in {settings.STATIONS_DB_PATH}")
+    loc = config.get('location', {})
+    if count and loc:
+        nx, ny = int(loc.get('nx', 61)), int(loc.get('ny', 115))
+        for name, dist in stations.nearest(nx, ny):
+            print(f"  {name:12s} {dist * 5:5.1f} km from {loc.get('name', '')} ({nx},{ny})")
+    return 0 if count else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
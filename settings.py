@@ -8,7 +8,30 @@ CONFIG_PATH = os.path.join(WEB_DIR, 'config.json')
 UPLOADS_DIR = os.path.join(WEB_DIR, 'uploads')
 STATIC_DIR = os.path.join(WEB_DIR, 'static')
 PREVIEW_PATH = os.path.join(STATIC_DIR, 'preview.jpg')
+PREVIEW_EINK_PATH = os.path.join(STATIC_DIR, 'preview_eink.png') # Dithered: what the panel shows
+PREVIEW_THUMB_PATH = os.path.join(STATIC_DIR, 'preview_thumb.jpg')
 DB_PATH = os.path.join(BASE_DIR, 'korea_zone.db')
+# Content-addressed photo storage (sharded by hash prefix) + name -> hash index
+PHOTO_STORE_DIR = os.path.join(WEB_DIR, 'photo_store')
+PHOTO_INDEX_PATH = os.path.join(WEB_DIR, 'photo_index.json')
+SHUFFLE_DECK_PATH = os.path.join(WEB_DIR, 'shuffle_deck.json')
+# Derived artifacts (thumbnails, base layers, framebuffers, API responses) under one disk budget
+CACHE_DIR = os.path.join(WEB_DIR, 'cache')
+CACHE_DB_PATH = os.path.join(WEB_DIR, 'cache.db')
+# Last successful weather / dust payloads (served stale while a refresh runs)
+LAST_DATA_PATH = os.path.join(WEB_DIR, 'last_data.json')
+# AirKorea stations (name, position on the KMA grid), built from getMsrstnList; not korea_zone.db,
+# which is tracked by git and must stay unmodified for `git pull` updates
+STATIONS_DB_PATH = os.path.join(WEB_DIR, 'stations.db')
+# AirKorea station that answered, per location (asked alone until it stops answering)
+STATION_CACHE_PATH = os.path.join(WEB_DIR, 'station_cache.json')
+# Full multi-day forecast kept for wakes that stay offline
+FORECAST_STORE_PATH = os.path.join(WEB_DIR, 'forecast_store.json')
+# Next wake's frame, rendered from forecast data before shutdown (panel buffer + previews + meta)
+NEXT_FRAME_DIR = os.path.join(WEB_DIR, 'next_frame')
+# Watched import folder (bulk copy over SMB/USB) + processed-file state for incremental scans
+IMPORT_DIR = os.path.join(WEB_DIR, 'import')
+IMPORT_STATE_PATH = os.path.join(WEB_DIR, 'import_state.json')
 
 # --- 기본 설정값 ---
 DEFAULT_CONFIG = {
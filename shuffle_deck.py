@@ -0,0 +1,174 @@
+import os
+import json
+import random
+import hashlib
+import logging
+import threading
+
+import settings
+import photo_store
+
+logger = logging.getLogger(__name__)
+
+# --- [Persistent Shuffle Deck] ---
+# Instead of random.choice() over the playlist on every wake (one stat per entry,
+# repeats possible), the frame deals from a pre-shuffled deck stored next to config.json:
+#   - next_photo() is O(1): read order[pos], advance pos
+#   - no repeats until every photo in the deck has been shown once
+#   - deleted photos are dropped lazily when they come up
+#   - new uploads are inserted at a random position in the undealt part
+# Optional weighting when a deck is (re)built: never-shown photos and favorites come earlier.
+
+NEVER_SHOWN_WEIGHT = 3.0
+FAVORITE_WEIGHT = 2.0
+
+_lock = threading.Lock()
+
+
+def _empty_deck():
+    return {"version": 1, "source": None, "signature": None, "order": [], "pos": 0,
+            "shown": {}, "last": None}
+
+
+def load_deck():
+    try:
+        with open(settings.SHUFFLE_DECK_PATH, 'r', encoding='utf-8') as f:
+            deck = json.load(f)
+        for k, v in _empty_deck().items():
+            deck.setdefault(k, v)
+        return deck
+    except FileNotFoundError:
+        return _empty_deck()
+    except Exception as e:
+        logger.warning(f"Shuffle deck unreadable, rebuilding: {e}")
+        return _empty_deck()
+
+
+def save_deck(deck):
+    tmp_path = settings.SHUFFLE_DECK_PATH + '.tmp'
+    try:
+        os.makedirs(os.path.dirname(settings.SHUFFLE_DECK_PATH), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(deck, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, settings.SHUFFLE_DECK_PATH)
+    except Exception as e:
+        logger.error(f"Shuffle deck save failed: {e}")
+        if os.path.exists(tmp_path):
+            try: os.remove(tmp_path)
+            except: pass
+
+
+def _source_for(config):
+    """('playlist', names) if a shuffle playlist is set, else ('all', None) (resolved lazily)."""
+    playlist = config.get('shuffle_playlist') or []
+    if playlist:
+        return 'playlist', list(dict.fromkeys(playlist))
+    return 'all', None
+
+
+def _signature(source, names):
+    if source == 'all':
+        return 'all'
+    return hashlib.sha1("\n".join(sorted(names)).encode('utf-8')).hexdigest()
+
+
+def _weighted_order(names, deck, config):
+    """Weighted random permutation (Efraimidis-Spirakis keys: u ** (1 / w))."""
+    if not config.get('shuffle_weighting', True):
+        order = list(names)
+        random.shuffle(order)
+        return order
+
+    favorites = set(config.get('favorite_photos') or [])
+    shown = deck.get('shown', {})
+
+    def key(name):
+        w = 1.0
+        if not shown.get(name): w *= NEVER_SHOWN_WEIGHT
+        if name in favorites: w *= FAVORITE_WEIGHT
+        return random.random() ** (1.0 / w)
+
+    return sorted(names, key=key, reverse=True)
+
+
+def _rebuild(deck, config, source, names):
+    if names is None:
+        names = photo_store.list_photos()
+    order = _weighted_order(names, deck, config)
+
+    deck['source'] = source
+    deck['signature'] = _signature(source, names)
+    deck['order'] = order
+    deck['pos'] = 0
+    members = set(order)
+    deck['shown'] = {n: c for n, c in deck.get('shown', {}).items() if n in members}
+    logger.info(f"🃏 Shuffle deck rebuilt ({source}, {len(order)} photos)")
+
+
+def _draw(deck, config, advance):
+    source, names = _source_for(config)
+    if deck.get('signature') != _signature(source, names or []):
+        _rebuild(deck, config, source, names) # Playlist changed (or first run)
+
+    rebuilt = False
+    while True:
+        if deck['pos'] >= len(deck['order']):
+            if rebuilt: return None # Nothing valid left
+            _rebuild(deck, config, source, names)
+            rebuilt = True
+            if not deck['order']: return None
+
+        name = deck['order'][deck['pos']]
+        if photo_store.contains(name):
+            # Don't deal the photo that was just on screen as the first card of a new deck
+            if deck['pos'] == 0 and name == deck.get('last') and len(deck['order']) > 1:
+                deck['order'].append(deck['order'].pop(0))
+                name = deck['order'][0]
+                if not photo_store.contains(name): continue
+            if advance:
+                deck['pos'] += 1
+            return name
+
+        # Lazy removal of deleted photos
+        del deck['order'][deck['pos']]
+
+
+def next_photo(config):
+    """Deal the next photo name from the persistent deck (None if there are no photos)."""
+    with _lock:
+        deck = load_deck()
+        name = _draw(deck, config, advance=True)
+        if name:
+            deck['shown'][name] = deck['shown'].get(name, 0) + 1
+            deck['last'] = name
+        save_deck(deck)
+        return name
+
+
+def peek_next(config):
+    """Name that next_photo() would return, without dealing it (read-only unless the deck is rebuilt)."""
+    with _lock:
+        deck = load_deck()
+        order = deck['order']
+        name = _draw(deck, config, advance=False)
+        if deck['order'] is not order:
+            save_deck(deck) # A rebuild is random: keep it, so next_photo() deals the peeked photo
+        return name
+
+
+def insert(name, config=None):
+    """Insert a new upload at a random position in the undealt part of an 'all photos' deck."""
+    if config is None:
+        config = settings.load_config()
+    source, _ = _source_for(config)
+    if source != 'all':
+        return # Playlist decks only contain what the user picked
+    with _lock:
+        deck = load_deck()
+        if deck.get('source') != 'all' or name in deck['order'][deck['pos']:]:
+            return
+        idx = random.randint(deck['pos'], len(deck['order']))
+        deck['order'].insert(idx, name)
+        save_deck(deck)
@@ -0,0 +1,228 @@
+import os
+import json
+import math
+import time
+import sqlite3
+import logging
+import threading
+
+import settings
+import data_api
+
+try:
+    from utils.logger import log_debug
+except ImportError:
+    log_debug = lambda msg, level='info': None # Fallback
+
+logger = logging.getLogger(__name__)
+
+# --- [AirKorea Stations: nearest-station index] ---
+# The station used to be guessed from the last word of the dong name, which often is no station
+# at all (empty items every wake). Instead:
+#   stations table    STATIONS_DB_PATH, built from AirKorea getMsrstnList (build_table(), also
+#                     scripts/build_station_table.py): name, address, WGS84 lat/lon and the
+#                     position on the KMA 5 km grid (same space as the locations' nx / ny)
+#   StationIndex      uniform-grid buckets over that plane; nearest(x, y, k) searches rings of
+#                     cells outward until no closer station can remain
+#   for_location()    dust candidates for a location, nearest first. data_api queries them
+#                     concurrently and keeps the nearest valid reading; the station that worked
+#                     is remembered per location (STATION_CACHE_PATH) and asked alone next time
+# Without a table (not built yet / no key) the configured station_name is used as before.
+
+STATION_LIST_PATH = "/B552584/MsrstnInfoInqireSvc/getMsrstnList"
+CANDIDATES = 3      # Stations queried when none is known to work for the location
+CELL = 8.0          # Index cell size in KMA grid units (5 km): 40 km
+
+# KMA Lambert conformal conic grid (동네예보 격자, 5 km)
+_RE, _GRID = 6371.00877, 5.0
+_SLAT1, _SLAT2, _OLON, _OLAT = 30.0, 60.0, 126.0, 38.0
+_XO, _YO = 43, 136
+
+_lock = threading.Lock()
+_index = {'mtime': None, 'index': None}
+
+
+def to_grid(lat, lon):
+    """WGS84 -> continuous KMA grid position (rounding gives the nx / ny of getVilageFcst)."""
+    deg = math.pi / 180.0
+    re = _RE / _GRID
+    slat1, slat2, olon, olat = _SLAT1 * deg, _SLAT2 * deg, _OLON * deg, _OLAT * deg
+    sn = math.log(math.cos(slat1) / math.cos(slat2)) / \
+        math.log(math.tan(math.pi * 0.25 + slat2 * 0.5) / math.tan(math.pi * 0.25 + slat1 * 0.5))
+    sf = math.tan(math.pi * 0.25 + slat1 * 0.5) ** sn * math.cos(slat1) / sn
+    ro = re * sf / math.tan(math.pi * 0.25 + olat * 0.5) ** sn
+    ra = re * sf / math.tan(math.pi * 0.25 + lat * deg * 0.5) ** sn
+    theta = lon * deg - olon
+    if theta > math.pi: theta -= 2.0 * math.pi
+    if theta < -math.pi: theta += 2.0 * math.pi
+    theta *= sn
+    return ra * math.sin(theta) + _XO, ro - ra * math.cos(theta) + _YO
+
+
+class StationIndex:
+    """Stations bucketed by CELL x CELL grid cells for k-nearest queries."""
+    def __init__(self, rows, cell=CELL):
+        self.cell = cell
+        self.buckets = {}
+        for name, x, y in rows:
+            self.buckets.setdefault(self._key(x, y), []).append((name, x, y))
+        self.size = len(rows)
+
+    def _key(self, x, y):
+        return int(math.floor(x / self.cell)), int(math.floor(y / self.cell))
+
+    def nearest(self, x, y, k=CANDIDATES):
+        """[(name, distance in grid units)] of the k nearest stations, nearest first."""
+        if not self.size:
+            return []
+        cx, cy = self._key(x, y)
+        found = []
+        ring = 0
+        while True:
+            for i in range(cx - ring, cx + ring + 1):
+                for j in range(cy - ring, cy + ring + 1):
+                    if max(abs(i - cx), abs(j - cy)) != ring:
+                        continue # Inner cells were searched in earlier rings
+                    for name, sx, sy in self.buckets.get((i, j), ()):
+                        found.append((math.hypot(sx - x, sy - y), name))
+            found.sort()
+            # Anything outside the searched square is at least `ring * cell` away
+            if len(found) >= min(k, self.size) and found[min(k, len(found)) - 1][0] <= ring * self.cell:
+                break
+            if len(found) == self.size:
+                break
+            ring += 1
+        return [(name, d) for d, name in found[:k]]
+
+
+def _connect():
+    os.makedirs(os.path.dirname(settings.STATIONS_DB_PATH), exist_ok=True)
+    return sqlite3.connect(settings.STATIONS_DB_PATH)
+
+
+def table_size():
+    try:
+        with _connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM stations").fetchone()[0]
+    except sqlite3.Error:
+        return 0
+
+
+def build_table(api_key, deadline=None):
+    """(Re)build the stations table from getMsrstnList. Returns the number of stations stored."""
+    api_key = data_api._decode_key(api_key)
+    if not api_key:
+        return 0
+    params = {'serviceKey': api_key, 'returnType': 'json', 'numOfRows': '1000', 'pageNo': '1'}
+    res = data_api.fetch_with_retry(data_api.api_url(STATION_LIST_PATH), params, label="Station List",
+                                    deadline=deadline)
+    try:
+        items = res.json()['response']['body']['items'] if res else []
+    except (ValueError, KeyError, TypeError):
+        items = []
+    rows = []
+    for item in items:
+        try:
+            a, b = float(item['dmX']), float(item['dmY'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        lat, lon = (a, b) if a < b else (b, a) # dmX is the latitude; tolerate swapped fields
+        x, y = to_grid(lat, lon)
+        rows.append((item['stationName'], item.get('addr', ''), lat, lon, x, y))
+    if not rows:
+        log_debug("Station List: no stations received", level='warning')
+        return 0
+    with _connect() as conn:
+        conn.execute("""CREATE TABLE IF NOT EXISTS stations
+                        (name TEXT PRIMARY KEY, addr TEXT, lat REAL, lon REAL, x REAL, y REAL)""")
+        conn.execute("DELETE FROM stations")
+        conn.executemany("INSERT OR REPLACE INTO stations VALUES (?, ?, ?, ?, ?, ?)", rows)
+    log_debug(f"Station List: stored {len(rows)} stations")
+    return len(rows)
+
+
+def ensure_table(api_key):
+    """Build the table in the background if it is still empty (first save with an AirKorea key)."""
+    if not api_key or table_size():
+        return
+    threading.Thread(target=build_table, args=(api_key,), daemon=True, name='stations').start()
+
+
+def get_index():
+    """StationIndex over the stations table (rebuilt when the stations database changes)."""
+    try:
+        mtime = os.path.getmtime(settings.STATIONS_DB_PATH)
+    except OSError:
+        return StationIndex([])
+    with _lock:
+        if _index['mtime'] != mtime:
+            try:
+                with _connect() as conn:
+                    rows = conn.execute("SELECT name, x, y FROM stations").fetchall()
+            except sqlite3.Error:
+                rows = []
+            _index['mtime'], _index['index'] = mtime, StationIndex(rows)
+        return _index['index']
+
+
+def nearest(nx, ny, k=CANDIDATES):
+    return get_index().nearest(float(nx), float(ny), k)
+
+
+def _load_cache():
+    try:
+        with open(settings.STATION_CACHE_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache):
+    """Atomic write (temp + rename), same pattern as settings.save_config."""
+    os.makedirs(os.path.dirname(settings.STATION_CACHE_PATH), exist_ok=True)
+    tmp_path = f"{settings.STATION_CACHE_PATH}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(tmp_path, settings.STATION_CACHE_PATH)
+    except Exception as e:
+        logger.error(f"Station cache save failed: {e}")
+        try: os.remove(tmp_path)
+        except OSError: pass
+
+
+def working_station(nx, ny):
+    return (_load_cache().get(f"{nx},{ny}") or {}).get('station')
+
+
+def for_location(nx, ny, configured=None):
+    """Dust station candidates for a location, nearest first (one when a station is known to work)."""
+    known = working_station(nx, ny)
+    if known:
+        return [known]
+    names = [name for name, _ in nearest(nx, ny)]
+    if not names:
+        return [configured] if configured else [] # No table yet: the configured / guessed name
+    if configured in names:
+        names.remove(configured)
+        names.insert(0, configured)
+    return names
+
+
+def record(nx, ny, candidates, dust):
+    """Remember the station that answered; forget a remembered one that stopped answering."""
+    key = f"{nx},{ny}"
+    with _lock:
+        cache = _load_cache()
+        known = (cache.get(key) or {}).get('station')
+        if dust and dust.get('station'):
+            if known == dust['station']:
+                return
+            cache[key] = {'station': dust['station'], 'verified_at': time.time()}
+            log_debug(f"Station for {key}: {dust['station']}")
+        elif known and candidates == [known]:
+            cache.pop(key, None) # Next fetch asks the nearest candidates again
+            log_debug(f"Station {known} gave no reading for {key}, candidates next time", level='warning')
+        else:
+            return
+        _save_cache(cache)